@@ -0,0 +1,170 @@
+"""
+负载自适应输入尺寸
+突发流量下按当前排队深度和最近的延迟逐级降低推理尺寸 (如 640 -> 512 -> 416 -> 320)，
+用少量精度换吞吐，而不是让请求排队到 gunicorn 的 120 秒超时：
+
+- 排队: 同时在途的请求数超出 ADAPTIVE_CAPACITY (能并行推理的数量) 后，每多 ADAPTIVE_QUEUE_STEP 个降一级，随排队立即生效
+- 延迟: 最近 ADAPTIVE_WINDOW 秒的 p95 超过 ADAPTIVE_TARGET_P95_MS 时降一级，低于目标的一半时升一级；
+  两次调整至少间隔 ADAPTIVE_COOLDOWN 秒，避免在两个尺寸之间来回抖动
+- 实际级别取两者中较低的尺寸；客户端可用 min_input_size 指定可接受的最小尺寸
+
+尺寸档位只取不超过检测器 input_size 的部分，空闲时始终按 input_size 推理，结果与关闭时相同。
+状态按进程统计，gunicorn 多worker时每个worker各自调整
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import ADAPTIVE_INPUT_SIZE
+
+ADAPTIVE_RESOLUTION = os.getenv('ADAPTIVE_RESOLUTION', '1') == '1'
+ADAPTIVE_SIZES = os.getenv('ADAPTIVE_SIZES', '640,512,416,320')              # 尺寸档位 (32的倍数)
+ADAPTIVE_TARGET_P95_MS = float(os.getenv('ADAPTIVE_TARGET_P95_MS', 2000))   # 目标p95延迟 (毫秒)
+ADAPTIVE_CAPACITY = int(os.getenv('ADAPTIVE_CAPACITY', 1))                  # 能并行推理的请求数 (推理锁串行时为1)
+ADAPTIVE_QUEUE_STEP = int(os.getenv('ADAPTIVE_QUEUE_STEP', 2))              # 每多少个排队请求降一级
+ADAPTIVE_WINDOW = float(os.getenv('ADAPTIVE_WINDOW', 30))                   # 延迟统计窗口 (秒)
+ADAPTIVE_COOLDOWN = float(os.getenv('ADAPTIVE_COOLDOWN', 5))                # 两次延迟调整的最小间隔 (秒)
+
+
+def parse_sizes(spec):
+    """解析尺寸档位，向下取整到32的倍数 (模型步长)，去重并从大到小排序"""
+    sizes = {int(item) // 32 * 32 for item in (spec or '').split(',') if item.strip()}
+    return sorted((size for size in sizes if size > 0), reverse=True)
+
+
+def parse_min_size(value):
+    """解析客户端的 min_input_size，空值返回None，不是正整数时抛出 ValueError"""
+    if value is None or value == '':
+        return None
+    size = int(value)
+    if size <= 0:
+        raise ValueError(f"min_input_size 必须为正整数: {value!r}")
+    return size
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class ResolutionController:
+    """with controller.request(detector.input_size, min_size) as request: ... 按 request.size 推理"""
+
+    def __init__(self, sizes=None, target_p95_ms=ADAPTIVE_TARGET_P95_MS, capacity=ADAPTIVE_CAPACITY,
+                 queue_step=ADAPTIVE_QUEUE_STEP, window=ADAPTIVE_WINDOW, cooldown=ADAPTIVE_COOLDOWN,
+                 enabled=ADAPTIVE_RESOLUTION, max_samples=500):
+        self.sizes = parse_sizes(ADAPTIVE_SIZES) if sizes is None else sorted(sizes, reverse=True)
+        self.target_p95_ms = target_p95_ms
+        self.capacity = max(1, capacity)
+        self.queue_step = max(1, queue_step)
+        self.window = window
+        self.cooldown = cooldown
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=max_samples)  # (完成时间, 延迟毫秒)
+        self._last_adjust = 0.0
+        self.in_flight = 0
+        self.latency_level = 0  # 延迟决定的降级级数
+        self.queue_level = 0    # 最近一次按排队深度计算的降级级数
+        self.degraded = 0
+        self.pinned = 0         # 因 min_input_size 没有降到控制器选择的尺寸的请求数
+        self.counts = {}
+
+    def ladder(self, top):
+        """不超过 top 的尺寸档位，第一档为 top 本身"""
+        return [top] + [size for size in self.sizes if size < top]
+
+    def request(self, top, min_size=None, adjustable=True):
+        """在途请求的上下文；adjustable=False (固定输入尺寸的模型) 时始终为 top"""
+        return _Request(self, top, min_size, adjustable and self.enabled)
+
+    def _begin(self, top, min_size, adjustable):
+        with self._lock:
+            self.in_flight += 1
+            if not adjustable:
+                return top
+            ladder = self.ladder(top)
+            self.queue_level = max(0, self.in_flight - self.capacity) // self.queue_step
+            level = min(len(ladder) - 1, max(self.latency_level, self.queue_level))
+            size = ladder[level]
+            if min_size and size < min_size:
+                # 取满足客户端最小尺寸的最小档位 (最大为 top)
+                size = min(candidate for candidate in ladder if candidate >= min(min_size, top))
+                self.pinned += 1
+            if size != top:
+                self.degraded += 1
+            self.counts[size] = self.counts.get(size, 0) + 1
+        ADAPTIVE_INPUT_SIZE.inc(size=size)
+        return size
+
+    def _end(self, top, latency_ms, record):
+        now = time.monotonic()
+        with self._lock:
+            self.in_flight -= 1
+            if not record:
+                return
+            self._samples.append((now, latency_ms))
+            if now - self._last_adjust < self.cooldown:
+                return
+            p95 = self._p95(now)
+            if p95 is None:
+                return
+            # 级别不超过本请求实际使用的档位数，否则顶档之下的多余级别要多次回升才生效
+            level = min(self.latency_level, len(self.ladder(top)) - 1)
+            if p95 > self.target_p95_ms and level < len(self.ladder(top)) - 1:
+                self.latency_level = level + 1
+                self._last_adjust = now
+            elif p95 < self.target_p95_ms / 2 and level > 0:
+                self.latency_level = level - 1
+                self._last_adjust = now
+            else:
+                return
+            # 调整后旧尺寸的延迟不再有参考价值
+            self._samples.clear()
+
+    def _p95(self, now):
+        while self._samples and now - self._samples[0][0] > self.window:
+            self._samples.popleft()
+        return percentile([latency for _, latency in self._samples], 0.95)
+
+    def stats(self):
+        with self._lock:
+            p95 = self._p95(time.monotonic())
+            return {
+                'enabled': self.enabled,
+                'sizes': list(self.sizes),
+                'target_p95_ms': self.target_p95_ms,
+                'recent_p95_ms': round(p95, 1) if p95 is not None else None,
+                'in_flight': self.in_flight,
+                'latency_level': self.latency_level,
+                'queue_level': self.queue_level,
+                'degraded_requests': self.degraded,
+                'pinned_requests': self.pinned,
+                'requests_by_size': {str(size): count for size, count in sorted(self.counts.items(), reverse=True)},
+            }
+
+
+class _Request:
+    __slots__ = ('controller', 'top', 'min_size', 'adjustable', 'size', 'started', 'record')
+
+    def __init__(self, controller, top, min_size, adjustable):
+        self.controller = controller
+        self.top = top
+        self.min_size = min_size
+        self.adjustable = adjustable
+        self.size = top
+        self.record = True  # 缓存命中等没有推理的请求设为False，不计入延迟统计
+
+    def __enter__(self):
+        self.size = self.controller._begin(self.top, self.min_size, self.adjustable)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        latency_ms = (time.perf_counter() - self.started) * 1000
+        self.controller._end(self.top, latency_ms, self.record and exc_type is None)
+        return False
@@ -1,26 +1,88 @@
+import time
+_IMPORT_STARTED = time.perf_counter()  # 冷启动耗时统计的起点
+
 import os
-import cv2
-import numpy as np
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
 from datetime import datetime
 import base64
+import json
 import traceback
-import gc
+import threading
 import sys
+from detection_utils import (letterbox, batch_letterbox_shape, unletterbox_boxes,
+                             decode_image_reduced, restore_decode_scale, split_batches, batch_limit,
+                             build_predictions, count_predictions, is_columnar_format, is_enabled)
+from micro_batching import MicroBatcher
+from frame_stream import (ChangeGate, FrameError, StreamStats, iter_multipart_frames, parse_boundary,
+                          stream_results)
+from tiled_inference import run_tiled
+from inference_backends import create_backend, default_backend_name
+from result_cache import DetectionCache, SingleFlight, file_identity
+from wire_format import RAW_UPLOAD_MAX_MB, accepted_format, encode_result, is_raw_upload, raw_upload_limit, read_raw_body
+from lifecycle import FAST_START, ServiceState, load_detector
+from memory_governor import MemoryGovernor, MemoryPressureError
+from input_buffers import create_input_pool
+from adaptive_resolution import ResolutionController, parse_min_size
+from model_registry import DEFAULT_MODEL_NAME, MODELS, ModelLoadError, ModelRegistry, UnknownModelError, parse_models
+from metrics import (REGISTRY, CONTENT_TYPE, Gauge, REQUESTS, ERRORS, CACHE_LOOKUPS, STAGE_SECONDS, REQUEST_SECONDS,
+                     IMAGE_MEGAPIXELS, UPLOAD_BYTES, DETECTIONS, COALESCED_REQUESTS, COALESCED_SAVED_SECONDS,
+                     process_rss_bytes, stage)
 
 print("=== Minimal YOLO API for 512MB RAM ===")
 
 app = Flask(__name__, static_folder='static')
 
+# 批量检测配置 - 默认值按512MB内存保守设置
+BATCH_MAX_IMAGES = int(os.getenv('BATCH_MAX_IMAGES', 4))   # 单次请求最多图像数
+BATCH_MEMORY_MB = int(os.getenv('BATCH_MEMORY_MB', 64))    # 解码图像与批量张量的内存上限
+
+# 微批调度配置 - 需配合 gunicorn gthread 多线程worker才能合并并发的 /detect 请求
+MICRO_BATCH_ENABLED = os.getenv('MICRO_BATCH', '0') == '1'
+MICRO_BATCH_MAX_SIZE = int(os.getenv('MICRO_BATCH_MAX_SIZE', 4))
+MICRO_BATCH_MAX_WAIT_MS = float(os.getenv('MICRO_BATCH_MAX_WAIT_MS', 10))
+
+# 结果缓存配置 - RESULT_CACHE_MB=0 关闭
+RESULT_CACHE_MB = float(os.getenv('RESULT_CACHE_MB', 8))
+RESULT_CACHE_TTL = float(os.getenv('RESULT_CACHE_TTL', 300))   # 秒
+
+# 请求合并 - 同时在途的相同 /detect 请求 (相同字节 + 参数 + 模型) 只推理一次，SINGLE_FLIGHT=0 关闭
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT', '1') == '1'
+
+# 分块推理配置 - /detect 传 tiled=1 时按重叠分块检测，小云团不会因整图缩小到416而丢失
+TILE_SIZE = int(os.getenv('TILE_SIZE', 0))                  # 分块边长，0为 INPUT_SIZE
+TILE_OVERLAP = float(os.getenv('TILE_OVERLAP', 0.2))        # 相邻分块重叠比例
+TILE_BATCH = int(os.getenv('TILE_BATCH', 2))                # 每次前向推理的分块数，决定峰值内存
+TILE_WORKERS = int(os.getenv('TILE_WORKERS', 1))            # 并行处理分块批次的线程数
+TILE_MAX_SIDE = int(os.getenv('TILE_MAX_SIDE', 4096))       # 分块模式下更大的图像降采样解码到接近该长边
+
+# 帧流配置 - /detect_stream 画面变化超过阈值或超过最大间隔才重新检测
+STREAM_CHANGE_THRESHOLD = float(os.getenv('STREAM_CHANGE_THRESHOLD', 0.02))  # 缩略图平均绝对差 (0-1)
+STREAM_MAX_INTERVAL = float(os.getenv('STREAM_MAX_INTERVAL', 30))            # 秒
+STREAM_MAX_CONCURRENT = int(os.getenv('STREAM_MAX_CONCURRENT', 2))          # 每个worker同时打开的帧流数，0为不限制
+
+# 内存调控 - RSS超过高水位才回收，解码前按剩余预算降采样或拒绝 (MEMORY_BUDGET_MB 等配置见 memory_governor.py)
+memory_governor = MemoryGovernor()
+
 class MinimalYOLODetector:
     def __init__(self, model_path):
         """极简YOLO检测器 - 专为低内存设计"""
         self.model_path = model_path
-        self.model = None
+        self.backend = None
+        self.model_identity = None  # 模型文件标识，用于结果缓存键
         self.model_loaded = False
         self.load_error = None
+        self.input_size = int(os.getenv('INPUT_SIZE', 416))  # 使用更小的尺寸以节省内存
+        self.input_pool = None  # 复用的float32输入张量 (input_buffers.py)
+        self.inference_lock = threading.Lock()  # ultralytics predictor 非线程安全
         self.load_model()
 
+    @property
+    def model_type(self):
+        """当前推理后端对应的模型类型描述"""
+        if self.backend is not None and self.backend.name == 'onnxruntime':
+            return 'ONNX Runtime INT8 (.onnx)' if self.backend.precision == 'int8' else 'ONNX Runtime (.onnx)'
+        return 'PyTorch (.pt)'
+
     def load_model(self):
         """加载模型 - 带详细错误处理"""
         try:
@@ -31,40 +93,44 @@ class MinimalYOLODetector:
             if not os.path.exists(self.model_path):
                 raise FileNotFoundError(f"模型文件不存在: {self.model_path}")
             
-            # 检查文件大小
-            file_size = os.path.getsize(self.model_path) / (1024*1024)  # MB
-            print(f"📊 模型文件大小: {file_size:.2f} MB")
-            
-            # 显示当前内存使用
-            import psutil
-            memory = psutil.virtual_memory()
-            print(f"🧠 系统内存: 总计{memory.total//1024//1024}MB, 可用{memory.available//1024//1024}MB")
-            
-            # 延迟导入ultralytics
-            print("📦 导入ultralytics...")
-            from ultralytics import YOLO
-            
-            # 清理内存
-            gc.collect()
+            # FAST_START 时跳过诊断信息，缩短冷启动
+            if not FAST_START:
+                # 检查文件大小
+                file_size = os.path.getsize(self.model_path) / (1024*1024)  # MB
+                print(f"📊 模型文件大小: {file_size:.2f} MB")
+                
+                # 显示当前内存使用
+                import psutil
+                memory = psutil.virtual_memory()
+                print(f"🧠 系统内存: 总计{memory.total//1024//1024}MB, 可用{memory.available//1024//1024}MB")
+                
+                # 内存接近高水位时先回收
+                memory_governor.maybe_collect()
             
-            print("🔄 开始加载YOLO模型...")
-            # 尝试加载模型，限制设备为CPU
-            self.model = YOLO(self.model_path, task='detect')
+            # 推理后端内部延迟导入 ultralytics / onnxruntime
+            # MODEL_PRECISION=int8 时加载INT8量化模型，校准/导出按 input_size 进行
+            backend_name = default_backend_name()
+            precision = os.getenv('MODEL_PRECISION', 'fp32')
+            print(f"🔄 开始加载YOLO模型 (后端: {backend_name}, 精度: {precision})...")
+            self.backend = create_backend(self.model_path, backend_name, imgsz=self.input_size, precision=precision)
+            self.model_identity = f"{self.backend.name}:{self.backend.precision}:{file_identity(self.backend.model_path)}"
             
             # 验证模型加载
-            if self.model is None:
+            if self.backend is None:
                 raise Exception("模型对象为None")
+            self.input_pool = create_input_pool(self.backend, self.input_size,
+                                                batch_limit(self.input_size, BATCH_MAX_IMAGES, BATCH_MEMORY_MB * 1024 * 1024))
             
             self.model_loaded = True
-            print(f"✅ 模型加载成功！")
-            print(f"🏷️  类别数量: {len(self.model.names)}")
-            print(f"🔤 类别: {list(self.model.names.values())}")
+            print(f"✅ 模型加载成功！ {self.backend.model_path}")
+            print(f"🏷️  类别数量: {len(self.backend.names)}")
+            print(f"🔤 类别: {list(self.backend.names.values())}")
             
-            # 强制清理内存
-            gc.collect()
+            # 加载过程中的临时对象超过高水位时回收
+            memory_governor.maybe_collect()
             
         except ImportError as e:
-            error_msg = f"导入ultralytics失败: {e}"
+            error_msg = f"导入推理后端失败: {e}"
             print(f"❌ {error_msg}")
             self.load_error = error_msg
             self.model_loaded = False
@@ -89,77 +155,341 @@ class MinimalYOLODetector:
             self.load_error = error_msg
             self.model_loaded = False
 
-    def detect(self, image, conf_threshold=0.5, nms_threshold=0.4):
-        """执行检测"""
+    def detect(self, image, conf_threshold=0.5, nms_threshold=0.4, columnar=False, decode_scale=None,
+               input_size=None):
+        """执行检测
+
+        decode_scale 来自 decode_image_reduced()，用于把框映射回上传原图的坐标；
+        input_size 为本次推理尺寸 (负载自适应降级时小于 self.input_size)
+        """
         if not self.model_loaded:
             raise Exception(f"模型未加载: {self.load_error}")
         
         try:
             print(f"🔍 开始检测...")
             
-            # 强制调整图片大小以节省内存
-            height, width = image.shape[:2]
-            max_size = 416  # 使用更小的尺寸
-            if width > max_size or height > max_size:
-                scale = max_size / max(width, height)
-                new_width = int(width * scale)
-                new_height = int(height * scale)
-                image = cv2.resize(image, (new_width, new_height))
-                print(f"📏 图片调整: {width}x{height} -> {new_width}x{new_height}")
-            
-            # 执行检测
-            results = self.model(image, conf=conf_threshold, iou=nms_threshold, verbose=False)
+            # 一次letterbox到input_size (矩形，只填充到32的倍数) 以节省内存
+            outputs, metas = self._letterbox_predict([image], conf_threshold, nms_threshold, stride=32,
+                                                     input_size=input_size)
+            xyxy, confidences, class_ids = outputs[0]
+            ratio, pad, _ = metas[0]
             
-            predictions = []
-            if results and len(results) > 0:
-                result = results[0]
-                if result.boxes is not None and len(result.boxes) > 0:
-                    boxes = result.boxes
-                    for i in range(len(boxes)):
-                        box = boxes.xyxy[i].cpu().numpy()
-                        x1, y1, x2, y2 = map(int, box)
-                        confidence = float(boxes.conf[i].cpu().numpy())
-                        class_id = int(boxes.cls[i].cpu().numpy())
-                        class_name = self.model.names.get(class_id, f'class_{class_id}')
-                        
-                        predictions.append({
-                            'bbox': [x1, y1, x2, y2],
-                            'confidence': confidence,
-                            'class_id': class_id,
-                            'class_name': class_name
-                        })
+            # 映射回原图坐标，NumPy数组批量构建响应，避免逐框的张量拷贝
+            with stage('postprocess'):
+                xyxy = restore_decode_scale(unletterbox_boxes(xyxy, ratio, pad, image.shape), decode_scale)
+                predictions = build_predictions(xyxy, confidences, class_ids, self.backend.names, columnar=columnar)
             
-            print(f"✅ 检测完成: {len(predictions)} 个目标")
-            gc.collect()  # 强制垃圾回收
+            print(f"✅ 检测完成: {count_predictions(predictions)} 个目标")
+            memory_governor.maybe_collect()  # 只在RSS超过高水位时回收
             return predictions
             
         except Exception as e:
+            # 推理失败时抛出，不返回空结果，否则会被当作"没有目标"写入结果缓存
             print(f"❌ 检测异常: {e}")
             traceback.print_exc()
-            return []
+            raise
+
+    def detect_many(self, images, conf_threshold=0.5, nms_threshold=0.4, columnar=False, decode_scales=None,
+                    input_size=None):
+        """批量检测 - 统一letterbox到input_size后批量前向推理
+
+        返回与 images 一一对应的预测列表，坐标为各自原图坐标
+        """
+        if not self.model_loaded:
+            raise Exception(f"模型未加载: {self.load_error}")
+
+        print(f"🔍 开始批量检测: {len(images)} 张图像")
+
+        # 每次只letterbox一个批次，降低峰值内存
+        decode_scales = decode_scales or [None] * len(images)
+        all_predictions = []
+        batches = split_batches(len(images), input_size or self.input_size, BATCH_MAX_IMAGES,
+                                BATCH_MEMORY_MB * 1024 * 1024)
+        for start, end in batches:
+            # 与 detect() 相同的矩形letterbox (stride=32)，整批填充到共同的矩形尺寸，
+            # 微批合并的单张请求与不合并时的结果一致
+            outputs, metas = self._letterbox_predict(images[start:end], conf_threshold, nms_threshold, stride=32,
+                                                     input_size=input_size)
+
+            with stage('postprocess'):
+                for (xyxy, confidences, class_ids), (ratio, pad, orig_shape), decode_scale in zip(
+                        outputs, metas, decode_scales[start:end]):
+                    xyxy = restore_decode_scale(unletterbox_boxes(xyxy, ratio, pad, orig_shape), decode_scale)
+                    all_predictions.append(build_predictions(xyxy, confidences, class_ids, self.backend.names,
+                                                             columnar=columnar))
+            del outputs
+
+        print(f"✅ 批量检测完成: {len(images)} 张图像, {len(batches)} 次前向推理")
+        memory_governor.maybe_collect()
+        return all_predictions
+
+    def _letterbox_predict(self, images, conf_threshold, nms_threshold, stride=None, input_size=None):
+        """letterbox到input_size后推理，返回 (letterbox坐标系下的 [(xyxy, confidences, class_ids), ...],
+        [(ratio, pad, 原图shape), ...])
+
+        有张量池时直接写入复用的float32输入张量，跳过推理后端自己的预处理
+        """
+        input_size = input_size or self.input_size
+        if self.input_pool is not None:
+            with stage('preprocess'):
+                batch = self.input_pool.letterbox(images, stride, imgsz=input_size)
+            with batch, stage('inference'), self.inference_lock:
+                outputs = self.backend.predict_tensor(batch.tensor, conf_threshold, nms_threshold)
+            return outputs, batch.metas
+
+        with stage('preprocess'):
+            letterboxed = []
+            metas = []
+            target = batch_letterbox_shape([image.shape for image in images], input_size, stride)
+            for image in images:
+                canvas, ratio, pad = letterbox(image, input_size, stride=stride, target=target)
+                letterboxed.append(canvas)
+                metas.append((ratio, pad, image.shape))
+        with stage('inference'), self.inference_lock:
+            outputs = self.backend.predict(letterboxed, conf_threshold, nms_threshold, imgsz=input_size)
+        return outputs, metas
+
+    def detect_tiled(self, image, conf_threshold=0.5, nms_threshold=0.4, columnar=False, decode_scale=None):
+        """分块检测 - 按 TILE_SIZE 重叠分块、每次 TILE_BATCH 块流式推理，全局NMS合并
+
+        返回 (predictions, tile_info)，坐标为原图坐标
+        """
+        if not self.model_loaded:
+            raise Exception(f"模型未加载: {self.load_error}")
+
+        print(f"🔍 开始分块检测: {image.shape[1]}x{image.shape[0]}")
+        lock = None if self.backend.thread_safe else self.inference_lock
+        with stage('inference'):
+            xyxy, confidences, class_ids, tile_info = run_tiled(
+                self.backend, image, conf_threshold, nms_threshold, tile_size=TILE_SIZE or self.input_size,
+                overlap=TILE_OVERLAP, tile_batch=TILE_BATCH, workers=TILE_WORKERS, lock=lock)
+        with stage('postprocess'):
+            xyxy = restore_decode_scale(xyxy, decode_scale)
+            predictions = build_predictions(xyxy, confidences, class_ids, self.backend.names, columnar=columnar)
+
+        print(f"✅ 分块检测完成: {tile_info['tiles']} 个分块, {count_predictions(predictions)} 个目标")
+        memory_governor.maybe_collect()
+        return predictions, tile_info
 
 # 全局检测器
 detector = None
 
+# 启动阶段与就绪状态
+service_state = ServiceState(_IMPORT_STARTED)
+
+def _on_model_swap(name, new_detector):
+    """默认模型热替换后更新全局检测器 (/health 等读取)"""
+    global detector
+    if name == model_registry.default_name:
+        detector = new_detector
+
+# 多模型注册表 - MODELS 配置的其它模型按名称懒加载、按 MODEL_MEMORY_BUDGET_MB 做LRU卸载 (见 model_registry.py)
+model_registry = ModelRegistry(MinimalYOLODetector, parse_models(MODELS), on_swap=_on_model_swap)
+
+def init_detector(model_path=None, for_fork=False):
+    """创建并预热全局检测器，model_path 为空时读取 MODEL_PATH 环境变量
+
+    加载成功后作为默认模型登记到注册表，常驻不卸载
+    """
+    global detector
+    model_path = model_path or os.getenv('MODEL_PATH', '/app/models/best.pt')
+    rss_before = process_rss_bytes() or 0
+    detector = load_detector(service_state, lambda: MinimalYOLODetector(model_path), for_fork=for_fork)
+    if detector.model_loaded:
+        model_registry.adopt(DEFAULT_MODEL_NAME, model_path, detector,
+                             footprint=(process_rss_bytes() or 0) - rss_before)
+    return detector
+
+def create_app():
+    """应用工厂: gunicorn --preload 'app:create_app()'
+
+    在master进程中加载并预热模型，worker通过fork以写时复制方式共享
+    """
+    if detector is None:
+        init_detector(for_fork=True)
+    return app
+
+def _batched_detect(images, conf_threshold, nms_threshold, model=None, **options):
+    with model_registry.acquire(model) as active:
+        return active.detect_many(images, conf_threshold, nms_threshold, **options)
+
+# 微批调度器 (调度线程在每个worker首次提交时懒启动)
+batcher = MicroBatcher(_batched_detect, MICRO_BATCH_MAX_SIZE, MICRO_BATCH_MAX_WAIT_MS) if MICRO_BATCH_ENABLED else None
+
+# 检测结果缓存 (LRU + TTL + 字节预算)
+result_cache = DetectionCache(RESULT_CACHE_MB * 1024 * 1024, RESULT_CACHE_TTL) if RESULT_CACHE_MB > 0 else None
+
+# 在途请求合并 (与结果缓存使用相同的键)
+single_flight = SingleFlight() if SINGLE_FLIGHT_ENABLED else None
+
+# 负载自适应输入尺寸 (按排队深度和最近p95逐级降低推理尺寸，见 adaptive_resolution.py)
+resolution = ResolutionController()
+
+# 帧流汇总统计
+stream_stats = StreamStats(STREAM_MAX_CONCURRENT)
+
+# 微批队列长度 (抓取 /metrics 时读取)
+REGISTRY.register(Gauge('yolo_micro_batch_queue_depth', '微批调度队列中等待的请求数',
+                        lambda: batcher.stats()['queue_depth'] if batcher else None))
+
+def run_detection(image_bytes, conf_threshold=0.5, nms_threshold=0.4, columnar=False, tiled=False, model=None,
+                  min_input_size=None, inference_executor=None):
+    """单张图像检测: 查缓存 -> 降采样解码 -> 推理 -> 写缓存，返回 /detect 的响应字典
+
+    Flask 路由和 ASGI 服务模式 (asgi_app.py) 共用；图像无法解码时返回None，
+    剩余内存预算放不下这张图像时抛出 MemoryPressureError。
+    model 为注册表中的模型名称 (空为默认模型)，未配置时抛出 UnknownModelError，懒加载失败时抛出 ModelLoadError。
+    min_input_size 为客户端可接受的最小推理尺寸，负载自适应降级不会低于它 (分块模式始终按完整尺寸)。
+    inference_executor 不为空时只把推理提交到该线程池，缓存查询和图像解码留在调用线程 (ASGI模式)
+    """
+    model = model_registry.resolve(model)
+    with model_registry.acquire(model) as active, resolution.request(
+            active.input_size, min_input_size,
+            adjustable=not tiled and not getattr(active.backend, 'fixed_size', None)) as sizing:
+        if single_flight is None:
+            return _run_detection(active, model, None, image_bytes, conf_threshold, nms_threshold, columnar, tiled,
+                                  sizing, inference_executor)
+        # 相机网关重试、多个看板同时请求同一帧时，后到的相同请求等待并共享第一个请求的结果
+        cache_key = DetectionCache.make_key(image_bytes, conf_threshold, nms_threshold, active.model_identity,
+                                            columnar=columnar, tiled=tiled, **_size_option(active, sizing))
+        result, saved_seconds = single_flight.do(cache_key, lambda: _run_detection(
+            active, model, cache_key, image_bytes, conf_threshold, nms_threshold, columnar, tiled, sizing,
+            inference_executor))
+        if saved_seconds is not None:
+            sizing.record = False  # 等待领头请求的耗时不代表推理延迟
+    if saved_seconds is None or result is None:
+        return result
+    COALESCED_REQUESTS.inc()
+    COALESCED_SAVED_SECONDS.inc(saved_seconds)
+    return dict(result, coalesced=True, timestamp=datetime.now().isoformat())
+
+def _size_option(detector, sizing):
+    """降级时推理尺寸作为缓存键/微批分组的选项；按完整尺寸推理时不加，与关闭自适应时的键相同"""
+    return {'input_size': sizing.size} if sizing.size != detector.input_size else {}
+
+def _infer(executor, fn, *args, **kwargs):
+    """在 executor 中执行推理并等待结果，executor 为None时直接调用"""
+    if executor is None:
+        return fn(*args, **kwargs)
+    return executor.submit(fn, *args, **kwargs).result()
+
+def _run_detection(detector, model, cache_key, image_bytes, conf_threshold, nms_threshold, columnar, tiled, sizing,
+                   inference_executor=None):
+    """run_detection 的主体，detector 为从注册表取出的检测器 (请求完成前不会被卸载或替换)，
+    cache_key 为已经算好的缓存键 (None 时按需计算)，sizing.size 为负载自适应选择的推理尺寸
+    """
+    # 相同字节 + 相同参数 + 相同模型直接返回缓存结果，连解码都省掉
+    predictions = None
+    if result_cache is not None:
+        with stage('cache_lookup'):
+            cache_key = cache_key or result_cache.make_key(image_bytes, conf_threshold, nms_threshold,
+                                                           detector.model_identity, columnar=columnar, tiled=tiled,
+                                                           **_size_option(detector, sizing))
+            predictions = result_cache.get(cache_key)
+        CACHE_LOOKUPS.inc(result='hit' if predictions is not None else 'miss')
+    cache_hit = predictions is not None
+    if cache_hit:
+        sizing.record = False  # 没有推理，不计入延迟统计
+
+    batch_info = None
+    tile_info = None
+    memory_target = None
+    if not cache_hit:
+        # 按input_size降采样解码，大图不再先分配全分辨率数组；分块模式按 TILE_MAX_SIDE 解码
+        decode_target = TILE_MAX_SIDE if tiled else sizing.size
+        with memory_governor.reserve(image_bytes, decode_target, sizing.size) as target_size:
+            if target_size != decode_target:
+                memory_target = target_size  # 内存紧张，按更小的尺寸解码
+            with stage('image_decode'):
+                image, decode_scale = decode_image_reduced(image_bytes, target_size)
+            if image is None:
+                return None
+            # 按上传原图尺寸统计，而不是降采样解码后的尺寸
+            width, height = decode_scale[2:] if decode_scale else (image.shape[1], image.shape[0])
+            IMAGE_MEGAPIXELS.observe(width * height / 1e6)
+
+            if tiled:
+                predictions, tile_info = _infer(inference_executor, detector.detect_tiled, image, conf_threshold,
+                                                nms_threshold, columnar=columnar, decode_scale=decode_scale)
+            elif batcher is not None:
+                predictions, batch_info = _infer(inference_executor, batcher.submit, image, conf_threshold,
+                                                 nms_threshold, decode_scale=decode_scale, columnar=columnar,
+                                                 model=model, **_size_option(detector, sizing))
+            else:
+                predictions = _infer(inference_executor, detector.detect, image, conf_threshold, nms_threshold,
+                                     columnar=columnar, decode_scale=decode_scale, input_size=sizing.size)
+            del image
+
+        # 降采样解码的结果与正常解码不同，不写入缓存
+        if result_cache is not None and memory_target is None:
+            result_cache.put(cache_key, predictions)
+
+    result = {
+        'success': True,
+        'predictions': predictions,
+        'total_detections': count_predictions(predictions),
+        'format': 'columnar' if columnar else 'rows',
+        'timestamp': datetime.now().isoformat(),
+        'model_type': detector.model_type,
+        'model': model,
+        'cache_hit': cache_hit,
+        'input_size': sizing.size
+    }
+    if batch_info is not None:
+        result['batch_info'] = batch_info
+    if tile_info is not None:
+        result['tile_info'] = tile_info
+    if memory_target is not None:
+        result['memory_downscale'] = {'decode_size': memory_target}
+    DETECTIONS.observe(result['total_detections'])
+    service_state.mark_first_prediction()
+    return result
+
 @app.route('/')
 def index():
     return send_from_directory('static', 'index.html')
 
-@app.route('/health', methods=['GET'])
-def health_check():
-    return jsonify({
-        'status': 'healthy',
+def health_status():
+    """健康检查内容 (Flask 与 ASGI 服务模式共用)"""
+    return {
+        'status': 'healthy' if service_state.ready else service_state.phase,
+        'ready': service_state.ready,
         'timestamp': datetime.now().isoformat(),
         'model_loaded': detector.model_loaded if detector else False,
-        'model_type': 'PyTorch (.pt)',
-        'model_classes': detector.model.names if detector and detector.model_loaded else None,
+        'model_type': detector.model_type if detector else 'PyTorch (.pt)',
+        'input_size': detector.input_size if detector else None,  # 客户端据此预先缩小图像
+        'batch_max_images': BATCH_MAX_IMAGES,
+        'inference_backend': detector.backend.name if detector and detector.model_loaded else None,
+        'model_precision': detector.backend.precision if detector and detector.model_loaded else None,
+        'model_classes': detector.backend.names if detector and detector.model_loaded else None,
         'load_error': detector.load_error if detector else None,
-        'model_path_exists': os.path.exists(os.getenv('MODEL_PATH', '/app/models/best.pt'))
-    })
+        'model_path_exists': os.path.exists(os.getenv('MODEL_PATH', '/app/models/best.pt')),
+        'models': model_registry.resident(),  # 常驻模型及其内存占用，可选名称见 available_models
+        'available_models': model_registry.names(),
+        'lifecycle': service_state.to_dict()
+    }
 
-@app.route('/debug', methods=['GET'])
-def debug_info():
-    """详细调试信息"""
+@app.route('/health', methods=['GET'])
+def health_check():
+    """就绪检查 - 模型加载并预热完成前返回503，加载失败的详情见 /debug"""
+    return jsonify(health_status()), 200 if service_state.ready else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 指标 - 各阶段耗时直方图、请求/错误计数、图像尺寸、检测框数量、进程RSS"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    return jsonify(service_state.to_dict()), 200 if service_state.ready else 503
+
+@app.route('/live', methods=['GET'])
+def liveness_check():
+    """存活检查 - 加载/预热期间也返回200"""
+    return jsonify({'status': 'alive', 'phase': service_state.phase, 'pid': os.getpid()})
+
+def debug_status():
+    """详细调试信息内容 (Flask 与 ASGI 服务模式共用)"""
     model_path = os.getenv('MODEL_PATH', '/app/models/best.pt')
     
     debug_data = {
@@ -172,7 +502,28 @@ def debug_info():
         'env_vars': {
             'MODEL_PATH': os.getenv('MODEL_PATH'),
             'PORT': os.getenv('PORT'),
+            'INFERENCE_BACKEND': os.getenv('INFERENCE_BACKEND'),
+            'MODEL_PRECISION': os.getenv('MODEL_PRECISION'),
+            'INPUT_SIZE': os.getenv('INPUT_SIZE'),
+            'FAST_START': os.getenv('FAST_START'),
             'PYTHONUNBUFFERED': os.getenv('PYTHONUNBUFFERED')
+        },
+        'micro_batching': batcher.stats() if batcher else None,
+        'result_cache': result_cache.stats() if result_cache else None,
+        'single_flight': single_flight.stats() if single_flight else None,
+        'adaptive_resolution': resolution.stats(),
+        'memory_governor': memory_governor.stats(),
+        'input_buffers': detector.input_pool.stats() if detector and detector.input_pool else None,
+        'model_registry': model_registry.stats(),
+        'streams': stream_stats.stats(),
+        'startup': service_state.to_dict(),
+        'artifact_path': detector.backend.model_path if detector and detector.model_loaded else None,
+        'tiling': {
+            'tile_size': TILE_SIZE or (detector.input_size if detector else None),
+            'overlap': TILE_OVERLAP,
+            'tile_batch': TILE_BATCH,
+            'workers': TILE_WORKERS,
+            'max_side': TILE_MAX_SIDE
         }
     }
     
@@ -200,7 +551,12 @@ def debug_info():
     except Exception as e:
         debug_data['directory_error'] = str(e)
     
-    return jsonify(debug_data)
+    return debug_data
+
+@app.route('/debug', methods=['GET'])
+def debug_info():
+    """详细调试信息"""
+    return jsonify(debug_status())
 
 @app.route('/detect', methods=['POST'])
 def detect_objects():
@@ -210,54 +566,244 @@ def detect_objects():
         error_msg = detector.load_error if detector else "检测器未初始化"
         return jsonify({'error': f'模型未加载: {error_msg}'}), 500
     
+    request_started = time.perf_counter()
     try:
-        image = None
-        
-        if 'image' in request.files:
+        if is_raw_upload(request.mimetype):
+            # 原始二进制上传 (application/octet-stream / image/*)，参数在查询字符串中
+            input_mode = 'raw'
+            if (request.content_length or 0) > raw_upload_limit():
+                ERRORS.inc(endpoint='detect', reason='too_large')
+                return jsonify({'error': f'图像超过上限 {RAW_UPLOAD_MAX_MB:g}MB'}), 413
+            try:
+                image_bytes = read_raw_body(request.stream, request.content_length)
+            except ValueError as e:
+                ERRORS.inc(endpoint='detect', reason='bad_body')
+                return jsonify({'error': str(e)}), 400
+            STAGE_SECONDS.observe(time.perf_counter() - request_started, stage='parse')
+        elif 'image' in request.files:
+            input_mode = 'file'
             file = request.files['image']
             image_bytes = file.read()
-            image_array = np.frombuffer(image_bytes, np.uint8)
-            image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+            STAGE_SECONDS.observe(time.perf_counter() - request_started, stage='parse')
         elif request.is_json and 'image_base64' in request.json:
+            input_mode = 'base64'
             image_base64 = request.json['image_base64']
-            image_bytes = base64.b64decode(image_base64)
-            image_array = np.frombuffer(image_bytes, np.uint8)
-            image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+            STAGE_SECONDS.observe(time.perf_counter() - request_started, stage='parse')
+            with stage('base64_decode'):
+                image_bytes = base64.b64decode(image_base64)
         else:
+            ERRORS.inc(endpoint='detect', reason='no_image')
             return jsonify({'error': '请提供图像文件或Base64编码的图像'}), 400
         
-        if image is None:
+        REQUESTS.inc(endpoint='detect', input_mode=input_mode)
+        UPLOAD_BYTES.observe(len(image_bytes))
+        
+        conf_threshold = request.json.get('conf_threshold', 0.5) if request.is_json else float(request.values.get('conf_threshold', 0.5))
+        nms_threshold = request.json.get('nms_threshold', 0.4) if request.is_json else float(request.values.get('nms_threshold', 0.4))
+        # format=columnar 返回列式结果，检测框较多时序列化更快
+        columnar = is_columnar_format(request.json.get('format') if request.is_json else request.values.get('format'))
+        # tiled=1 对超大图像分块检测
+        tiled = is_enabled(request.json.get('tiled') if request.is_json else request.values.get('tiled'))
+        # model=名称 选择 MODELS 中配置的模型，默认为 MODEL_PATH
+        model = request.json.get('model') if request.is_json else request.values.get('model')
+        # min_input_size=416 限制负载自适应降级的最小推理尺寸
+        try:
+            min_input_size = parse_min_size(request.json.get('min_input_size') if request.is_json
+                                            else request.values.get('min_input_size'))
+        except (TypeError, ValueError):
+            ERRORS.inc(endpoint='detect', reason='bad_param')
+            return jsonify({'error': 'min_input_size 必须为正整数'}), 400
+        
+        # Accept: application/x-msgpack / application/x-yolo-f32 返回紧凑的二进制响应 (见 wire_format.py)
+        response_format = accepted_format(request.headers.get('Accept'))
+        
+        result = run_detection(image_bytes, conf_threshold, nms_threshold,
+                               columnar=columnar or response_format != 'json', tiled=tiled, model=model,
+                               min_input_size=min_input_size)
+        del image_bytes
+        if result is None:
+            ERRORS.inc(endpoint='detect', reason='decode_error')
             return jsonify({'error': '无法解析图像'}), 400
         
-        conf_threshold = request.json.get('conf_threshold', 0.5) if request.is_json else float(request.form.get('conf_threshold', 0.5))
-        nms_threshold = request.json.get('nms_threshold', 0.4) if request.is_json else float(request.form.get('nms_threshold', 0.4))
+        with stage('serialize'):
+            if response_format == 'json':
+                response = jsonify(result)
+            else:
+                body, content_type, headers = encode_result(result, response_format,
+                                                            model_registry.class_names(result['model']))
+                response = Response(body, content_type=content_type, headers=headers)
+        elapsed = time.perf_counter() - request_started
+        REQUEST_SECONDS.observe(elapsed, endpoint='detect')
+        # 网页演示据此区分服务端耗时与网络传输耗时
+        response.headers['Server-Timing'] = f'detect;dur={elapsed * 1000:.1f}'
+        return response
         
-        predictions = detector.detect(image, conf_threshold, nms_threshold)
+    except MemoryPressureError as e:
+        ERRORS.inc(endpoint='detect', reason='memory')
+        return jsonify({'error': str(e), 'retry_after': e.retry_after}), 503, {'Retry-After': str(e.retry_after)}
         
-        result = {
-            'success': True,
-            'predictions': predictions,
-            'total_detections': len(predictions),
-            'timestamp': datetime.now().isoformat(),
-            'model_type': 'PyTorch (.pt)'
-        }
+    except UnknownModelError as e:
+        ERRORS.inc(endpoint='detect', reason='unknown_model')
+        return jsonify({'error': str(e), 'available_models': e.available}), 404
         
-        return jsonify(result)
+    except ModelLoadError as e:
+        ERRORS.inc(endpoint='detect', reason='model_load')
+        return jsonify({'error': str(e)}), 503
         
     except Exception as e:
+        ERRORS.inc(endpoint='detect', reason='exception')
         print("❌ 检测异常:", e)
         traceback.print_exc()
         return jsonify({'error': f'检测失败: {str(e)}'}), 500
 
+@app.route('/detect_batch', methods=['POST'])
+def detect_batch():
+    """批量检测 - 多张Base64图像合并为一次批量推理"""
+    global detector
+
+    if not detector or not detector.model_loaded:
+        error_msg = detector.load_error if detector else "检测器未初始化"
+        return jsonify({'error': f'模型未加载: {error_msg}'}), 500
+
+    if not request.is_json or not isinstance(request.json.get('images'), list):
+        return jsonify({'error': '请提供images字段 (Base64编码的图像列表)'}), 400
+
+    images_base64 = request.json['images']
+    if len(images_base64) == 0:
+        return jsonify({'error': 'images列表为空'}), 400
+    if len(images_base64) > BATCH_MAX_IMAGES:
+        return jsonify({'error': f'图像数量超过上限: {len(images_base64)} > {BATCH_MAX_IMAGES}'}), 413
+
+    try:
+        conf_threshold = float(request.json.get('conf_threshold', 0.5))
+        nms_threshold = float(request.json.get('nms_threshold', 0.4))
+        columnar = is_columnar_format(request.json.get('format', request.args.get('format')))
+
+        # 逐张解码，单张失败或超出内存上限只影响该张图像
+        results = [None] * len(images_base64)
+        images = []
+        decode_scales = []
+        indices = []
+        memory_budget = BATCH_MEMORY_MB * 1024 * 1024
+        decoded_bytes = 0
+        for i, image_base64 in enumerate(images_base64):
+            try:
+                image_bytes = base64.b64decode(image_base64)
+                # 已解码的图像都计入RSS，逐张按剩余预算决定是否降采样
+                action, target_size = memory_governor.plan(image_bytes, detector.input_size)
+                if action == 'reject':
+                    results[i] = {'success': False, 'error': '内存不足，请减少图像数量或缩小图像'}
+                    continue
+                image, decode_scale = decode_image_reduced(image_bytes, target_size)
+                del image_bytes
+            except Exception:
+                image = None
+
+            if image is None:
+                results[i] = {'success': False, 'error': '无法解析图像'}
+                continue
+            if decoded_bytes + image.nbytes > memory_budget:
+                results[i] = {'success': False, 'error': f'超出批量内存上限 ({BATCH_MEMORY_MB} MB)'}
+                continue
+
+            decoded_bytes += image.nbytes
+            images.append(image)
+            decode_scales.append(decode_scale)
+            indices.append(i)
+
+        if images:
+            batch_predictions = detector.detect_many(images, conf_threshold, nms_threshold, columnar=columnar,
+                                                     decode_scales=decode_scales)
+            del images
+            for i, predictions in zip(indices, batch_predictions):
+                results[i] = {
+                    'success': True,
+                    'predictions': predictions,
+                    'total_detections': count_predictions(predictions)
+                }
+
+        return jsonify({
+            'success': True,
+            'results': results,
+            'total_images': len(results),
+            'format': 'columnar' if columnar else 'rows',
+            'timestamp': datetime.now().isoformat(),
+            'model_type': detector.model_type
+        })
+
+    except Exception as e:
+        print("❌ 批量检测异常:", e)
+        traceback.print_exc()
+        return jsonify({'error': f'批量检测失败: {str(e)}'}), 500
+
+@app.route('/detect_stream', methods=['POST'])
+def detect_stream():
+    """帧流检测接口 - 一个连接持续上传 multipart/x-mixed-replace (MJPEG) 帧，逐帧返回NDJSON
+
+    查询参数: camera, conf_threshold, nms_threshold, format, change_threshold, max_interval
+    """
+    if not detector or not detector.model_loaded:
+        error_msg = detector.load_error if detector else "检测器未初始化"
+        return jsonify({'error': f'模型未加载: {error_msg}'}), 500
+
+    boundary = parse_boundary(request.content_type)
+    if boundary is None:
+        return jsonify({'error': '请使用 multipart/x-mixed-replace; boundary=... 上传帧流'}), 400
+
+    try:
+        camera_id = request.args.get('camera')
+        conf_threshold = float(request.args.get('conf_threshold', 0.5))
+        nms_threshold = float(request.args.get('nms_threshold', 0.4))
+        columnar = is_columnar_format(request.args.get('format'))
+        gate = ChangeGate(float(request.args.get('change_threshold', STREAM_CHANGE_THRESHOLD)),
+                          float(request.args.get('max_interval', STREAM_MAX_INTERVAL)))
+    except ValueError as e:
+        return jsonify({'error': f'参数错误: {str(e)}'}), 400
+
+    # 每个帧流在整个连接期间占用一个工作线程，超过上限时直接拒绝
+    if not stream_stats.try_open():
+        return jsonify({'error': f'帧流连接数已达上限 ({stream_stats.max_streams})，请稍后重试'}), 503
+
+    def detect_frame(image_bytes):
+        try:
+            with memory_governor.reserve(image_bytes, detector.input_size) as target_size:
+                image, decode_scale = decode_image_reduced(image_bytes, target_size)
+                if image is None:
+                    return None
+                return detector.detect(image, conf_threshold, nms_threshold, columnar=columnar,
+                                       decode_scale=decode_scale)
+        except MemoryPressureError as e:
+            raise FrameError(str(e), retryable=True, retry_after=e.retry_after) from e
+        except Exception as e:
+            print("❌ 帧检测异常:", e)
+            raise FrameError(str(e)) from e
+
+    def generate():
+        try:
+            frames = iter_multipart_frames(request.stream, boundary)
+            yield from stream_results(frames, gate, detect_frame, camera_id)
+        except Exception as e:
+            print("❌ 帧流异常:", e)
+            yield json.dumps({'done': True, 'camera': camera_id, 'error': str(e),
+                              'frames': gate.frames, 'skip_ratio': gate.skip_ratio}, ensure_ascii=False) + '\n'
+        finally:
+            print(f"✅ 帧流结束: camera={camera_id}, {gate.frames} 帧, 跳过 {gate.skipped} 帧 (skip_ratio={gate.skip_ratio})")
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    # 连接关闭时归还名额 (生成器未开始迭代就断开时 finally 不会执行)
+    response.call_on_close(lambda: stream_stats.closed(gate))
+    return response
+
 if __name__ == '__main__':
     model_path = os.getenv('MODEL_PATH', '/app/models/best.pt')
     
     print(f"🚀 启动极简YOLO API...")
     print(f"📁 模型路径: {model_path}")
-    print(f"🌍 环境变量: {dict(os.environ)}")
+    if not FAST_START:
+        print(f"🌍 环境变量: {dict(os.environ)}")
     
     # 初始化检测器
-    detector = MinimalYOLODetector(model_path)
+    init_detector(model_path)
     
     # 启动Flask应用
     port = int(os.getenv('PORT', 5000))
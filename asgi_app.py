@@ -0,0 +1,293 @@
+"""
+ASGI 服务模式 (asyncio)
+与 Flask 应用提供相同的 /detect、/health、/ready、/live、/debug、/metrics 接口，复用其中的检测器、微批调度和结果缓存：
+
+    # ASGI_APP_MODULE 为 Flask 应用模块名 (Docker镜像中为 app，本地为 app_pytorch / app_minimal)
+    ASGI_APP_MODULE=app uvicorn --factory asgi_app:create_asgi_app --host 0.0.0.0 --port 5000
+
+上传在事件循环里异步接收；Base64解码、缓存查询和图像解码在解码线程池执行，推理线程池只做推理，
+慢上传和大图解码都不会占用推理线程。推理线程数固定 (ASYNC_INFERENCE_WORKERS)，正在推理与排队的请求数达到 ASYNC_MAX_QUEUE 时
+立即返回 429 + Retry-After；模型尚未加载并预热完成时返回 503 + Retry-After，而不是让请求一直等到超时
+"""
+
+import asyncio
+import base64
+import functools
+import importlib
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.responses import FileResponse, JSONResponse, Response
+from starlette.routing import Route
+
+from detection_utils import is_columnar_format, is_enabled
+from wire_format import RAW_UPLOAD_MAX_MB, accepted_format, encode_result, is_raw_upload, raw_upload_limit
+from memory_governor import MemoryPressureError
+from adaptive_resolution import parse_min_size
+from model_registry import ModelLoadError, UnknownModelError
+from metrics import REGISTRY, CONTENT_TYPE, Gauge, REQUESTS, ERRORS, STAGE_SECONDS, REQUEST_SECONDS, UPLOAD_BYTES, stage
+
+ASGI_APP_MODULE = os.getenv('ASGI_APP_MODULE', 'app')
+ASYNC_INFERENCE_WORKERS = int(os.getenv('ASYNC_INFERENCE_WORKERS', 2))   # 推理线程数
+ASYNC_MAX_QUEUE = int(os.getenv('ASYNC_MAX_QUEUE', 8))                   # 推理中 + 排队的请求上限
+ASYNC_DECODE_WORKERS = int(os.getenv('ASYNC_DECODE_WORKERS', 2))         # 请求体与图像解码线程数
+ASYNC_LOADING_RETRY_AFTER = int(os.getenv('ASYNC_LOADING_RETRY_AFTER', 10))  # 模型加载中的 Retry-After (秒)
+
+
+class AdmissionControl:
+    """推理队列的准入控制
+
+    只统计已被接受、尚未完成推理的请求；超过上限直接拒绝，
+    Retry-After 按最近的平均推理耗时和当前排队长度估算
+    """
+
+    def __init__(self, workers, max_queue):
+        self.workers = max(1, int(workers))
+        self.max_queue = max(self.workers, int(max_queue))
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.max_observed = 0
+        self.avg_latency = None  # 指数滑动平均 (秒)
+
+    def try_acquire(self):
+        with self._lock:
+            if self.in_flight >= self.max_queue:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            self.accepted += 1
+            self.max_observed = max(self.max_observed, self.in_flight)
+            return True
+
+    def release(self, elapsed):
+        with self._lock:
+            self.in_flight -= 1
+            self.avg_latency = elapsed if self.avg_latency is None else 0.8 * self.avg_latency + 0.2 * elapsed
+
+    def retry_after(self):
+        """预计排在前面的请求全部完成所需的秒数 (至少1秒)"""
+        with self._lock:
+            latency = self.avg_latency or 1.0
+            return max(1, math.ceil(latency * self.in_flight / self.workers))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'inference_workers': self.workers,
+                'max_queue': self.max_queue,
+                'in_flight': self.in_flight,
+                'max_observed_in_flight': self.max_observed,
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'avg_latency_ms': round(self.avg_latency * 1000, 2) if self.avg_latency is not None else None
+            }
+
+
+def create_asgi_app(flask_module=None, inference_workers=None, max_queue=None):
+    """基于 Flask 应用模块 (app_pytorch / app_minimal) 创建 ASGI 应用: uvicorn --factory asgi_app:create_asgi_app
+
+    导入本模块时不会导入 Flask 应用模块，调用工厂时才导入
+    """
+    module = flask_module or importlib.import_module(ASGI_APP_MODULE)
+    inference_workers = inference_workers or ASYNC_INFERENCE_WORKERS
+    admission = AdmissionControl(inference_workers, max_queue or ASYNC_MAX_QUEUE)
+    inference_pool = ThreadPoolExecutor(max_workers=admission.workers, thread_name_prefix='asgi-infer')
+    # 解码线程在等待推理结果时仍被占用，加上推理线程数，推理饱和时仍有 ASYNC_DECODE_WORKERS 个线程解码下一批请求
+    decode_pool = ThreadPoolExecutor(max_workers=max(1, ASYNC_DECODE_WORKERS) + admission.workers,
+                                     thread_name_prefix='asgi-decode')
+    service_state = module.service_state
+    REGISTRY.register(Gauge('yolo_asgi_in_flight', 'ASGI模式下推理中 + 排队的请求数', lambda: admission.in_flight))
+
+    def load_model():
+        try:
+            module.init_detector()
+        except Exception as e:
+            print(f"模型加载失败: {e}")
+
+    @asynccontextmanager
+    async def lifespan(app):
+        # 模型在线程池中加载并预热，期间 /live 正常响应，/health、/ready 和 /detect 返回 503
+        if module.detector is None:
+            service_state.set_phase('loading')
+            asyncio.get_running_loop().run_in_executor(inference_pool, load_model)
+        yield
+        inference_pool.shutdown(wait=False)
+        decode_pool.shutdown(wait=False)
+
+    def serving_stats():
+        return dict(admission.stats(), mode='asgi')
+
+    def loading():
+        return service_state.phase in ('starting', 'loading', 'warming_up')
+
+    def reject(status, error, retry_after):
+        return JSONResponse({'error': error, 'retry_after': retry_after}, status_code=status,
+                            headers={'Retry-After': str(retry_after)})
+
+    async def index(request):
+        return FileResponse(os.path.join('static', 'index.html'))
+
+    async def health(request):
+        return JSONResponse(dict(module.health_status(), serving=serving_stats()),
+                            status_code=200 if service_state.ready else 503)
+
+    async def ready(request):
+        return JSONResponse(service_state.to_dict(), status_code=200 if service_state.ready else 503)
+
+    async def live(request):
+        return JSONResponse({'status': 'alive', 'phase': service_state.phase, 'pid': os.getpid()})
+
+    async def debug(request):
+        return JSONResponse(dict(module.debug_status(), serving=serving_stats()))
+
+    async def metrics(request):
+        return Response(REGISTRY.render(), headers={'Content-Type': CONTENT_TYPE})
+
+    async def detect(request):
+        if not service_state.ready:
+            ERRORS.inc(endpoint='detect', reason='not_ready')
+            if loading():
+                return reject(503, '模型加载中', ASYNC_LOADING_RETRY_AFTER)
+            return JSONResponse({'error': f'模型未加载: {service_state.error}'}, status_code=500)
+
+        loop = asyncio.get_running_loop()
+        request_started = time.perf_counter()
+        try:
+            content_type = request.headers.get('content-type', '')
+            if is_raw_upload(content_type):
+                # 原始二进制上传，参数在查询字符串中
+                content_length = request.headers.get('content-length')
+                content_length = int(content_length) if content_length else None
+                if (content_length or 0) > raw_upload_limit():
+                    ERRORS.inc(endpoint='detect', reason='too_large')
+                    return JSONResponse({'error': f'图像超过上限 {RAW_UPLOAD_MAX_MB:g}MB'}, status_code=413)
+                image_bytes = await read_raw_body_async(request, content_length)
+                params = request.query_params
+                input_mode = 'raw'
+                STAGE_SECONDS.observe(time.perf_counter() - request_started, stage='parse')
+            elif content_type.startswith('multipart/form-data') or content_type.startswith('application/x-www-form-urlencoded'):
+                # 上传在事件循环中异步接收，文件大于1MB时暂存到临时文件
+                form = await request.form()
+                upload = form.get('image')
+                if upload is None or isinstance(upload, str):
+                    return no_image()
+                image_bytes = await upload.read()
+                params = form
+                input_mode = 'file'
+                STAGE_SECONDS.observe(time.perf_counter() - request_started, stage='parse')
+            elif content_type.startswith('application/json'):
+                body = await request.body()
+                params = await loop.run_in_executor(decode_pool, json.loads, body)
+                if not isinstance(params, dict) or 'image_base64' not in params:
+                    return no_image()
+                input_mode = 'base64'
+                STAGE_SECONDS.observe(time.perf_counter() - request_started, stage='parse')
+                image_bytes = await loop.run_in_executor(decode_pool, _b64decode, params['image_base64'])
+            else:
+                return no_image()
+            REQUESTS.inc(endpoint='detect', input_mode=input_mode)
+            UPLOAD_BYTES.observe(len(image_bytes))
+
+            conf_threshold = float(params.get('conf_threshold', 0.5))
+            nms_threshold = float(params.get('nms_threshold', 0.4))
+            columnar = is_columnar_format(params.get('format', request.query_params.get('format')))
+            tiled = is_enabled(params.get('tiled', request.query_params.get('tiled')))
+            # 未配置的模型名称在排队前拒绝
+            model = module.model_registry.resolve(params.get('model', request.query_params.get('model')))
+            min_input_size = parse_min_size(params.get('min_input_size', request.query_params.get('min_input_size')))
+        except UnknownModelError as e:
+            ERRORS.inc(endpoint='detect', reason='unknown_model')
+            return JSONResponse({'error': str(e), 'available_models': e.available}, status_code=404)
+        except ValueError as e:
+            ERRORS.inc(endpoint='detect', reason='bad_request')
+            return JSONResponse({'error': f'参数错误: {str(e)}'}, status_code=400)
+
+        # 队列已满时立即拒绝，不让请求堆积到超时
+        if not admission.try_acquire():
+            ERRORS.inc(endpoint='detect', reason='overloaded')
+            return reject(429, '服务繁忙，请稍后重试', admission.retry_after())
+
+        response_format = accepted_format(request.headers.get('accept'))
+        started = time.perf_counter()
+        try:
+            # 缓存查询与图像解码在解码线程池，只有推理提交到推理线程池
+            result = await loop.run_in_executor(decode_pool, functools.partial(
+                module.run_detection, image_bytes, conf_threshold, nms_threshold,
+                columnar or response_format != 'json', tiled, model, min_input_size,
+                inference_executor=inference_pool))
+        except MemoryPressureError as e:
+            ERRORS.inc(endpoint='detect', reason='memory')
+            return reject(503, str(e), e.retry_after)
+        except ModelLoadError as e:
+            ERRORS.inc(endpoint='detect', reason='model_load')
+            return JSONResponse({'error': str(e)}, status_code=503)
+        except Exception as e:
+            ERRORS.inc(endpoint='detect', reason='exception')
+            print("检测异常:", e)
+            return JSONResponse({'error': f'检测失败: {str(e)}'}, status_code=500)
+        finally:
+            admission.release(time.perf_counter() - started)
+
+        if result is None:
+            ERRORS.inc(endpoint='detect', reason='decode_error')
+            return JSONResponse({'error': '无法解析图像'}, status_code=400)
+        with stage('serialize'):
+            if response_format == 'json':
+                response = JSONResponse(result)
+            else:
+                body, media_type, headers = encode_result(result, response_format,
+                                                           module.model_registry.class_names(result['model']))
+                response = Response(body, media_type=media_type, headers=headers)
+        elapsed = time.perf_counter() - request_started
+        REQUEST_SECONDS.observe(elapsed, endpoint='detect')
+        # 网页演示据此区分服务端耗时与网络传输耗时
+        response.headers['Server-Timing'] = f'detect;dur={elapsed * 1000:.1f}'
+        return response
+
+    def no_image():
+        ERRORS.inc(endpoint='detect', reason='no_image')
+        return JSONResponse({'error': '请提供图像文件或Base64编码的图像'}, status_code=400)
+
+    routes = [
+        Route('/', index),
+        Route('/health', health, methods=['GET']),
+        Route('/ready', ready, methods=['GET']),
+        Route('/live', live, methods=['GET']),
+        Route('/debug', debug, methods=['GET']),
+        Route('/metrics', metrics, methods=['GET']),
+        Route('/detect', detect, methods=['POST']),
+    ]
+    asgi_app = Starlette(routes=routes, lifespan=lifespan)
+    asgi_app.state.admission = admission
+    return asgi_app
+
+
+async def read_raw_body_async(request, content_length=None):
+    """异步接收原始请求体：有 Content-Length 时写入预先分配的 bytearray，超过上限或不完整时抛出 ValueError"""
+    limit = raw_upload_limit()
+    buffer = bytearray(content_length) if content_length is not None else bytearray()
+    received = 0
+    async for chunk in request.stream():
+        if content_length is None:
+            buffer += chunk
+        elif received + len(chunk) <= content_length:
+            buffer[received:received + len(chunk)] = chunk
+        received += len(chunk)
+        if received > (content_length if content_length is not None else limit):
+            raise ValueError(f'请求体超过声明的长度或上限: {received} 字节')
+    if content_length is not None and received != content_length:
+        raise ValueError(f'请求体不完整: 收到 {received} / {content_length} 字节')
+    return buffer
+
+
+def _b64decode(data):
+    with stage('base64_decode'):
+        return base64.b64decode(data)
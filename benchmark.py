@@ -0,0 +1,573 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+YOLO检测API压测与基准工具
+基于 YOLOClient 的会话对 /detect、/detect_batch 施加负载，统计吞吐、延迟分位数、错误率和服务端RSS：
+
+    # 闭环压测: 4个并发客户端持续请求30秒
+    python benchmark.py --url http://localhost:5000 --concurrency 4 --duration 30
+
+    # 开环压测: 固定到达率 5 请求/秒 (延迟从计划发送时刻算起，客户端积压也计入)
+    python benchmark.py --rate 5 --duration 60 --sizes 640x480,1920x1080,4000x3000
+
+    # 本地替身: 无 best.pt、无网络，在进程内启动服务
+    python benchmark.py --local tiny    # 随机初始化的 yolov8n，走完整的推理流水线
+    python benchmark.py --local stub    # 桩推理后端，只测HTTP、解码和序列化开销
+
+结果写入 --output 指定的JSON文件，--compare 与之前保存的结果对比 (例如两个版本之间)
+"""
+
+import argparse
+import base64
+import importlib
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from client_example import YOLOClient
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+DEFAULT_SIZES = '640x480,1280x720,1920x1080,4000x3000'
+
+
+# ---------------------------------------------------------------- 图像语料
+
+def synthetic_image(width, height, seed=0):
+    """生成天空样式的测试图像 (渐变背景 + 若干模糊云团)，JPEG压缩率接近真实照片"""
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(0, 1, height, dtype=np.float32)[:, None, None]
+    top = rng.uniform(120, 200, 3).astype(np.float32)
+    bottom = rng.uniform(180, 250, 3).astype(np.float32)
+    image = np.broadcast_to(top + (bottom - top) * gradient, (height, width, 3)).copy()
+
+    for _ in range(int(rng.integers(3, 9))):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        axes = (int(rng.integers(width // 20 + 1, width // 4 + 2)), int(rng.integers(height // 20 + 1, height // 5 + 2)))
+        cv2.ellipse(image, center, axes, float(rng.uniform(0, 180)), 0, 360, (245, 245, 245), -1)
+    image = cv2.GaussianBlur(image, (0, 0), max(1.0, min(width, height) / 80))
+    image += rng.normal(0, 4, image.shape).astype(np.float32)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def parse_sizes(text):
+    sizes = []
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        width, height = item.lower().split('x')
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+def build_corpus(image_dir=None, sizes=DEFAULT_SIZES, per_size=2, quality=90, seed=0):
+    """返回 [{'name', 'bytes', 'size'}]：image_dir 中的图片，或按 sizes 生成的合成图像"""
+    corpus = []
+    if image_dir:
+        for name in sorted(os.listdir(image_dir)):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.join(image_dir, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+            size = f"~{image.shape[1] * 8}x{image.shape[0] * 8}" if image is not None else 'unknown'
+            corpus.append({'name': name, 'bytes': data, 'size': size})
+        if not corpus:
+            raise ValueError(f"目录中没有图片: {image_dir}")
+        return corpus
+
+    for width, height in parse_sizes(sizes):
+        for index in range(per_size):
+            image = synthetic_image(width, height, seed=seed + index)
+            data = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+            corpus.append({'name': f'synthetic_{width}x{height}_{index}.jpg', 'bytes': data,
+                           'size': f'{width}x{height}'})
+    return corpus
+
+
+# ---------------------------------------------------------------- 请求
+
+class RequestSender:
+    """每个压测线程一个 YOLOClient，复用其 requests 会话 (连接保持)"""
+
+    def __init__(self, api_url, endpoint='detect', input_mode='file', batch_size=4,
+                 conf_threshold=0.25, nms_threshold=0.4, timeout=120, response_format='json'):
+        self.api_url = api_url
+        self.response_format = response_format
+        self.endpoint = endpoint
+        self.input_mode = input_mode
+        self.batch_size = batch_size
+        self.conf_threshold = conf_threshold
+        self.nms_threshold = nms_threshold
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = YOLOClient(self.api_url, self.response_format)
+        return client
+
+    def send(self, items):
+        """发送一个请求，返回 (HTTP状态码或None, 检测框数量, 是否命中结果缓存, 错误信息)"""
+        session = self.client.session
+        url = f"{self.client.api_url}/{self.endpoint}"
+        try:
+            if self.endpoint == 'detect_batch':
+                payload = {
+                    'images': [base64.b64encode(item['bytes']).decode('utf-8') for item in items],
+                    'conf_threshold': self.conf_threshold,
+                    'nms_threshold': self.nms_threshold
+                }
+                response = session.post(url, json=payload, timeout=self.timeout)
+            elif self.input_mode == 'raw':
+                params = {'conf_threshold': self.conf_threshold, 'nms_threshold': self.nms_threshold}
+                headers = dict(self.client.accept_header(), **{'Content-Type': 'image/jpeg'})
+                response = session.post(url, params=params, data=items[0]['bytes'], headers=headers,
+                                        timeout=self.timeout)
+            elif self.input_mode == 'base64':
+                payload = {
+                    'image_base64': base64.b64encode(items[0]['bytes']).decode('utf-8'),
+                    'conf_threshold': self.conf_threshold,
+                    'nms_threshold': self.nms_threshold
+                }
+                response = session.post(url, json=payload, headers=self.client.accept_header(),
+                                        timeout=self.timeout)
+            else:
+                files = {'image': (items[0]['name'], items[0]['bytes'], 'image/jpeg')}
+                data = {'conf_threshold': self.conf_threshold, 'nms_threshold': self.nms_threshold}
+                response = session.post(url, files=files, data=data, headers=self.client.accept_header(),
+                                        timeout=self.timeout)
+        except Exception as e:
+            return None, 0, False, f"{type(e).__name__}: {e}"
+
+        if response.status_code != 200:
+            return response.status_code, 0, False, response.text[:200]
+        try:
+            result = response.json() if self.endpoint == 'detect_batch' else self.client.parse_response(response)
+        except ValueError as e:
+            return response.status_code, 0, False, f"响应解析失败: {e}"
+        if self.endpoint == 'detect_batch':
+            detections = sum(item.get('total_detections', 0) for item in result.get('results', []))
+        else:
+            detections = result.get('total_detections', 0)
+        return response.status_code, detections, bool(result.get('cache_hit')), None
+
+    def items_for(self, corpus, index):
+        count = self.batch_size if self.endpoint == 'detect_batch' else 1
+        return [corpus[(index + offset) % len(corpus)] for offset in range(count)]
+
+
+class RssSampler:
+    """后台定时抓取 /metrics 中的 process_resident_memory_bytes (服务端未提供时为空)"""
+
+    def __init__(self, api_url, interval=1.0):
+        self.client = YOLOClient(api_url)
+        self.interval = interval
+        self.samples = []
+        self.started = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def read_rss_mb(self):
+        try:
+            response = self.client.session.get(f"{self.client.api_url}/metrics", timeout=5)
+        except Exception:
+            return None
+        if response.status_code != 200:
+            return None
+        for line in response.text.splitlines():
+            if line.startswith('process_resident_memory_bytes '):
+                return round(float(line.split()[1]) / 1024 / 1024, 1)
+        return None
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = self.read_rss_mb()
+            if rss is None and not self.samples:
+                return  # 服务端没有 /metrics
+            if rss is not None:
+                self.samples.append((round(time.perf_counter() - self.started, 2), rss))
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    def summary(self):
+        if not self.samples:
+            return None
+        values = [rss for _, rss in self.samples]
+        return {
+            'start_mb': values[0],
+            'end_mb': values[-1],
+            'max_mb': max(values),
+            'growth_mb': round(values[-1] - values[0], 1),
+            'timeline': [{'t_s': t, 'rss_mb': rss} for t, rss in self.samples]
+        }
+
+
+# ---------------------------------------------------------------- 负载模式
+
+def run_closed_loop(sender, corpus, concurrency, duration=None, total_requests=None):
+    """闭环: concurrency 个线程各自收到响应后立即发送下一个请求"""
+    records = []
+    lock = threading.Lock()
+    counter = iter(range(10 ** 12))
+    deadline = time.perf_counter() + duration if duration else None
+
+    def worker():
+        while True:
+            with lock:
+                index = next(counter)
+            if total_requests is not None and index >= total_requests:
+                return
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            items = sender.items_for(corpus, index)
+            started = time.perf_counter()
+            status, detections, cache_hit, error = sender.send(items)
+            record = (started, time.perf_counter() - started, status, detections, error, items[0]['size'], cache_hit)
+            with lock:
+                records.append(record)
+
+    threads = [threading.Thread(target=worker, name=f'bench-{i}', daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records
+
+
+def run_open_loop(sender, corpus, rate, duration=None, total_requests=None, max_in_flight=64, poisson=False, seed=0):
+    """开环: 按固定到达率 (或泊松到达) 发送请求，不等待前一个请求完成
+
+    延迟从计划发送时刻算起，服务变慢导致客户端积压时也如实计入，避免协调遗漏 (coordinated omission)
+    """
+    records = []
+    lock = threading.Lock()
+    rng = np.random.default_rng(seed)
+    if total_requests is None:
+        total_requests = max(1, int(rate * duration))
+
+    def one(index, scheduled):
+        items = sender.items_for(corpus, index)
+        status, detections, cache_hit, error = sender.send(items)
+        record = (scheduled, time.perf_counter() - scheduled, status, detections, error, items[0]['size'], cache_hit)
+        with lock:
+            records.append(record)
+
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='bench') as pool:
+        started = time.perf_counter()
+        offset = 0.0
+        for index in range(total_requests):
+            scheduled = started + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(one, index, scheduled)
+            offset += rng.exponential(1.0 / rate) if poisson else 1.0 / rate
+    return records
+
+
+# ---------------------------------------------------------------- 统计
+
+def latency_summary(latencies):
+    if not latencies:
+        return None
+    values = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'count': len(values),
+        'mean_ms': round(float(values.mean()), 2),
+        'p50_ms': round(float(p50), 2),
+        'p95_ms': round(float(p95), 2),
+        'p99_ms': round(float(p99), 2),
+        'max_ms': round(float(values.max()), 2)
+    }
+
+
+def summarize(records, elapsed, images_per_request=1):
+    ok = [r for r in records if r[2] == 200 and r[4] is None]
+    status_counts = {}
+    for record in records:
+        key = str(record[2]) if record[2] is not None else 'connection_error'
+        status_counts[key] = status_counts.get(key, 0) + 1
+    errors = [r[4] for r in records if r[4] is not None]
+
+    by_size = {}
+    for size in sorted({r[5] for r in records}):
+        by_size[size] = latency_summary([r[1] for r in ok if r[5] == size])
+
+    return {
+        'requests': len(records),
+        'succeeded': len(ok),
+        'failed': len(records) - len(ok),
+        'error_rate': round((len(records) - len(ok)) / len(records), 4) if records else 0,
+        'status_codes': status_counts,
+        'sample_errors': errors[:5],
+        'elapsed_s': round(elapsed, 2),
+        'throughput_rps': round(len(ok) / elapsed, 2) if elapsed > 0 else 0,
+        'images_per_s': round(len(ok) * images_per_request / elapsed, 2) if elapsed > 0 else 0,
+        'total_detections': int(sum(r[3] for r in ok)),
+        'cache_hits': sum(1 for r in ok if r[6]),
+        'latency': latency_summary([r[1] for r in ok]),
+        'latency_by_size': by_size
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare_results(baseline, current):
+    """打印两次结果的吞吐与延迟变化"""
+    rows = [('throughput_rps', baseline['summary']['throughput_rps'], current['summary']['throughput_rps']),
+            ('error_rate', baseline['summary']['error_rate'], current['summary']['error_rate'])]
+    for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+        before = (baseline['summary']['latency'] or {}).get(key)
+        after = (current['summary']['latency'] or {}).get(key)
+        rows.append((key, before, after))
+    before_rss = (baseline.get('server_rss') or {}).get('max_mb')
+    after_rss = (current.get('server_rss') or {}).get('max_mb')
+    rows.append(('server_rss_max_mb', before_rss, after_rss))
+
+    print(f"\n=== 对比 {baseline['meta'].get('git_revision')} -> {current['meta'].get('git_revision')} ===")
+    for name, before, after in rows:
+        change = ''
+        if before not in (None, 0) and after is not None:
+            change = f" ({(after - before) / before * 100:+.1f}%)"
+        print(f"{name:>20}: {before} -> {after}{change}")
+
+
+# ---------------------------------------------------------------- 本地替身服务
+
+class StubBackend:
+    """桩推理后端: 固定耗时，返回少量随机框，接口与 inference_backends 中的后端一致"""
+
+    name = 'stub'
+    precision = 'fp32'
+    thread_safe = True
+
+    def __init__(self, model_path, latency_ms=20.0, boxes=5):
+        self.model_path = model_path
+        self.latency = latency_ms / 1000
+        self.boxes = boxes
+        self.names = {0: 'cloud'}
+        self._rng = np.random.default_rng(0)
+
+    def prepare_fork(self):
+        pass
+
+    def reset_after_fork(self):
+        return False
+
+    def predict(self, images, conf_threshold=0.5, nms_threshold=0.4, imgsz=None):
+        time.sleep(self.latency * len(images))
+        results = []
+        for image in images:
+            height, width = image.shape[:2]
+            xy = self._rng.uniform(0, 1, (self.boxes, 2)) * [width * 0.8, height * 0.8]
+            wh = self._rng.uniform(0.05, 0.2, (self.boxes, 2)) * [width, height]
+            xyxy = np.concatenate([xy, xy + wh], axis=1).astype(np.float32)
+            confidences = self._rng.uniform(max(conf_threshold, 0.01), 1.0, self.boxes).astype(np.float32)
+            results.append((xyxy, confidences, np.zeros(self.boxes, dtype=np.int64)))
+        return results
+
+
+def create_tiny_model(path):
+    """随机初始化的 yolov8n (由ultralytics内置的 yolov8n.yaml 构建，不需要下载权重)"""
+    import torch
+    from ultralytics import YOLO
+
+    model = YOLO('yolov8n.yaml')
+    torch.save({'model': model.model, 'train_args': {}}, path)
+    return path
+
+
+def start_local_server(app_module='app_minimal', mode='tiny', stub_latency_ms=20.0, port=0):
+    """在进程内启动 Flask 应用 (werkzeug 多线程服务)，返回 (api_url, 关闭函数)"""
+    from werkzeug.serving import make_server
+
+    workdir = tempfile.mkdtemp(prefix='yolo-bench-')
+    model_path = os.path.join(workdir, 'best.pt')
+    # 语料循环发送，默认关闭结果缓存，测的是完整的检测流水线
+    os.environ.setdefault('RESULT_CACHE_MB', '0')
+    module = importlib.import_module(app_module)
+    if mode == 'stub':
+        # 模型文件只用于生成缓存标识，桩后端不会读取
+        with open(model_path, 'wb') as f:
+            f.write(b'stub')
+        module.create_backend = lambda path, *args, **kwargs: StubBackend(path, latency_ms=stub_latency_ms)
+    elif mode == 'tiny':
+        create_tiny_model(model_path)
+    else:
+        raise ValueError(f"未知的本地模式: {mode} (可选: tiny, stub)")
+
+    module.init_detector(model_path)
+    if not module.service_state.ready:
+        raise RuntimeError(f"本地模型加载失败: {module.service_state.error}")
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # 不逐个打印请求日志
+    server = make_server('127.0.0.1', port, module.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, name='local-server', daemon=True)
+    thread.start()
+    return f"http://127.0.0.1:{server.server_port}", server.shutdown
+
+
+# ---------------------------------------------------------------- 入口
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='YOLO检测API压测与基准工具')
+    parser.add_argument('--url', default='http://localhost:5000', help='服务地址')
+    parser.add_argument('--endpoint', choices=['detect', 'detect_batch'], default='detect')
+    parser.add_argument('--input', dest='input_mode', choices=['file', 'base64', 'raw'], default='file',
+                        help='/detect 的上传方式: multipart / Base64 JSON / 原始二进制请求体')
+    parser.add_argument('--response', dest='response_format', choices=['json', 'msgpack', 'f32'], default='json',
+                        help='/detect 的响应格式 (Accept 协商)')
+    parser.add_argument('--batch-size', type=int, default=4, help='/detect_batch 每个请求的图像数')
+    parser.add_argument('--concurrency', type=int, default=4, help='闭环模式的并发客户端数')
+    parser.add_argument('--rate', type=float, default=None, help='开环模式的到达率 (请求/秒)，设置后忽略 --concurrency')
+    parser.add_argument('--poisson', action='store_true', help='开环模式按泊松过程到达，而不是固定间隔')
+    parser.add_argument('--max-in-flight', type=int, default=64, help='开环模式客户端最多同时等待的请求数')
+    parser.add_argument('--duration', type=float, default=30, help='压测时长 (秒)')
+    parser.add_argument('--requests', type=int, default=None, help='请求总数 (设置后忽略 --duration)')
+    parser.add_argument('--warmup', type=int, default=2, help='正式计时前的预热请求数')
+    parser.add_argument('--images', default=None, help='图片目录，不设置时生成合成图像')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='合成图像尺寸，逗号分隔 (WxH)')
+    parser.add_argument('--per-size', type=int, default=2, help='每种尺寸生成的图像数')
+    parser.add_argument('--conf', type=float, default=0.25, help='置信度阈值')
+    parser.add_argument('--nms', type=float, default=0.4, help='NMS阈值')
+    parser.add_argument('--timeout', type=float, default=120, help='单个请求超时 (秒)')
+    parser.add_argument('--rss-interval', type=float, default=1.0, help='抓取服务端RSS的间隔 (秒)')
+    parser.add_argument('--local', choices=['tiny', 'stub'], default=None,
+                        help='在进程内启动本地替身服务: tiny=随机初始化的yolov8n, stub=桩推理后端')
+    parser.add_argument('--local-app', default='app_minimal', choices=['app_minimal', 'app_pytorch'])
+    parser.add_argument('--stub-latency-ms', type=float, default=20.0, help='桩后端每张图像的推理耗时')
+    parser.add_argument('--label', default=None, help='结果标签 (例如版本号)')
+    parser.add_argument('--output', default=None, help='结果JSON文件路径')
+    parser.add_argument('--compare', default=None, help='与之前保存的结果JSON对比')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    shutdown = None
+    api_url = args.url
+    if args.local:
+        print(f"启动本地替身服务 ({args.local_app}, {args.local})...")
+        api_url, shutdown = start_local_server(args.local_app, args.local, args.stub_latency_ms)
+
+    try:
+        health = YOLOClient(api_url).health_check()
+        if health is None:
+            print(f"服务不可用: {api_url}")
+            return 1
+
+        corpus = build_corpus(args.images, args.sizes, args.per_size)
+        print(f"图像语料: {len(corpus)} 张, 尺寸 {sorted({item['size'] for item in corpus})}")
+
+        sender = RequestSender(api_url, args.endpoint, args.input_mode, args.batch_size,
+                               args.conf, args.nms, args.timeout, args.response_format)
+        for index in range(args.warmup):
+            sender.send(sender.items_for(corpus, index))
+
+        sampler = RssSampler(api_url, args.rss_interval)
+        sampler.start()
+        started = time.perf_counter()
+        if args.rate:
+            mode = 'open_loop'
+            print(f"开环压测: {args.rate} 请求/秒{' (泊松)' if args.poisson else ''}")
+            records = run_open_loop(sender, corpus, args.rate, args.duration, args.requests,
+                                    args.max_in_flight, args.poisson)
+        else:
+            mode = 'closed_loop'
+            print(f"闭环压测: {args.concurrency} 个并发客户端")
+            records = run_closed_loop(sender, corpus, args.concurrency,
+                                      None if args.requests else args.duration, args.requests)
+        elapsed = time.perf_counter() - started
+        sampler.stop()
+
+        images_per_request = args.batch_size if args.endpoint == 'detect_batch' else 1
+        result = {
+            'meta': {
+                'label': args.label,
+                'timestamp': datetime.now().isoformat(),
+                'git_revision': git_revision(),
+                'api_url': api_url,
+                'local': args.local,
+                'mode': mode,
+                'endpoint': args.endpoint,
+                'input_mode': args.input_mode,
+                'response_format': args.response_format,
+                'concurrency': None if args.rate else args.concurrency,
+                'rate': args.rate,
+                'poisson': args.poisson,
+                'batch_size': images_per_request,
+                'corpus': {'images': len(corpus), 'sizes': sorted({item['size'] for item in corpus}),
+                           'bytes': sum(len(item['bytes']) for item in corpus)},
+                'conf_threshold': args.conf,
+                'nms_threshold': args.nms,
+                'client': {'python': platform.python_version(), 'platform': platform.platform()},
+                'server': {key: health.get(key) for key in ('model_type', 'inference_backend', 'model_precision')
+                           if key in health}
+            },
+            'summary': summarize(records, elapsed, images_per_request),
+            'server_rss': sampler.summary()
+        }
+    finally:
+        if shutdown is not None:
+            shutdown()
+
+    summary = result['summary']
+    latency = summary['latency'] or {}
+    print(f"\n=== 结果 ({mode}, {args.endpoint}) ===")
+    print(f"请求: {summary['requests']}, 成功: {summary['succeeded']}, 错误率: {summary['error_rate'] * 100:.2f}% "
+          f"{summary['status_codes']}")
+    print(f"吞吐: {summary['throughput_rps']} 请求/秒 ({summary['images_per_s']} 图像/秒)")
+    print(f"延迟: p50 {latency.get('p50_ms')}ms, p95 {latency.get('p95_ms')}ms, p99 {latency.get('p99_ms')}ms")
+    for size, stats in summary['latency_by_size'].items():
+        if stats:
+            print(f"  {size:>12}: p50 {stats['p50_ms']}ms, p95 {stats['p95_ms']}ms ({stats['count']} 次)")
+    if result['server_rss']:
+        rss = result['server_rss']
+        print(f"服务端RSS: {rss['start_mb']} -> {rss['end_mb']} MB (峰值 {rss['max_mb']} MB)")
+    if summary['cache_hits']:
+        print(f"注意: {summary['cache_hits']} 个请求命中服务端结果缓存 (服务端可设置 RESULT_CACHE_MB=0)")
+    if summary['sample_errors']:
+        print(f"错误示例: {summary['sample_errors'][:3]}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"结果已保存到: {args.output}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare_results(json.load(f), result)
+    return 0 if summary['succeeded'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+离线批量检测 (归档重处理)
+不经过HTTP，直接在进程池中运行 YOLODetector / MinimalYOLODetector：
+
+    python bulk_detect.py /data/sky_archive --output results.jsonl
+    python bulk_detect.py /data/sky_archive --output results.parquet --detector pytorch --workers 4
+
+- 递归遍历目录 (按路径排序，顺序稳定)，每个工作进程加载一份模型，进程数按CPU核数和可用内存确定
+- 工作进程内用后台线程预读取并解码下一批图像，与推理重叠
+- 结果流式写入 JSONL (每行一张图像)，或 Parquet (输出为目录，每次运行写一个分片文件)
+- 已完成图像的路径摘要追加写入 <output>.checkpoint；中断后用相同参数重新运行即从断点继续，
+  已完成的图像不会重新检测 (结果先于检查点落盘，中断瞬间的最后一批可能在输出中重复出现，可按 path 去重)
+"""
+
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime
+import multiprocessing
+
+import numpy as np
+
+from resource_plan import available_cpus
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+# 检测器类型 -> (模块, 类名, 每个副本的预估内存MB)
+DETECTORS = {
+    'minimal': ('app_minimal', 'MinimalYOLODetector', 400),
+    'pytorch': ('app_pytorch', 'YOLODetector', 900),
+}
+
+
+# ---------------------------------------------------------------- 目录遍历与检查点
+
+def iter_images(root, extensions=IMAGE_EXTENSIONS):
+    """递归遍历目录，按路径排序产出 (绝对路径, 相对路径)，不会一次列出整棵目录树"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(extensions):
+                path = os.path.join(dirpath, name)
+                yield path, os.path.relpath(path, root)
+
+
+def path_digest(relpath):
+    """相对路径的64位摘要，检查点中只保存摘要，百万张图像约8MB"""
+    return int.from_bytes(hashlib.blake2b(relpath.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class Checkpoint:
+    """已完成图像的检查点: 追加写入的 uint64 路径摘要"""
+
+    def __init__(self, path):
+        self.path = path
+        done = np.zeros(0, dtype='<u8')
+        if os.path.exists(path):
+            size = os.path.getsize(path)
+            # 中断时最后一条可能只写了一半，丢弃不完整的尾部
+            done = np.fromfile(path, dtype='<u8', count=size // 8)
+            if size % 8:
+                os.truncate(path, size // 8 * 8)
+        self.done = np.unique(done)
+        self._file = open(path, 'ab')
+
+    def __len__(self):
+        return len(self.done)
+
+    def pending(self, digests):
+        """返回未完成的掩码"""
+        if not len(self.done):
+            return np.ones(len(digests), dtype=bool)
+        return ~np.isin(np.asarray(digests, dtype='<u8'), self.done)
+
+    def mark(self, digests):
+        self._file.write(np.asarray(digests, dtype='<u8').tobytes())
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def iter_chunks(root, checkpoint, chunk_size, stats):
+    """按 chunk_size 分组产出未完成的图像 [(绝对路径, 相对路径, 摘要)]，跳过检查点中已完成的图像"""
+    batch = []
+
+    def flush():
+        digests = [path_digest(relpath) for _, relpath in batch]
+        keep = checkpoint.pending(digests)
+        stats['skipped'] += int((~keep).sum())
+        return [(path, relpath, digest) for (path, relpath), digest, k in zip(batch, digests, keep) if k]
+
+    for item in iter_images(root):
+        batch.append(item)
+        if len(batch) >= chunk_size:
+            chunk = flush()
+            batch = []
+            if chunk:
+                yield chunk
+    if batch:
+        chunk = flush()
+        if chunk:
+            yield chunk
+
+
+# ---------------------------------------------------------------- 输出
+
+class JsonlWriter:
+    def __init__(self, path):
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, records):
+        for record in records:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """Parquet 输出为目录，每次运行写一个分片 (Parquet文件不能追加)，读取时按目录读取整个数据集"""
+
+    def __init__(self, path, row_group_size=10000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("写入Parquet需要安装 pyarrow (pip install pyarrow)，或改用 .jsonl 输出")
+        self._pa = pa
+        self._pq = pq
+        os.makedirs(path, exist_ok=True)
+        self.path = os.path.join(path, f"part-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.parquet")
+        self.schema = pa.schema([
+            ('path', pa.string()),
+            ('width', pa.int32()),
+            ('height', pa.int32()),
+            ('total_detections', pa.int32()),
+            ('bbox', pa.list_(pa.list_(pa.int32(), 4))),
+            ('confidence', pa.list_(pa.float32())),
+            ('class_id', pa.list_(pa.int32())),
+            ('class_name', pa.list_(pa.string())),
+            ('error', pa.string()),
+            ('elapsed_ms', pa.float32()),
+        ])
+        self.row_group_size = row_group_size
+        self._rows = []
+        self._writer = None
+
+    def write(self, records):
+        for record in records:
+            predictions = record.get('predictions') or []
+            self._rows.append({
+                'path': record['path'],
+                'width': record.get('width'),
+                'height': record.get('height'),
+                'total_detections': record.get('total_detections', 0),
+                'bbox': [p['bbox'] for p in predictions],
+                'confidence': [p['confidence'] for p in predictions],
+                'class_id': [p['class_id'] for p in predictions],
+                'class_name': [p['class_name'] for p in predictions],
+                'error': record.get('error'),
+                'elapsed_ms': record.get('elapsed_ms'),
+            })
+        # 检查点只记录已写入的行组，未写满的行在这里先落盘
+        self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        table = self._pa.Table.from_pylist(self._rows, schema=self.schema)
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self.path, self.schema)
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+        self._rows = []
+
+    def close(self):
+        self._flush()
+        if self._writer is not None:
+            self._writer.close()
+
+
+def open_writer(path):
+    if path.endswith('.parquet'):
+        return ParquetWriter(path)
+    return JsonlWriter(path)
+
+
+# ---------------------------------------------------------------- 工作进程
+
+_detector = None
+_decode = None
+_options = {}
+
+
+def _init_worker(detector_name, model_path, threads, prefetch, batch_size, quiet):
+    """工作进程初始化: 限制推理线程数后加载一份模型"""
+    global _detector, _decode
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+    # 在导入torch/onnxruntime之前限制线程数，N个副本共享CPU时避免过度订阅
+    for name in ('INFERENCE_THREADS', 'OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[name] = str(threads)
+    # 离线处理不需要微批调度和结果缓存
+    os.environ['MICRO_BATCH'] = '0'
+    os.environ['RESULT_CACHE_MB'] = '0'
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C 由主进程处理
+
+    import cv2
+    cv2.setNumThreads(1)  # 解码在预取线程中并行
+
+    module_name, class_name, _ = DETECTORS[detector_name]
+    module = importlib.import_module(module_name)
+    detector = getattr(module, class_name)(model_path)
+    if not getattr(detector, 'model_loaded', True):
+        raise RuntimeError(f"模型加载失败: {detector.load_error}")
+
+    from detection_utils import decode_image_bytes, decode_image_reduced
+    if detector_name == 'minimal':
+        # 按输入尺寸降采样解码，框按 decode_scale 映射回原图坐标
+        _decode = lambda data: decode_image_reduced(data, detector.input_size)
+    else:
+        _decode = lambda data: (decode_image_bytes(data), None)
+    _detector = detector
+    _options.update(prefetch=prefetch, batch_size=batch_size)
+
+
+def _load(path):
+    """预取线程: 读取并解码一张图像，返回 (image, decode_scale, 原图宽, 原图高, 错误)"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        image, decode_scale = _decode(data)
+        if image is None:
+            return None, None, None, None, '无法解析图像'
+        width, height = decode_scale[2:] if decode_scale else (image.shape[1], image.shape[0])
+        return image, decode_scale, int(width), int(height), None
+    except Exception as e:
+        return None, None, None, None, f"{type(e).__name__}: {e}"
+
+
+def process_chunk(chunk, conf_threshold, nms_threshold):
+    """在工作进程中检测一组图像，返回结果记录 (与输入顺序一致)"""
+    batch_size = _options['batch_size']
+    records = []
+    with ThreadPoolExecutor(max_workers=_options['prefetch'], thread_name_prefix='prefetch') as pool:
+        # 解码任务全部提交给预取线程，推理当前批次时后续图像继续在后台解码
+        loaded = [pool.submit(_load, path) for path, _, _ in chunk]
+        for start in range(0, len(chunk), batch_size):
+            items = chunk[start:start + batch_size]
+            results = [future.result() for future in loaded[start:start + batch_size]]
+            for index in range(start, start + len(items)):
+                loaded[index] = None  # 释放已取出的图像引用
+
+            valid = [i for i, result in enumerate(results) if result[0] is not None]
+            started = time.perf_counter()
+            predictions = {}
+            if valid:
+                images = [results[i][0] for i in valid]
+                kwargs = {}
+                if any(results[i][1] is not None for i in valid):
+                    kwargs['decode_scales'] = [results[i][1] for i in valid]
+                outputs = _detector.detect_many(images, conf_threshold, nms_threshold, **kwargs)
+                predictions = dict(zip(valid, outputs))
+            elapsed_ms = (time.perf_counter() - started) * 1000 / max(1, len(valid))
+
+            for i, ((_, relpath, digest), result) in enumerate(zip(items, results)):
+                _, _, width, height, error = result
+                record = {'path': relpath, 'width': width, 'height': height}
+                if error is not None:
+                    record.update(error=error, predictions=None, total_detections=0)
+                else:
+                    record.update(predictions=predictions[i], total_detections=len(predictions[i]),
+                                  elapsed_ms=round(elapsed_ms, 2))
+                records.append(record)
+    return records
+
+
+# ---------------------------------------------------------------- 资源规划
+
+def available_memory_mb():
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def plan_workers(detector_name, requested=None, replica_mb=None):
+    """进程数 = min(CPU核数 (含cgroup配额), 可用内存 / 每个副本的内存)，至少1个"""
+    cpus = available_cpus()
+    if requested:
+        return int(requested), cpus
+    replica_mb = replica_mb or DETECTORS[detector_name][2]
+    memory_mb = available_memory_mb()
+    by_memory = memory_mb // replica_mb if memory_mb else cpus
+    return max(1, min(cpus, by_memory)), cpus
+
+
+# ---------------------------------------------------------------- 入口
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='离线批量检测 (目录递归，可断点续跑)')
+    parser.add_argument('input_dir', help='图片根目录')
+    parser.add_argument('--output', default='results.jsonl', help='输出文件: .jsonl 或 .parquet (目录)')
+    parser.add_argument('--detector', choices=sorted(DETECTORS), default='minimal', help='检测器实现')
+    parser.add_argument('--model', default=os.getenv('MODEL_PATH', 'models/best.pt'), help='模型路径')
+    parser.add_argument('--conf', type=float, default=0.5, help='置信度阈值')
+    parser.add_argument('--nms', type=float, default=0.4, help='NMS阈值')
+    parser.add_argument('--workers', type=int, default=None, help='模型副本 (进程) 数，默认按CPU核数和可用内存确定')
+    parser.add_argument('--replica-mb', type=int, default=None, help='每个模型副本的预估内存 (MB)')
+    parser.add_argument('--threads', type=int, default=None, help='每个副本的推理线程数，默认 CPU核数 / 进程数')
+    parser.add_argument('--prefetch', type=int, default=2, help='每个进程的预读取/解码线程数')
+    parser.add_argument('--batch-size', type=int, default=4, help='每次前向推理的图像数')
+    parser.add_argument('--chunk-size', type=int, default=64, help='每个任务的图像数 (也是检查点的粒度)')
+    parser.add_argument('--restart', action='store_true', help='忽略已有检查点，从头处理')
+    parser.add_argument('--verbose', action='store_true', help='保留工作进程中检测器的输出')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.isdir(args.input_dir):
+        print(f"目录不存在: {args.input_dir}")
+        return 1
+
+    workers, cpus = plan_workers(args.detector, args.workers, args.replica_mb)
+    threads = args.threads or max(1, cpus // workers)
+    checkpoint_path = args.output.rstrip('/') + '.checkpoint'
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = Checkpoint(checkpoint_path)
+    writer = open_writer(args.output)
+
+    print(f"输入: {args.input_dir}")
+    print(f"输出: {args.output} (检查点 {checkpoint_path}, 已完成 {len(checkpoint)} 张)")
+    print(f"检测器: {args.detector}, {workers} 个进程 x {threads} 线程, 预取线程 {args.prefetch}, "
+          f"batch {args.batch_size}")
+
+    stats = {'processed': 0, 'failed': 0, 'detections': 0, 'skipped': 0}
+    stopping = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        if not stopping:
+            print("\n收到中断信号，等待进行中的任务完成后退出 (再次运行即可继续)...")
+        stopping = True
+
+    previous_handler = signal.signal(signal.SIGINT, request_stop)
+    started = time.perf_counter()
+    last_report = started
+    chunks = iter_chunks(args.input_dir, checkpoint, args.chunk_size, stats)
+    # spawn: 工作进程在导入推理库之前设置线程数
+    context = multiprocessing.get_context('spawn')
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(args.detector, args.model, threads, args.prefetch,
+                                           args.batch_size, not args.verbose)) as pool:
+            pending = {}
+
+            def submit_next():
+                if stopping:
+                    return False
+                for chunk in chunks:
+                    pending[pool.submit(process_chunk, chunk, args.conf, args.nms)] = chunk
+                    return True
+                return False
+
+            # 每个进程最多两个任务在途，目录遍历与结果写出都是流式的
+            for _ in range(workers * 2):
+                if not submit_next():
+                    break
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk = pending.pop(future)
+                    records = future.result()
+                    # 先写结果再记检查点: 中断时最多重复一批，不会丢失
+                    writer.write(records)
+                    checkpoint.mark([digest for _, _, digest in chunk])
+                    stats['processed'] += len(records)
+                    stats['failed'] += sum(1 for r in records if r.get('error'))
+                    stats['detections'] += sum(r['total_detections'] for r in records)
+                    submit_next()
+
+                now = time.perf_counter()
+                if now - last_report >= 10:
+                    last_report = now
+                    rate = stats['processed'] / (now - started)
+                    print(f"已处理 {stats['processed']} 张 ({rate:.1f} 张/秒), 失败 {stats['failed']}, "
+                          f"跳过已完成 {stats['skipped']}")
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+        writer.close()
+        checkpoint.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"\n{'已中断' if stopping else '完成'}: 处理 {stats['processed']} 张, 失败 {stats['failed']}, "
+          f"检测框 {stats['detections']}, 跳过已完成 {stats['skipped']}, "
+          f"耗时 {elapsed:.1f}秒 ({stats['processed'] / elapsed if elapsed else 0:.1f} 张/秒)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,39 +13,97 @@ import cv2
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import os
+import mimetypes
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 紧凑响应格式 (服务端 wire_format.py)，通过 Accept 头协商
+RESPONSE_MEDIA_TYPES = {
+    'json': 'application/json',
+    'msgpack': 'application/x-msgpack',
+    'f32': 'application/x-yolo-f32',
+}
+
+# JPEG可在解码时按DCT缩放 1/8、1/4、1/2，预先缩小大图时不必先解码全分辨率
+_REDUCED_READ_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+_EXIF_ORIENTATION = 0x0112
 
 class YOLOClient:
-    def __init__(self, api_url="http://localhost:5000"):
-        """初始化客户端"""
+    def __init__(self, api_url="http://localhost:5000", response_format="json", pool_size=8, max_retries=3,
+                 backoff_factor=0.5, timeout=120, shrink_uploads=False, jpeg_quality=90):
+        """初始化客户端
+
+        response_format: json / msgpack (需要安装 msgpack) / f32，检测结果解析后格式相同
+        pool_size: 连接池大小，也是 detect_files() 的默认并发数
+        max_retries / backoff_factor: 重试次数和指数退避系数。连接错误 (请求未发出) 对所有请求重试；
+            429/502/503/504 只对幂等请求 (GET等，遵循 Retry-After) 重试，POST /detect 可能已被处理或请求体已被读取，不自动重发
+        shrink_uploads: 上传前按服务端的输入尺寸缩小图像 (见 prepare_upload)，返回的框仍为原图坐标
+        """
         self.api_url = api_url
         self.session = requests.Session()
+        self.response_format = response_format
+        self.pool_size = max(1, int(pool_size))
+        self.timeout = timeout
+        self.shrink_uploads = shrink_uploads
+        self.jpeg_quality = jpeg_quality
+        self.raw_upload = True  # 服务端不支持原始二进制上传时自动退回 multipart
+        self._class_names = None
+        self._input_size = None
+        self._batch_max_images = None
+
+        # 有界连接池: 并发请求最多占用 pool_size 个连接，超出的请求等待空闲连接
+        retry = Retry(total=max_retries, backoff_factor=backoff_factor, status_forcelist=(429, 502, 503, 504),
+                      respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
     
     def health_check(self):
         """健康检查"""
         try:
-            response = self.session.get(f"{self.api_url}/health")
+            response = self.session.get(f"{self.api_url}/health", timeout=self.timeout)
             return response.json() if response.status_code == 200 else None
         except Exception as e:
             print(f"健康检查失败: {e}")
             return None
     
-    def detect_from_file(self, image_path, conf_threshold=0.5, nms_threshold=0.4):
-        """从文件路径检测"""
+    def detect_from_file(self, image_path, conf_threshold=0.5, nms_threshold=0.4, shrink=None):
+        """从文件路径检测 - 优先以原始二进制请求体上传，旧版本服务端退回 multipart
+
+        shrink 为空时按 shrink_uploads；缩小上传时返回的框已映射回原图坐标
+        """
         if not os.path.exists(image_path):
             print(f"图片文件不存在: {image_path}")
             return None
         
         try:
-            with open(image_path, 'rb') as f:
-                files = {'image': f}
-                data = {
-                    'conf_threshold': conf_threshold,
-                    'nms_threshold': nms_threshold
-                }
-                response = self.session.post(f"{self.api_url}/detect", files=files, data=data)
+            if self.shrink_uploads if shrink is None else shrink:
+                image_bytes, content_type, scale = self.prepare_upload(image_path)
+            else:
+                with open(image_path, 'rb') as f:
+                    image_bytes = f.read()
+                content_type, scale = mimetypes.guess_type(image_path)[0] or 'application/octet-stream', None
+        except Exception as e:
+            print(f"读取图片失败: {image_path} - {e}")
+            return None
+        
+        if self.raw_upload:
+            result = self.detect_raw(image_bytes, conf_threshold, nms_threshold, content_type=content_type)
+            if result is not None or self.raw_upload:
+                return self.rescale_result(result, scale)
+        
+        try:
+            files = {'image': (os.path.basename(image_path), image_bytes, content_type)}
+            data = {
+                'conf_threshold': conf_threshold,
+                'nms_threshold': nms_threshold
+            }
+            response = self.session.post(f"{self.api_url}/detect", files=files, data=data,
+                                         headers=self.accept_header(), timeout=self.timeout)
             
             if response.status_code == 200:
-                return response.json()
+                return self.rescale_result(self.parse_response(response), scale)
             else:
                 print(f"检测失败: {response.status_code} - {response.text}")
                 return None
@@ -53,6 +111,184 @@ class YOLOClient:
             print(f"文件检测失败: {e}")
             return None
     
+    def detect_raw(self, image, conf_threshold=0.5, nms_threshold=0.4, tiled=False,
+                   content_type='application/octet-stream'):
+        """原始二进制上传 - 请求体就是图像字节，阈值放在查询参数中
+
+        image 为图片路径或图像字节；比Base64 JSON小约25%，服务端也不需要先解析JSON再解码Base64
+        """
+        try:
+            if isinstance(image, str):
+                content_type = mimetypes.guess_type(image)[0] or content_type
+                with open(image, 'rb') as f:
+                    image = f.read()
+            
+            params = {'conf_threshold': conf_threshold, 'nms_threshold': nms_threshold}
+            if tiled:
+                params['tiled'] = 1
+            headers = dict(self.accept_header(), **{'Content-Type': content_type})
+            response = self.session.post(f"{self.api_url}/detect", params=params, data=image, headers=headers,
+                                         timeout=self.timeout)
+            
+            if response.status_code == 200:
+                return self.parse_response(response)
+            if response.status_code in (400, 415) and 'Base64' in response.text:
+                # 旧版本服务端只接受 multipart / Base64 JSON
+                print("服务端不支持原始二进制上传，改用 multipart")
+                self.raw_upload = False
+                return None
+            print(f"检测失败: {response.status_code} - {response.text}")
+            return None
+        except Exception as e:
+            print(f"二进制上传检测失败: {e}")
+            return None
+    
+    def server_input_size(self, default=640):
+        """服务端模型的输入尺寸 (从 /health 获取一次后缓存)，旧版本服务端未提供时为 default"""
+        if self._input_size is None:
+            health = self.health_check() or {}
+            self._input_size = int(health.get('input_size') or default)
+        return self._input_size
+    
+    def server_batch_max_images(self):
+        """服务端单次 /detect_batch 的最多图像数 (从 /health 获取一次后缓存)，未提供时为0 (不拆分)"""
+        if self._batch_max_images is None:
+            health = self.health_check() or {}
+            self._batch_max_images = int(health.get('batch_max_images') or 0)
+        return self._batch_max_images
+    
+    def prepare_upload(self, image_path, max_side=None):
+        """读取图片并缩小到长边不超过 max_side (默认为服务端输入尺寸) 后重新编码为JPEG
+
+        服务端反正会把图像letterbox到输入尺寸，大图在客户端缩小后上传体积和服务端解码开销都小得多。
+        JPEG按DCT缩放直接解码到接近目标的尺寸，不分配全分辨率数组。
+        返回 (图像字节, Content-Type, scale)；scale 为 (原图宽/上传宽, 原图高/上传高, 原图宽, 原图高)，未缩小时为None
+        """
+        max_side = int(max_side or self.server_input_size())
+        with Image.open(image_path) as img:
+            width, height = img.size
+            # OpenCV 解码时会按EXIF方向旋转，原图尺寸也按旋转后计算
+            if img.getexif().get(_EXIF_ORIENTATION) in (5, 6, 7, 8):
+                width, height = height, width
+        
+        if max(width, height) <= max_side:
+            with open(image_path, 'rb') as f:
+                return f.read(), mimetypes.guess_type(image_path)[0] or 'application/octet-stream', None
+        
+        read_flag = cv2.IMREAD_COLOR
+        for factor, flag in _REDUCED_READ_FLAGS:
+            if max(width, height) / factor >= max_side:
+                read_flag = flag
+                break
+        image = cv2.imread(image_path, read_flag)
+        if image is None:
+            raise ValueError(f"无法解码图片: {image_path}")
+        
+        ratio = max_side / max(image.shape[:2])
+        if ratio < 1:
+            size = (max(1, round(image.shape[1] * ratio)), max(1, round(image.shape[0] * ratio)))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            raise ValueError(f"JPEG编码失败: {image_path}")
+        sent_height, sent_width = image.shape[:2]
+        return encoded.tobytes(), 'image/jpeg', (width / sent_width, height / sent_height, width, height)
+    
+    @staticmethod
+    def rescale_result(result, scale):
+        """把缩小上传得到的框映射回原图坐标 (scale 来自 prepare_upload)，可直接用于 visualize_results"""
+        if not result or scale is None or 'predictions' not in result:
+            return result
+        scale_x, scale_y, width, height = scale
+        factors = np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+        limits = np.array([width, height, width, height], dtype=np.float32)
+        
+        def rescale(boxes):
+            boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4) * factors
+            return np.clip(boxes, 0, limits)
+        
+        predictions = result['predictions']
+        if isinstance(predictions, dict):
+            predictions['bbox'] = rescale(predictions['bbox']).astype(np.int64).tolist()
+        elif predictions:
+            boxes = rescale([p['bbox'] for p in predictions]).astype(np.int64).tolist()
+            for prediction, bbox in zip(predictions, boxes):
+                prediction['bbox'] = bbox
+        if 'arrays' in result:
+            result['arrays']['boxes'] = rescale(result['arrays']['boxes'])
+        result['original_size'] = [width, height]
+        result['upload_scale'] = [round(scale_x, 4), round(scale_y, 4)]
+        return result
+    
+    def detect_files(self, image_paths, conf_threshold=0.5, nms_threshold=0.4, shrink=True, workers=None):
+        """高吞吐模式 - 并发检测多个文件，按完成顺序产出 (路径, 结果)
+
+        文件在工作线程中逐个读取和缩小，同时在途的请求数不超过 2 x workers，
+        image_paths 可以是很长的生成器，内存占用与文件总数无关；失败的文件结果为None
+        """
+        workers = max(1, int(workers or self.pool_size))
+        paths = iter(image_paths)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='yolo-client') as pool:
+            pending = {}
+            
+            def submit_next():
+                for path in paths:
+                    future = pool.submit(self.detect_from_file, path, conf_threshold, nms_threshold, shrink)
+                    pending[future] = path
+                    return True
+                return False
+            
+            for _ in range(workers * 2):
+                if not submit_next():
+                    break
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future)
+                    yield path, future.result()
+                    submit_next()
+    
+    def accept_header(self):
+        """按 response_format 生成 Accept 请求头"""
+        return {'Accept': RESPONSE_MEDIA_TYPES.get(self.response_format, 'application/json')}
+    
+    def class_names(self):
+        """类别ID -> 类别名 (从 /health 获取一次后缓存)，f32 响应中只有类别ID"""
+        if self._class_names is None:
+            health = self.health_check() or {}
+            self._class_names = {int(k): v for k, v in (health.get('model_classes') or {}).items()}
+        return self._class_names
+    
+    def parse_response(self, response):
+        """解析 /detect 响应 (JSON / MessagePack / 打包float32)，统一为JSON响应的结构
+
+        紧凑格式解析后 predictions 为行式列表，另在 arrays 中给出 NumPy 数组 (boxes / confidences / class_ids)
+        """
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+        if content_type == RESPONSE_MEDIA_TYPES['msgpack']:
+            import msgpack
+            result = msgpack.unpackb(response.content, raw=False)
+            boxes = np.frombuffer(result.pop('boxes'), dtype='<f4').reshape(-1, 4)
+            confidences = np.frombuffer(result.pop('confidences'), dtype='<f4')
+            class_ids = np.frombuffer(result.pop('class_ids'), dtype='<i4')
+            names = {int(k): v for k, v in result.pop('class_names', {}).items()}
+        elif content_type == RESPONSE_MEDIA_TYPES['f32']:
+            result = json.loads(response.headers.get('X-Detection-Meta', '{}'))
+            packed = np.frombuffer(response.content, dtype='<f4').reshape(-1, 6)
+            boxes, confidences, class_ids = packed[:, :4], packed[:, 4], packed[:, 5].astype(np.int32)
+            names = self.class_names()
+        else:
+            return response.json()
+        
+        result['predictions'] = [
+            {'bbox': [int(v) for v in box], 'confidence': float(conf), 'class_id': int(cls),
+             'class_name': names.get(int(cls), f'class_{int(cls)}')}
+            for box, conf, cls in zip(boxes, confidences, class_ids)
+        ]
+        result['total_detections'] = len(result['predictions'])
+        result['arrays'] = {'boxes': boxes, 'confidences': confidences, 'class_ids': class_ids}
+        return result
+    
     def detect_from_base64(self, image_path, conf_threshold=0.5, nms_threshold=0.4):
         """从Base64编码检测"""
         if not os.path.exists(image_path):
@@ -75,11 +311,12 @@ class YOLOClient:
             response = self.session.post(
                 f"{self.api_url}/detect",
                 json=data,
-                headers={'Content-Type': 'application/json'}
+                headers=dict(self.accept_header(), **{'Content-Type': 'application/json'}),
+                timeout=self.timeout
             )
             
             if response.status_code == 200:
-                return response.json()
+                return self.parse_response(response)
             else:
                 print(f"检测失败: {response.status_code} - {response.text}")
                 return None
@@ -87,20 +324,50 @@ class YOLOClient:
             print(f"Base64检测失败: {e}")
             return None
     
-    def detect_batch(self, image_paths, conf_threshold=0.5, nms_threshold=0.4):
-        """批量检测"""
+    def detect_batch(self, image_paths, conf_threshold=0.5, nms_threshold=0.4, shrink=None, batch_size=None):
+        """批量检测
+
+        shrink 为空时按 shrink_uploads，缩小后再Base64编码，请求体小得多；
+        batch_size 为空时按服务端的 batch_max_images 拆分为多个请求，通过连接池并发发送，结果按输入顺序合并
+        """
+        shrink = self.shrink_uploads if shrink is None else shrink
+        if batch_size is None:
+            batch_size = self.server_batch_max_images() or len(image_paths)
+        batch_size = max(1, int(batch_size))
+        chunks = [image_paths[i:i + batch_size] for i in range(0, len(image_paths), batch_size)]
+        if not chunks:
+            return None
+        
+        with ThreadPoolExecutor(max_workers=min(len(chunks), self.pool_size)) as pool:
+            responses = list(pool.map(lambda chunk: self._post_batch(chunk, conf_threshold, nms_threshold, shrink),
+                                      chunks))
+        if any(response is None for response in responses):
+            return None
+        
+        merged = dict(responses[0])
+        merged['results'] = [result for response in responses for result in response['results']]
+        merged['total_images'] = len(merged['results'])
+        merged['requests'] = len(responses)
+        return merged
+    
+    def _post_batch(self, image_paths, conf_threshold, nms_threshold, shrink):
+        """发送一个 /detect_batch 请求 (图像逐个读取、缩小并Base64编码)"""
         try:
-            # 读取所有图片并转换为Base64
             images_base64 = []
+            scales = []
             for image_path in image_paths:
                 if os.path.exists(image_path):
-                    with open(image_path, 'rb') as f:
-                        image_data = f.read()
-                        image_base64 = base64.b64encode(image_data).decode('utf-8')
-                        images_base64.append(image_base64)
+                    if shrink:
+                        image_data, _, scale = self.prepare_upload(image_path)
+                    else:
+                        with open(image_path, 'rb') as f:
+                            image_data, scale = f.read(), None
+                    images_base64.append(base64.b64encode(image_data).decode('utf-8'))
+                    scales.append(scale)
                 else:
                     print(f"图片文件不存在: {image_path}")
                     images_base64.append("")  # 空字符串表示无效图片
+                    scales.append(None)
             
             # 发送批量请求
             data = {
@@ -112,11 +379,15 @@ class YOLOClient:
             response = self.session.post(
                 f"{self.api_url}/detect_batch",
                 json=data,
-                headers={'Content-Type': 'application/json'}
+                headers={'Content-Type': 'application/json'},
+                timeout=self.timeout
             )
             
             if response.status_code == 200:
-                return response.json()
+                result = response.json()
+                result['results'] = [self.rescale_result(item, scale)
+                                     for item, scale in zip(result['results'], scales)]
+                return result
             else:
                 print(f"批量检测失败: {response.status_code} - {response.text}")
                 return None
@@ -124,6 +395,44 @@ class YOLOClient:
             print(f"批量检测失败: {e}")
             return None
     
+    def detect_stream(self, frames, camera_id=None, conf_threshold=0.5, nms_threshold=0.4,
+                      change_threshold=None, max_interval=None, boundary="frame"):
+        """帧流检测 - 在一个分块上传的连接里发送 MJPEG 帧，逐帧返回结果
+
+        frames 为JPEG字节或图片路径的可迭代对象 (可以是持续产生帧的生成器)
+        """
+        def body():
+            for frame in frames:
+                if isinstance(frame, str):
+                    with open(frame, 'rb') as f:
+                        frame = f.read()
+                yield (f"--{boundary}\r\nContent-Type: image/jpeg\r\n"
+                       f"Content-Length: {len(frame)}\r\n\r\n").encode('latin-1') + frame + b"\r\n"
+            yield f"--{boundary}--\r\n".encode('latin-1')
+
+        params = {'conf_threshold': conf_threshold, 'nms_threshold': nms_threshold}
+        if camera_id is not None:
+            params['camera'] = camera_id
+        if change_threshold is not None:
+            params['change_threshold'] = change_threshold
+        if max_interval is not None:
+            params['max_interval'] = max_interval
+
+        # 生成器作为请求体时 requests 使用 Transfer-Encoding: chunked
+        response = self.session.post(
+            f"{self.api_url}/detect_stream",
+            params=params,
+            data=body(),
+            headers={'Content-Type': f'multipart/x-mixed-replace; boundary={boundary}'},
+            stream=True
+        )
+        if response.status_code != 200:
+            print(f"帧流检测失败: {response.status_code} - {response.text}")
+            return
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
+
     def visualize_results(self, image_path, results, output_path=None):
         """可视化检测结果"""
         if not results or 'predictions' not in results:
@@ -206,6 +515,12 @@ def main():
             else:
                 print(f"图片 {i+1}: {result['error']}")
     
+    # 高吞吐模式: 缩小到服务端输入尺寸后并发上传，框映射回原图坐标
+    print("\n=== 并发检测 (缩小上传) ===")
+    for path, file_result in client.detect_files([test_image, test_image, test_image]):
+        if file_result:
+            print(f"{path}: 检测到 {file_result['total_detections']} 个目标")
+    
     # 可视化结果
     if result:
         print("\n=== 可视化结果 ===")
@@ -1,79 +1,256 @@
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, ttk
 from PIL import Image, ImageTk, ImageDraw
 import requests
-import base64
-import io
+from requests.adapters import HTTPAdapter
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+import threading
 
 API_URL = "http://localhost:5000/detect"
+WORKERS = int(os.getenv("GUI_WORKERS", 4))          # 后台检测线程数 (同时在途的请求数)
+THUMBNAIL_SIZE = (500, 400)
+THUMBNAIL_CACHE_SIZE = int(os.getenv("GUI_THUMBNAIL_CACHE", 64))  # 缓存的已解码缩略图数量
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+class ThumbnailCache:
+    """已解码缩略图的LRU缓存: 路径 -> (缩略图, 原图尺寸)
+
+    每张图片只解码一次，检测框按比例画在缩略图上，不再为画框重新打开原图
+    """
+
+    def __init__(self, max_items=THUMBNAIL_CACHE_SIZE):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        with self._lock:
+            item = self._items.get(path)
+            if item is not None:
+                self._items.move_to_end(path)
+                return item
+        img = Image.open(path)
+        original_size = img.size
+        img.draft("RGB", THUMBNAIL_SIZE)  # JPEG 按DCT缩放解码，大图不再整张解码
+        img = img.convert("RGB")
+        img.thumbnail(THUMBNAIL_SIZE)
+        item = (img, original_size)
+        with self._lock:
+            self._items[path] = item
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return item
+
 
 class DetectApp:
     def __init__(self, root):
         self.root = root
         self.root.title("YOLO能效标识检测GUI")
-        self.root.geometry("800x600")
+        self.root.geometry("800x700")
         self.image_path = None
         self.img_panel = None
         self.result_text = None
+        # 复用连接的会话，后台线程池发请求，主线程只负责界面
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=WORKERS))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=WORKERS))
+        self.executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="detect")
+        self.thumbnails = ThumbnailCache()
+        self.events = queue.Queue()  # 后台线程 -> 主线程 (Tk 不是线程安全的)
+        self.results = {}            # 路径 -> 检测结果
+        self.batch_paths = []
+        self.futures = []
+        self.cancel_event = threading.Event()
+        self.pending = 0
         self.create_widgets()
+        self.root.protocol("WM_DELETE_WINDOW", self.quit)
+        self.root.after(50, self.poll_events)
 
     def create_widgets(self):
         btn_frame = tk.Frame(self.root)
         btn_frame.pack(pady=10)
 
         tk.Button(btn_frame, text="选择图片", command=self.select_image).pack(side=tk.LEFT, padx=5)
-        tk.Button(btn_frame, text="检测", command=self.detect_image).pack(side=tk.LEFT, padx=5)
-        tk.Button(btn_frame, text="退出", command=self.root.quit).pack(side=tk.LEFT, padx=5)
+        tk.Button(btn_frame, text="选择文件夹", command=self.select_folder).pack(side=tk.LEFT, padx=5)
+        self.detect_button = tk.Button(btn_frame, text="检测", command=self.detect_image)
+        self.detect_button.pack(side=tk.LEFT, padx=5)
+        self.cancel_button = tk.Button(btn_frame, text="取消", command=self.cancel, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+        tk.Button(btn_frame, text="退出", command=self.quit).pack(side=tk.LEFT, padx=5)
+
+        progress_frame = tk.Frame(self.root)
+        progress_frame.pack(fill=tk.X, padx=10)
+        self.progress = ttk.Progressbar(progress_frame, mode="determinate")
+        self.progress.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.status = tk.Label(progress_frame, text="", width=24, anchor=tk.W)
+        self.status.pack(side=tk.LEFT, padx=5)
 
         self.img_panel = tk.Label(self.root)
         self.img_panel.pack(pady=10)
 
-        self.result_text = tk.Text(self.root, height=10, width=90)
-        self.result_text.pack(pady=10)
+        bottom = tk.Frame(self.root)
+        bottom.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        # 文件夹批量检测的文件列表，点击查看对应结果
+        self.file_list = tk.Listbox(bottom, width=28, height=10)
+        self.file_list.pack(side=tk.LEFT, fill=tk.Y)
+        self.file_list.bind("<<ListboxSelect>>", self.on_select_file)
+        self.result_text = tk.Text(bottom, height=10, width=60)
+        self.result_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(10, 0))
 
     def select_image(self):
         path = filedialog.askopenfilename(filetypes=[("Image Files", "*.jpg;*.jpeg;*.png;*.bmp")])
         if path:
             self.image_path = path
-            img = Image.open(path)
-            img.thumbnail((500, 400))
-            self.tk_img = ImageTk.PhotoImage(img)
-            self.img_panel.config(image=self.tk_img)
+            self.batch_paths = [path]
+            self.file_list.delete(0, tk.END)
+            self.file_list.insert(tk.END, os.path.basename(path))
+            self.show_image(path)
             self.result_text.delete(1.0, tk.END)
 
+    def select_folder(self):
+        folder = filedialog.askdirectory()
+        if not folder:
+            return
+        paths = sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                       if name.lower().endswith(IMAGE_EXTENSIONS))
+        if not paths:
+            messagebox.showwarning("提示", "文件夹中没有图片！")
+            return
+        self.image_path = paths[0]
+        self.batch_paths = paths
+        self.file_list.delete(0, tk.END)
+        for path in paths:
+            self.file_list.insert(tk.END, os.path.basename(path))
+        self.result_text.delete(1.0, tk.END)
+        self.result_text.insert(tk.END, f"已选择 {len(paths)} 张图片，点击\"检测\"开始批量检测\n")
+        self.show_image(paths[0])
+
     def detect_image(self):
-        if not self.image_path:
+        if not self.batch_paths:
             messagebox.showwarning("提示", "请先选择图片！")
             return
+        if self.pending:
+            return
+        # 全部提交到线程池，同时在途的请求不超过 WORKERS 个，界面不阻塞
+        self.cancel_event.clear()
+        self.pending = len(self.batch_paths)
+        self.progress.config(maximum=self.pending, value=0)
+        self.status.config(text=f"0/{self.pending}")
+        self.detect_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.result_text.delete(1.0, tk.END)
+        self.futures = [self.executor.submit(self.detect_worker, path) for path in self.batch_paths]
+
+    def detect_worker(self, path):
+        """后台线程: 上传检测并准备缩略图，结果放入事件队列由主线程显示"""
+        if self.cancel_event.is_set():
+            self.events.put(("cancelled", path, None))
+            return
         try:
-            with open(self.image_path, "rb") as f:
-                files = {"image": f}
-                response = requests.post(API_URL, files=files)
+            with open(path, "rb") as f:
+                response = self.session.post(API_URL, files={"image": f}, timeout=120)
             result = response.json()
-            if not result.get("success"):
-                self.result_text.insert(tk.END, f"检测失败: {result.get('error', '未知错误')}\n")
-                return
-            self.result_text.delete(1.0, tk.END)
-            self.result_text.insert(tk.END, f"检测到 {result['total_detections']} 个目标\n")
-            for i, pred in enumerate(result["predictions"]):
-                self.result_text.insert(tk.END, f"目标{i+1}: {pred['class_name']} 置信度: {pred['confidence']:.2f} 坐标: {pred['bbox']}\n")
-            # 显示带框图片
-            self.show_detected_image(result["predictions"])
+            self.thumbnails.get(path)
+            self.events.put(("done", path, result))
         except Exception as e:
-            self.result_text.insert(tk.END, f"检测失败: {e}\n")
+            self.events.put(("error", path, str(e)))
 
-    def show_detected_image(self, predictions):
-        img = Image.open(self.image_path).convert("RGB")
+    def cancel(self):
+        """取消尚未开始的检测，正在进行的请求完成后结束"""
+        self.cancel_event.set()
+        for future in self.futures:
+            if future.cancel():
+                self.events.put(("cancelled", None, None))
+        self.cancel_button.config(state=tk.DISABLED)
+
+    def poll_events(self):
+        try:
+            while True:
+                kind, path, payload = self.events.get_nowait()
+                self.handle_event(kind, path, payload)
+        except queue.Empty:
+            pass
+        self.root.after(50, self.poll_events)
+
+    def handle_event(self, kind, path, payload):
+        self.pending -= 1
+        done = int(self.progress["maximum"]) - self.pending
+        self.progress.config(value=done)
+        self.status.config(text=f"{done}/{int(self.progress['maximum'])}")
+        if kind == "done":
+            self.results[path] = payload
+            name = os.path.basename(path)
+            if payload.get("success"):
+                self.result_text.insert(tk.END, f"{name}: 检测到 {payload['total_detections']} 个目标\n")
+            else:
+                self.result_text.insert(tk.END, f"{name}: 检测失败: {payload.get('error', '未知错误')}\n")
+            # 单张检测或当前选中的图片，直接在缩略图上画框
+            if path == self.image_path:
+                self.show_result(path)
+        elif kind == "error":
+            self.result_text.insert(tk.END, f"{os.path.basename(path)}: 检测失败: {payload}\n")
+        self.result_text.see(tk.END)
+        if self.pending <= 0:
+            self.pending = 0
+            self.futures = []
+            self.detect_button.config(state=tk.NORMAL)
+            self.cancel_button.config(state=tk.DISABLED)
+            self.status.config(text=("已取消 " if self.cancel_event.is_set() else "完成 ") + self.status["text"])
+
+    def on_select_file(self, event):
+        selection = self.file_list.curselection()
+        if not selection:
+            return
+        self.image_path = self.batch_paths[selection[0]]
+        self.show_result(self.image_path)
+
+    def show_result(self, path):
+        result = self.results.get(path)
+        if not result or not result.get("success"):
+            self.show_image(path)
+            return
+        self.result_text.insert(tk.END, f"--- {os.path.basename(path)}: {result['total_detections']} 个目标\n")
+        for i, pred in enumerate(result["predictions"]):
+            self.result_text.insert(tk.END, f"目标{i+1}: {pred['class_name']} 置信度: {pred['confidence']:.2f} 坐标: {pred['bbox']}\n")
+        self.result_text.see(tk.END)
+        # 显示带框图片
+        self.show_detected_image(path, result["predictions"])
+
+    def show_image(self, path):
+        try:
+            thumbnail, _ = self.thumbnails.get(path)
+        except Exception as e:
+            self.result_text.insert(tk.END, f"无法打开图片: {e}\n")
+            return
+        self.tk_img = ImageTk.PhotoImage(thumbnail)
+        self.img_panel.config(image=self.tk_img)
+
+    def show_detected_image(self, path, predictions):
+        # 在缓存的缩略图副本上画框，坐标按缩放比例换算
+        thumbnail, (width, height) = self.thumbnails.get(path)
+        img = thumbnail.copy()
+        scale_x = img.width / width
+        scale_y = img.height / height
         draw = ImageDraw.Draw(img)
         for pred in predictions:
-            bbox = pred["bbox"]
-            draw.rectangle(bbox, outline="red", width=3)
-            draw.text((bbox[0], bbox[1]-10), f"{pred['class_name']} {pred['confidence']:.2f}", fill="red")
-        img.thumbnail((500, 400))
+            x1, y1, x2, y2 = pred["bbox"]
+            bbox = [x1 * scale_x, y1 * scale_y, x2 * scale_x, y2 * scale_y]
+            draw.rectangle(bbox, outline="red", width=2)
+            draw.text((bbox[0], max(0, bbox[1] - 10)), f"{pred['class_name']} {pred['confidence']:.2f}", fill="red")
         self.tk_img = ImageTk.PhotoImage(img)
         self.img_panel.config(image=self.tk_img)
 
+    def quit(self):
+        self.cancel_event.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+        self.root.quit()
+
 if __name__ == "__main__":
     root = tk.Tk()
     app = DetectApp(root)
-    root.mainloop() 
\ No newline at end of file
+    root.mainloop()
@@ -0,0 +1,268 @@
+"""
+检测公共工具
+app_pytorch.py 与 app_minimal.py 共用的图像预处理与结果后处理函数
+"""
+
+import io
+
+import cv2
+import numpy as np
+
+
+def letterbox_geometry(height, width, new_size, stride=None):
+    """letterbox 的缩放与填充参数
+
+    返回 (缩放比例, (缩放后宽, 缩放后高), (目标宽, 目标高), (pad_x, pad_y))
+    """
+    ratio = min(new_size / height, new_size / width)
+    new_width = int(round(width * ratio))
+    new_height = int(round(height * ratio))
+
+    if stride:
+        target_width = new_width + (new_size - new_width) % stride
+        target_height = new_height + (new_size - new_height) % stride
+    else:
+        target_width = target_height = new_size
+
+    pad_x = (target_width - new_width) // 2
+    pad_y = (target_height - new_height) // 2
+    return ratio, (new_width, new_height), (target_width, target_height), (pad_x, pad_y)
+
+
+def batch_letterbox_shape(shapes, new_size, stride=None):
+    """一批图像共用的letterbox目标尺寸 (宽, 高)
+
+    stride 不为 None 时取各图像矩形letterbox尺寸的最大值，尺寸相同的图像与单张矩形推理完全一致；
+    否则为 new_size x new_size 正方形
+    """
+    if not stride:
+        return new_size, new_size
+    targets = [letterbox_geometry(shape[0], shape[1], new_size, stride)[2] for shape in shapes]
+    return max(width for width, _ in targets), max(height for _, height in targets)
+
+
+def letterbox(image, new_size, color=(114, 114, 114), stride=None, target=None):
+    """等比缩放并居中填充到 new_size x new_size
+
+    stride 不为 None 时只填充到 stride 的整数倍 (矩形推理，与ultralytics auto=True 一致)；
+    target 为 (宽, 高) 时填充到该尺寸 (批量推理时一批图像共用的尺寸，见 batch_letterbox_shape)
+    返回 (填充后的图像, 缩放比例, (pad_x, pad_y))
+    """
+    height, width = image.shape[:2]
+    ratio, (new_width, new_height), (target_width, target_height), _ = letterbox_geometry(
+        height, width, new_size, stride)
+    if target is not None:
+        target_width, target_height = target
+    pad_x = (target_width - new_width) // 2
+    pad_y = (target_height - new_height) // 2
+
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+
+    canvas = np.full((target_height, target_width, 3), color, dtype=np.uint8)
+    canvas[pad_y:pad_y + new_height, pad_x:pad_x + new_width] = image
+    return canvas, ratio, (pad_x, pad_y)
+
+
+def unletterbox_boxes(xyxy, ratio, pad, orig_shape):
+    """把letterbox坐标系下的xyxy框映射回原图坐标，并裁剪到图像边界"""
+    boxes = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4).copy()
+    boxes[:, [0, 2]] -= pad[0]
+    boxes[:, [1, 3]] -= pad[1]
+    boxes /= ratio
+    height, width = orig_shape[:2]
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+    return boxes
+
+
+def nms(boxes, scores, iou_threshold):
+    """NumPy版NMS，返回保留框的下标 (按得分降序)
+
+    与 torchvision.ops.nms 语义一致：IoU 大于阈值的框被抑制
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+    if len(boxes) == 0:
+        return np.zeros((0,), dtype=np.int64)
+
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+    order = scores.argsort(kind='stable')[::-1]
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        inter_w = (np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest])).clip(0)
+        inter_h = (np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest])).clip(0)
+        inter = inter_w * inter_h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-7)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def batched_nms(boxes, scores, class_ids, iou_threshold, max_det=300, max_wh=7680):
+    """按类别做NMS (同ultralytics：给不同类别的框加上大偏移后统一NMS)"""
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    if len(boxes) == 0:
+        return np.zeros((0,), dtype=np.int64)
+    offsets = np.asarray(class_ids, dtype=np.float32).reshape(-1, 1) * max_wh
+    keep = nms(boxes + offsets, scores, iou_threshold)
+    return keep[:max_det]
+
+
+def decode_image_bytes(image_bytes):
+    """把原始字节解码为BGR图像，失败返回None"""
+    if not image_bytes:
+        return None
+    image_array = np.frombuffer(image_bytes, np.uint8)
+    return cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+
+
+# JPEG可在解码时按DCT缩放 1/2、1/4、1/8，其它格式由OpenCV解码后再缩小
+_REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def read_image_size(image_bytes):
+    """只解析文件头获取 (width, height)，不解码像素；无法识别时返回None"""
+    from PIL import Image  # 只在需要读取文件头时导入，缩短冷启动
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as header:
+            return header.size
+    except Exception:
+        return None
+
+
+def decode_image_reduced(image_bytes, target_size):
+    """按目标尺寸降采样解码
+
+    先读文件头拿到原图尺寸，选择能让长边仍不小于 target_size 的最大缩小倍数
+    (IMREAD_REDUCED_COLOR_2/4/8)，避免先解码全分辨率再缩小。
+    返回 (image, decode_scale)；decode_scale 为 (scale_x, scale_y, 原图宽, 原图高)，
+    未缩小时为None。解码失败返回 (None, None)
+    """
+    if not image_bytes:
+        return None, None
+    image_array = np.frombuffer(image_bytes, np.uint8)
+
+    size = read_image_size(image_bytes)
+    factor, flag = 1, cv2.IMREAD_COLOR
+    if size is not None:
+        for candidate, candidate_flag in _REDUCED_DECODE_FLAGS:
+            if max(size) / candidate >= target_size:
+                factor, flag = candidate, candidate_flag
+                break
+
+    image = cv2.imdecode(image_array, flag)
+    if image is None and factor > 1:
+        factor = 1
+        image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+    if image is None or factor == 1:
+        return image, None
+
+    width, height = size
+    decoded_height, decoded_width = image.shape[:2]
+    # EXIF方向会让解码结果相对文件头宽高旋转90度
+    if (decoded_width > decoded_height) != (width > height) and decoded_width != decoded_height:
+        width, height = height, width
+    return image, (width / decoded_width, height / decoded_height, width, height)
+
+
+def restore_decode_scale(xyxy, decode_scale):
+    """把降采样解码图像上的框映射回原图坐标"""
+    if decode_scale is None:
+        return xyxy
+    scale_x, scale_y, width, height = decode_scale
+    xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4) * np.array([scale_x, scale_y, scale_x, scale_y],
+                                                                         dtype=np.float32)
+    xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, width)
+    xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, height)
+    return xyxy
+
+
+def batch_tensor_bytes(imgsz):
+    """单张图像在批量推理中的内存估算 (letterbox uint8 + float32 输入张量)"""
+    return imgsz * imgsz * 3 * (1 + 4)
+
+
+def batch_limit(imgsz, max_batch_size, memory_budget_bytes):
+    """单次前向推理的最大图像数 (批大小与内存上限取小)"""
+    return max(1, min(max_batch_size, memory_budget_bytes // batch_tensor_bytes(imgsz)))
+
+
+def split_batches(count, imgsz, max_batch_size, memory_budget_bytes):
+    """按批大小与内存上限把 count 张图像切分成若干次前向推理
+
+    返回 [(start, end), ...]
+    """
+    chunk = batch_limit(imgsz, max_batch_size, memory_budget_bytes)
+    return [(start, min(start + chunk, count)) for start in range(0, count, chunk)]
+
+
+def boxes_to_arrays(boxes):
+    """ultralytics Boxes 一次性转为NumPy数组 (xyxy, confidence, class_id)
+
+    boxes.data 为 [N, 6] 张量 (x1, y1, x2, y2, conf, cls)，只做一次 .cpu().numpy()
+    """
+    if boxes is None or len(boxes) == 0:
+        return (np.zeros((0, 4), dtype=np.float32),
+                np.zeros((0,), dtype=np.float32),
+                np.zeros((0,), dtype=np.int64))
+    data = boxes.data.cpu().numpy()
+    return data[:, :4], data[:, 4], data[:, 5].astype(np.int64)
+
+
+def build_predictions(xyxy, confidences, class_ids, names, conf_threshold=None, columnar=False):
+    """把数组形式的检测结果批量转换为响应格式
+
+    默认返回 [{'bbox', 'confidence', 'class_id', 'class_name'}, ...]；
+    columnar=True 时返回 {'bbox': [[...]], 'confidence': [...], 'class_id': [...]}
+    """
+    xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+    confidences = np.asarray(confidences, dtype=np.float32).reshape(-1)
+    class_ids = np.asarray(class_ids).reshape(-1).astype(np.int64)
+
+    if conf_threshold is not None:
+        keep = confidences >= conf_threshold
+        xyxy, confidences, class_ids = xyxy[keep], confidences[keep], class_ids[keep]
+
+    # astype 向零截断，与逐个 int() 的结果一致
+    bboxes = xyxy.astype(np.int64).tolist()
+    confidence_list = confidences.tolist()
+    class_id_list = class_ids.tolist()
+
+    if columnar:
+        return {'bbox': bboxes, 'confidence': confidence_list, 'class_id': class_id_list}
+
+    # 每个类别只查一次类别名
+    class_names = {class_id: names.get(class_id, f'class_{class_id}') for class_id in set(class_id_list)}
+    return [
+        {'bbox': bbox, 'confidence': confidence, 'class_id': class_id, 'class_name': class_names[class_id]}
+        for bbox, confidence, class_id in zip(bboxes, confidence_list, class_id_list)
+    ]
+
+
+def count_predictions(predictions):
+    """统计检测数量，兼容行式与列式两种格式"""
+    if isinstance(predictions, dict):
+        return len(predictions['confidence'])
+    return len(predictions)
+
+
+def is_columnar_format(value):
+    """解析请求中的 format 参数"""
+    return str(value or '').lower() == 'columnar'
+
+
+def is_enabled(value):
+    """解析请求中的布尔开关参数 (1/true/yes/on)"""
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'on')
@@ -0,0 +1,261 @@
+"""
+天空相机帧流
+/detect_stream 在一个分块上传 (chunked) 的连接里持续接收 multipart/x-mixed-replace (MJPEG) 帧，
+每帧先用低分辨率灰度缩略图和上一次检测的参考帧做差分：
+画面变化超过阈值或距上次检测超过最大间隔才调用 detector.detect()，否则直接复用上一次的预测结果
+"""
+
+import json
+import re
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from detection_utils import count_predictions
+
+_BOUNDARY_RE = re.compile(r'boundary="?([^";,]+)"?', re.IGNORECASE)
+
+
+def parse_boundary(content_type):
+    """从 Content-Type 中取出 multipart 边界，没有时返回None"""
+    match = _BOUNDARY_RE.search(content_type or '')
+    return match.group(1).encode('latin-1') if match else None
+
+
+def iter_multipart_frames(stream, boundary, chunk_size=64 * 1024, max_frame_bytes=32 * 1024 * 1024):
+    """从请求体流中逐个读取 multipart 分段的内容
+
+    分段头里有 Content-Length 时直接按长度读取，否则扫描到下一个边界为止；
+    只在缓冲区中保留当前这一帧，内存占用与流的总长度无关
+    """
+    delimiter = b'--' + boundary
+    buffer = b''
+    eof = False
+
+    def fill():
+        nonlocal buffer, eof
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer += chunk
+
+    while True:
+        # 定位分段起始边界
+        start = buffer.find(delimiter)
+        while start < 0 and not eof:
+            # 保留可能被截断的边界前缀
+            buffer = buffer[-len(delimiter):]
+            fill()
+            start = buffer.find(delimiter)
+        if start < 0:
+            return
+        buffer = buffer[start + len(delimiter):]
+
+        # 分段头以空行结束；"--boundary--" 表示流结束
+        while b'\r\n\r\n' not in buffer and not eof and len(buffer) < 16 * 1024:
+            fill()
+        if buffer.startswith(b'--'):
+            return
+        header_end = buffer.find(b'\r\n\r\n')
+        if header_end < 0:
+            return
+        headers = buffer[:header_end].decode('latin-1').lower()
+        buffer = buffer[header_end + 4:]
+
+        length = None
+        for line in headers.split('\r\n'):
+            if line.startswith('content-length:'):
+                try:
+                    length = int(line.split(':', 1)[1])
+                except ValueError:
+                    length = None
+
+        if length is not None:
+            if length > max_frame_bytes:
+                raise ValueError(f'单帧超过上限: {length} > {max_frame_bytes} 字节')
+            while len(buffer) < length and not eof:
+                fill()
+            frame, buffer = buffer[:length], buffer[length:]
+        else:
+            end = buffer.find(b'\r\n' + delimiter)
+            while end < 0 and not eof:
+                if len(buffer) > max_frame_bytes:
+                    raise ValueError(f'单帧超过上限: {max_frame_bytes} 字节')
+                fill()
+                end = buffer.find(b'\r\n' + delimiter)
+            if end < 0:
+                frame, buffer = buffer, b''
+            else:
+                frame, buffer = buffer[:end], buffer[end + 2:]
+
+        if frame:
+            yield frame
+
+
+def frame_thumbnail(image_bytes, size=64):
+    """帧差分用的灰度缩略图 (float32, size x size)
+
+    JPEG 用 IMREAD_REDUCED_GRAYSCALE_8 直接解码到1/8分辨率，代价远小于完整解码
+    """
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None:
+        return None
+    return cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+class ChangeGate:
+    """按画面变化决定是否需要重新检测
+
+    score 为缩略图与参考帧的平均绝对差 (0-1)。参考帧只在真正检测时更新，
+    云层缓慢漂移时变化会逐帧累积，最终仍会触发检测
+    """
+
+    def __init__(self, threshold=0.02, max_interval_s=30.0, thumbnail_size=64):
+        self.threshold = float(threshold)
+        self.max_interval = float(max_interval_s)
+        self.thumbnail_size = int(thumbnail_size)
+        self.reference = None
+        self.last_detect_at = None
+        self.frames = 0
+        self.detections = 0
+
+    def check(self, image_bytes, force=False):
+        """返回 (是否需要检测, 变化分数)；force 或无法生成缩略图时总是检测"""
+        self.frames += 1
+        now = time.monotonic()
+        thumbnail = frame_thumbnail(image_bytes, self.thumbnail_size)
+
+        score = None
+        if thumbnail is not None and self.reference is not None:
+            score = float(np.mean(np.abs(thumbnail - self.reference))) / 255.0
+
+        expired = self.last_detect_at is None or now - self.last_detect_at >= self.max_interval
+        if force or score is None or score > self.threshold or expired:
+            self.reference = thumbnail
+            self.last_detect_at = now
+            self.detections += 1
+            return True, score
+        return False, score
+
+    @property
+    def skipped(self):
+        return self.frames - self.detections
+
+    @property
+    def skip_ratio(self):
+        return round(self.skipped / self.frames, 4) if self.frames else 0
+
+
+class StreamStats:
+    """所有帧流连接的汇总统计与并发上限
+
+    每个帧流连接在整个生命周期内占用一个 gthread 工作线程，max_streams 限制同时打开的连接数
+    (0为不限制)，给普通 /detect 请求留出线程
+    """
+
+    def __init__(self, max_streams=0):
+        self._lock = threading.Lock()
+        self.max_streams = max(0, int(max_streams))
+        self.active_streams = 0
+        self.total_streams = 0
+        self.rejected = 0
+        self.frames = 0
+        self.detections = 0
+
+    def try_open(self):
+        """占用一个连接名额，已满时返回False"""
+        with self._lock:
+            if self.max_streams and self.active_streams >= self.max_streams:
+                self.rejected += 1
+                return False
+            self.active_streams += 1
+            self.total_streams += 1
+            return True
+
+    def closed(self, gate):
+        with self._lock:
+            self.active_streams -= 1
+            self.frames += gate.frames
+            self.detections += gate.detections
+
+    def stats(self):
+        with self._lock:
+            skipped = self.frames - self.detections
+            return {
+                'active_streams': self.active_streams,
+                'max_streams': self.max_streams or None,
+                'total_streams': self.total_streams,
+                'rejected': self.rejected,
+                'frames': self.frames,
+                'detections': self.detections,
+                'skipped': skipped,
+                'skip_ratio': round(skipped / self.frames, 4) if self.frames else 0
+            }
+
+
+class FrameError(Exception):
+    """单帧检测失败，stream_results 输出该帧的错误行后继续处理后续帧
+
+    retryable=True 表示暂时性失败 (如内存压力)，客户端可在 retry_after 秒后重发该帧
+    """
+
+    def __init__(self, message, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def stream_results(frames, gate, detect_frame, camera_id=None):
+    """对帧序列执行变化门控检测，逐帧产出 NDJSON 行
+
+    detect_frame(image_bytes) -> predictions，解码失败返回None，检测失败抛出 FrameError
+    """
+    predictions = None
+    for index, image_bytes in enumerate(frames):
+        started = time.perf_counter()
+        run, score = gate.check(image_bytes, force=predictions is None)
+        if run:
+            try:
+                result = detect_frame(image_bytes)
+            except FrameError as e:
+                line = {'frame': index, 'camera': camera_id, 'success': False, 'error': str(e),
+                        'retryable': e.retryable}
+                if e.retry_after is not None:
+                    line['retry_after'] = e.retry_after
+                yield _line(line)
+                continue
+            if result is None:
+                yield _line({'frame': index, 'camera': camera_id, 'success': False, 'error': '无法解析图像',
+                             'retryable': False})
+                continue
+            predictions = result
+            skipped = False
+        else:
+            skipped = True
+
+        yield _line({
+            'frame': index,
+            'camera': camera_id,
+            'success': True,
+            'skipped': skipped,
+            'change_score': round(score, 5) if score is not None else None,
+            'predictions': predictions,
+            'total_detections': count_predictions(predictions),
+            'skip_ratio': gate.skip_ratio,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)
+        })
+
+    yield _line({
+        'done': True,
+        'camera': camera_id,
+        'frames': gate.frames,
+        'detections': gate.detections,
+        'skipped': gate.skipped,
+        'skip_ratio': gate.skip_ratio
+    })
+
+
+def _line(payload):
+    return json.dumps(payload, ensure_ascii=False) + '\n'
@@ -0,0 +1,31 @@
+"""
+gunicorn 配置 (bind、worker类型等命令行参数仍在 Dockerfile 中指定)
+配合 --preload 'app:create_app()' 使用：模型在master中加载并预热，fork 后在每个worker里恢复推理线程
+
+worker 数与每个worker的推理/OpenCV线程数由 resource_plan.py 按 cgroup CPU配额、内存上限和模型内存占用规划
+(有 resource_plan.py --benchmark 的自测结果时直接采用)。命令行的 --workers 或 WEB_CONCURRENCY 优先
+"""
+
+import resource_plan
+
+# 本文件在导入应用之前执行，线程数环境变量在 numpy / torch / onnxruntime 加载前生效
+plan = resource_plan.plan_resources()
+resource_plan.export_thread_env(plan)
+workers = plan['workers']
+
+
+def on_starting(server):
+    server.log.info(
+        "资源规划 (%s): %d workers x %d 推理线程, OpenCV %d 线程 (可用核数 %d, 内存上限 %dMB, 单worker约 %dMB)",
+        plan['source'], plan['workers'], plan['inference_threads'], plan['opencv_threads'],
+        plan['cpus'], plan['memory_limit_mb'], plan['worker_memory_mb'])
+
+
+def post_fork(server, worker):
+    import sys
+
+    resource_plan.apply_opencv_threads()
+    # 只有在master中预加载过模型时才需要处理
+    lifecycle = sys.modules.get('lifecycle')
+    if lifecycle is not None:
+        lifecycle.after_fork()
@@ -0,0 +1,275 @@
+"""
+推理后端
+YOLODetector / MinimalYOLODetector 通过统一的 predict() 接口调用模型：
+
+    predict(images, conf_threshold, nms_threshold, imgsz=None)
+        -> [(xyxy, confidence, class_id), ...]   每张输入图像一组NumPy数组，坐标为输入图像坐标
+
+由环境变量 INFERENCE_BACKEND 选择：
+    ultralytics  - ultralytics.YOLO 加载 .pt (默认)
+    onnxruntime  - ONNX Runtime CPU 推理，自带NumPy letterbox与NMS，不需要导入torch
+
+MODEL_PRECISION=int8 时使用INT8量化的ONNX模型 (强制 onnxruntime 后端)，
+QUANT_CALIB_DIR 指定校准图像目录 (静态量化)，未指定则动态量化
+
+FAST_START=1 且未设置 INFERENCE_BACKEND 时默认使用 onnxruntime：冷启动不导入torch/ultralytics，
+直接加载 MODEL_PATH 旁缓存的 .onnx (镜像构建时可预先导出)
+"""
+
+import ast
+import os
+
+import numpy as np
+
+from detection_utils import letterbox, unletterbox_boxes, batched_nms, boxes_to_arrays
+
+DEFAULT_BACKEND = 'ultralytics'
+FAST_START = os.getenv('FAST_START', '0') == '1'
+
+
+def default_backend_name():
+    """INFERENCE_BACKEND 未设置时的默认后端"""
+    return os.getenv('INFERENCE_BACKEND') or ('onnxruntime' if FAST_START else DEFAULT_BACKEND)
+
+
+class UltralyticsBackend:
+    """ultralytics.YOLO (PyTorch) 推理"""
+
+    name = 'ultralytics'
+    precision = 'fp32'
+    thread_safe = False  # predictor 内部有状态，并发调用需加锁
+    fixed_size = None
+    # predict() 每张图像的 LetterBox、BGR->RGB、float32 三次拷贝，predict_tensor() 只在后处理时把输入转回一次uint8
+    preprocess_allocations = 2
+
+    def __init__(self, model_path, task='detect', num_threads=None):
+        # 延迟导入，选择其它后端时不加载torch
+        from ultralytics import YOLO
+
+        if num_threads:
+            import torch
+            torch.set_num_threads(int(num_threads))  # 不设置时torch为每个核开一个线程，多worker会过度订阅
+        self.model_path = model_path
+        self.model = YOLO(model_path, task=task)
+        self.names = self.model.names
+        self._torch_threads = None
+
+    def prepare_fork(self):
+        """gunicorn --preload: fork 前在master中只用单线程推理
+
+        libgomp 的线程池不能跨 fork 使用，master 里一旦启动过多线程并行区，worker 中的推理会卡死；
+        预热时限制为单线程，fork 后在 worker 中恢复 (reset_after_fork)
+        """
+        import torch
+
+        if self._torch_threads is None:
+            self._torch_threads = torch.get_num_threads()
+            torch.set_num_threads(1)
+
+    def reset_after_fork(self):
+        """在worker中恢复推理线程数，返回是否需要重新预热"""
+        if self._torch_threads is not None:
+            import torch
+
+            torch.set_num_threads(self._torch_threads)
+            self._torch_threads = None
+        return False
+
+    def predict(self, images, conf_threshold=0.5, nms_threshold=0.4, imgsz=None):
+        kwargs = {'conf': conf_threshold, 'iou': nms_threshold, 'verbose': False}
+        if imgsz is not None:
+            kwargs['imgsz'] = imgsz
+        results = self.model(images, **kwargs)
+        return [boxes_to_arrays(result.boxes) for result in results]
+
+    def predict_tensor(self, tensor, conf_threshold=0.5, nms_threshold=0.4):
+        """输入已预处理好的 NCHW float32 RGB [0, 1] 张量 (边长为32的倍数)，跳过 ultralytics 的预处理
+
+        torch.from_numpy 与NumPy共享内存，不复制；返回的坐标为张量坐标系
+        """
+        import torch
+
+        results = self.model(torch.from_numpy(tensor), conf=conf_threshold, iou=nms_threshold, verbose=False)
+        return [boxes_to_arrays(result.boxes) for result in results]
+
+
+class OnnxRuntimeBackend:
+    """ONNX Runtime CPU 推理
+
+    预处理 (letterbox、BGR->RGB、归一化) 与后处理 (置信度过滤、按类别NMS) 均按
+    ultralytics 的默认行为实现，输出与 UltralyticsBackend 一致
+    """
+
+    name = 'onnxruntime'
+    thread_safe = True  # InferenceSession.run 可并发调用
+    stride = 32
+    max_det = 300
+    preprocess_allocations = 3  # predict() 每张图像的 letterbox 画布、float32 转换、归一化各一次
+
+    def __init__(self, model_path, imgsz=640, num_threads=None, precision='fp32', calibration_dir=None):
+        import onnxruntime  # noqa: F401  缺少依赖时在导出/量化之前报错
+
+        if model_path.endswith('.pt'):
+            model_path = ensure_onnx_export(model_path, imgsz)
+        if precision == 'int8' and not model_path.endswith('.int8.onnx'):
+            from quantize_model import ensure_int8_model
+            model_path = ensure_int8_model(model_path, calibration_dir, imgsz)
+        self.model_path = model_path
+        self.precision = precision
+        self.num_threads = int(num_threads) if num_threads else None
+        self.session = self._create_session()
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        batch_dim, _, height_dim, width_dim = model_input.shape
+        # 导出时 dynamic=False 的模型只能接受固定的 batch 与输入尺寸
+        self.fixed_batch = batch_dim if isinstance(batch_dim, int) else None
+        self.fixed_size = height_dim if isinstance(height_dim, int) and isinstance(width_dim, int) else None
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata['names']) if 'names' in metadata else {}
+        exported_imgsz = ast.literal_eval(metadata['imgsz']) if 'imgsz' in metadata else [imgsz, imgsz]
+        self.imgsz = self.fixed_size or int(max(exported_imgsz))
+
+    def _create_session(self):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.num_threads:
+            options.intra_op_num_threads = self.num_threads
+        return ort.InferenceSession(self.model_path, options, providers=['CPUExecutionProvider'])
+
+    def prepare_fork(self):
+        """ONNX Runtime 会话在 fork 前无需特殊处理"""
+
+    def reset_after_fork(self):
+        """会话的线程池不会随 fork 进入worker，多线程会话在worker中重建 (权重只有几MB)
+
+        返回是否重建了会话 (需要重新预热)
+        """
+        if self.num_threads == 1 or (self.num_threads is None and (os.cpu_count() or 1) == 1):
+            return False
+        self.session = self._create_session()
+        return True
+
+    def predict(self, images, conf_threshold=0.5, nms_threshold=0.4, imgsz=None):
+        imgsz = self.fixed_size or imgsz or self.imgsz
+        # 尺寸相同的图像用矩形letterbox (同ultralytics auto=True)，尺寸不同时统一为正方形以便堆叠成batch
+        same_shape = len({image.shape[:2] for image in images}) == 1
+        stride = self.stride if same_shape and self.fixed_size is None else None
+
+        canvases = []
+        metas = []
+        for image in images:
+            canvas, ratio, pad = letterbox(image, imgsz, stride=stride)
+            canvases.append(canvas)
+            metas.append((ratio, pad, image.shape))
+
+        outputs = self._run(self._to_blob(canvases))
+
+        return [
+            self._postprocess(output, conf_threshold, nms_threshold, ratio, pad, orig_shape)
+            for output, (ratio, pad, orig_shape) in zip(outputs, metas)
+        ]
+
+    def predict_tensor(self, tensor, conf_threshold=0.5, nms_threshold=0.4):
+        """输入已预处理好的 NCHW float32 RGB [0, 1] 张量，直接送入会话；返回的坐标为张量坐标系"""
+        outputs = self._run(tensor)
+        return [self._postprocess(output, conf_threshold, nms_threshold, 1.0, (0, 0), tensor.shape[2:])
+                for output in outputs]
+
+    def _run(self, blob):
+        """执行会话，返回每张图像的原始输出
+
+        固定 batch 的模型按 fixed_batch 分段推理，最后一段不足时补零到 fixed_batch，补齐部分的输出丢弃
+        """
+        if not self.fixed_batch:
+            return list(self.session.run(None, {self.input_name: blob})[0])
+        outputs = []
+        for start in range(0, len(blob), self.fixed_batch):
+            chunk = blob[start:start + self.fixed_batch]
+            count = len(chunk)
+            if count < self.fixed_batch:
+                padding = np.zeros((self.fixed_batch - count,) + chunk.shape[1:], dtype=chunk.dtype)
+                chunk = np.concatenate([chunk, padding])
+            outputs.extend(self.session.run(None, {self.input_name: chunk})[0][:count])
+        return outputs
+
+    @staticmethod
+    def _to_blob(canvases):
+        """HWC BGR uint8 -> NCHW RGB float32 [0, 1]"""
+        blob = np.stack(canvases)[..., ::-1].transpose(0, 3, 1, 2)
+        return np.ascontiguousarray(blob, dtype=np.float32) / 255.0
+
+    def _postprocess(self, output, conf_threshold, nms_threshold, ratio, pad, orig_shape):
+        if output.ndim == 2 and output.shape[-1] == 6 and output.shape[0] <= self.max_det:
+            # 端到端导出的模型已包含NMS: [max_det, 6] (x1, y1, x2, y2, conf, cls)
+            detections = output[output[:, 4] > conf_threshold]
+            xyxy, confidences, class_ids = detections[:, :4], detections[:, 4], detections[:, 5]
+        else:
+            # YOLOv8 原始输出: [4 + nc, N] (cx, cy, w, h, 各类别得分)
+            predictions = output.T
+            scores = predictions[:, 4:]
+            class_ids = scores.argmax(1)
+            confidences = scores[np.arange(len(scores)), class_ids]
+            keep = confidences > conf_threshold
+            boxes = predictions[keep, :4]
+            confidences = confidences[keep]
+            class_ids = class_ids[keep]
+
+            xyxy = np.empty_like(boxes)
+            xyxy[:, 0] = boxes[:, 0] - boxes[:, 2] / 2
+            xyxy[:, 1] = boxes[:, 1] - boxes[:, 3] / 2
+            xyxy[:, 2] = boxes[:, 0] + boxes[:, 2] / 2
+            xyxy[:, 3] = boxes[:, 1] + boxes[:, 3] / 2
+
+            keep = batched_nms(xyxy, confidences, class_ids, nms_threshold, max_det=self.max_det)
+            xyxy, confidences, class_ids = xyxy[keep], confidences[keep], class_ids[keep]
+
+        xyxy = unletterbox_boxes(xyxy, ratio, pad, orig_shape)
+        return xyxy, confidences.astype(np.float32), class_ids.astype(np.int64)
+
+
+def onnx_path_for(model_path):
+    """best.pt -> best.onnx (与 .pt 放在同一目录)"""
+    return os.path.splitext(model_path)[0] + '.onnx'
+
+
+def ensure_onnx_export(model_path, imgsz=640):
+    """把 .pt 导出为 ONNX，已存在且比 .pt 新的导出文件直接复用"""
+    onnx_path = onnx_path_for(model_path)
+    if os.path.exists(onnx_path) and os.path.getmtime(onnx_path) >= os.path.getmtime(model_path):
+        return onnx_path
+
+    print(f"导出ONNX模型: {model_path} -> {onnx_path}")
+    from ultralytics import YOLO
+
+    # dynamic=True 保留动态 batch 与输入尺寸，支持批量推理和矩形letterbox
+    exported = YOLO(model_path, task='detect').export(format='onnx', imgsz=imgsz, dynamic=True, simplify=False)
+    if os.path.abspath(exported) != os.path.abspath(onnx_path):
+        os.replace(exported, onnx_path)
+    return onnx_path
+
+
+def create_backend(model_path, backend_name=None, imgsz=640, precision=None):
+    """按名称创建推理后端
+
+    backend_name / precision 为空时读取 INFERENCE_BACKEND / MODEL_PRECISION 环境变量 (见 default_backend_name)；
+    推理线程数读取 INFERENCE_THREADS (gunicorn.conf.py 按 resource_plan.py 的规划设置)
+    """
+    backend_name = (backend_name or default_backend_name()).lower()
+    num_threads = int(os.getenv('INFERENCE_THREADS', 0)) or None
+    precision = (precision or os.getenv('MODEL_PRECISION', 'fp32')).lower()
+    if precision not in ('fp32', 'int8'):
+        raise ValueError(f"未知的模型精度: {precision} (可选: fp32, int8)")
+
+    if precision == 'int8':
+        # INT8 量化模型只能由 ONNX Runtime 执行
+        return OnnxRuntimeBackend(model_path, imgsz=imgsz, num_threads=num_threads, precision='int8',
+                                  calibration_dir=os.getenv('QUANT_CALIB_DIR'))
+    if backend_name == 'ultralytics':
+        return UltralyticsBackend(model_path, num_threads=num_threads)
+    if backend_name == 'onnxruntime':
+        return OnnxRuntimeBackend(model_path, imgsz=imgsz, num_threads=num_threads)
+    raise ValueError(f"未知的推理后端: {backend_name} (可选: ultralytics, onnxruntime)")
@@ -0,0 +1,194 @@
+"""
+预分配的输入张量池
+检测器的预处理直接把图像 letterbox 进池中复用的 float32 NCHW 输入张量，再交给推理后端的 predict_tensor()，
+跳过 ultralytics / ONNX 后端自己的预处理：
+
+    原路径 (每张图像)   letterbox画布 -> 后端再letterbox一次 -> BGR->RGB 拷贝 -> float32 转换 (-> 多张时 np.stack)
+    张量池路径         cv2.resize 写入池中的 uint8 暂存区 -> 按通道除以255直接写入池中的 float32 张量
+
+池中张量按整张图像 (3, imgsz, imgsz) 的倍数分配、最大到 max_batch 张，矩形推理与较小的batch取其前部的连续视图，
+稳定负载下预处理不再分配大数组，RSS 不会因分配器碎片持续增长。
+INPUT_BUFFER_POOL=0 时回到原来的逐次分配路径
+"""
+
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from detection_utils import batch_letterbox_shape, letterbox_geometry
+from metrics import INPUT_ALLOCATIONS_SAVED
+
+INPUT_BUFFER_POOL = os.getenv('INPUT_BUFFER_POOL', '1') == '1'
+INPUT_BUFFER_POOL_SIZE = int(os.getenv('INPUT_BUFFER_POOL_SIZE', 2))  # 常驻的张量个数 (并发预处理的请求数)
+
+_PAD_VALUE = np.float32(114 / 255)
+_SCALE = np.float32(255)
+
+
+class _Buffer:
+    __slots__ = ('tensor', 'scratch')
+
+    def __init__(self, tensor_size, scratch_size):
+        self.tensor = np.empty(tensor_size, dtype=np.float32)
+        self.scratch = np.empty(scratch_size, dtype=np.uint8)
+
+
+def letterbox_into(image, out, new_size, stride=None, scratch=None):
+    """把 BGR uint8 图像 letterbox 进 out (3, H, W) float32 RGB [0, 1]，返回 (ratio, (pad_x, pad_y))
+
+    填充到 out 的尺寸 (居中)；与 letterbox() + ultralytics 预处理的结果逐像素一致；
+    scratch 为缩放结果的暂存区 (uint8 一维数组)
+    """
+    height, width = image.shape[:2]
+    ratio, (new_width, new_height), _, _ = letterbox_geometry(height, width, new_size, stride)
+    pad_x = (out.shape[2] - new_width) // 2
+    pad_y = (out.shape[1] - new_height) // 2
+
+    if (new_width, new_height) != (width, height):
+        dst = None
+        if scratch is not None and scratch.size >= new_width * new_height * 3:
+            dst = scratch[:new_width * new_height * 3].reshape(new_height, new_width, 3)
+        image = cv2.resize(image, (new_width, new_height), dst=dst, interpolation=cv2.INTER_LINEAR)
+
+    # 只填充边框，内容区按通道 BGR->RGB、uint8->float32、/255 一次写入
+    out[:, :pad_y] = _PAD_VALUE
+    out[:, pad_y + new_height:] = _PAD_VALUE
+    out[:, pad_y:pad_y + new_height, :pad_x] = _PAD_VALUE
+    out[:, pad_y:pad_y + new_height, pad_x + new_width:] = _PAD_VALUE
+    for channel in range(3):
+        np.divide(image[:, :, 2 - channel], _SCALE, dtype=np.float32,
+                  out=out[channel, pad_y:pad_y + new_height, pad_x:pad_x + new_width])
+    return ratio, (pad_x, pad_y)
+
+
+class InputBufferPool:
+    """固定容量的 float32 输入张量池
+
+    baseline_allocations: 不使用张量池时每张图像预处理分配的大数组个数
+    (检测器的 letterbox 画布 + 推理后端 predict() 内部的拷贝，见各后端的 preprocess_allocations)
+    """
+
+    def __init__(self, imgsz, max_batch=1, size=INPUT_BUFFER_POOL_SIZE, baseline_allocations=4, rect=True):
+        self.imgsz = int(imgsz)
+        self.rect = rect  # 固定输入尺寸的模型 (ONNX dynamic=False) 不能做矩形推理
+        self.max_batch = max(1, int(max_batch))
+        self.size = max(1, int(size))
+        self.baseline_allocations = baseline_allocations
+        self.tensor_size = self.max_batch * 3 * self.imgsz * self.imgsz
+        self.scratch_size = self.imgsz * self.imgsz * 3
+        self._free = []
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.images = 0
+        self.reused = 0
+        self.allocated = 0
+        self.allocations_saved = 0
+
+    def letterbox(self, images, stride=None, baseline_allocations=None, imgsz=None):
+        """with pool.letterbox(images, stride) as batch: backend.predict_tensor(batch.tensor, ...)
+
+        传 stride=32 时做矩形推理，多张图像填充到这批图像共同的矩形尺寸 (见 batch_letterbox_shape)；
+        不传 stride 或固定输入尺寸的模型统一为 imgsz 正方形。
+        imgsz 可临时指定更小的输入尺寸 (负载自适应降级)，取池中张量的前部；固定输入尺寸的模型忽略该参数。
+        batch.metas 为每张图像的 (ratio, pad, 原图shape)，退出时张量归还到池中
+        """
+        baseline = self.baseline_allocations if baseline_allocations is None else baseline_allocations
+        imgsz = min(int(imgsz), self.imgsz) if imgsz and self.rect else self.imgsz
+        return _Lease(self, images, stride, baseline, imgsz)
+
+    def _acquire(self, tensor_size):
+        """取能容纳 tensor_size 的最小空闲张量，返回 (buffer, 是否新分配)
+
+        未命中时按整张图像的倍数分配，只有单张请求的服务不会分配整个batch的张量
+        """
+        with self._lock:
+            candidates = [buffer for buffer in self._free if buffer.tensor.size >= tensor_size]
+            if candidates:
+                buffer = min(candidates, key=lambda item: item.tensor.size)
+                self._free.remove(buffer)
+                self.reused += 1
+                return buffer, False
+            self.allocated += 1
+        per_image = 3 * self.imgsz * self.imgsz
+        return _Buffer(-(-tensor_size // per_image) * per_image, self.scratch_size), True
+
+    def _release(self, buffer, images, baseline, fresh):
+        # 原路径每张图像 baseline 次分配，多张时还有一次 np.stack；张量池只在未命中时分配一次
+        saved = images * baseline + (images > 1) - fresh
+        with self._lock:
+            self.requests += 1
+            self.images += images
+            self.allocations_saved += saved
+            # 超过 max_batch 的张量不常驻；池满时替换掉更小的张量
+            if buffer.tensor.size <= self.tensor_size:
+                if len(self._free) < self.size:
+                    self._free.append(buffer)
+                else:
+                    smallest = min(self._free, key=lambda item: item.tensor.size)
+                    if smallest.tensor.size < buffer.tensor.size:
+                        self._free[self._free.index(smallest)] = buffer
+        INPUT_ALLOCATIONS_SAVED.inc(saved)
+
+    def stats(self):
+        with self._lock:
+            pooled_bytes = sum(buffer.tensor.nbytes + buffer.scratch.nbytes for buffer in self._free)
+            return {
+                'max_input_shape': [self.max_batch, 3, self.imgsz, self.imgsz],
+                'pooled_buffers': len(self._free),
+                'pool_size': self.size,
+                'pooled_mb': round(pooled_bytes / 1024 / 1024, 2),
+                'requests': self.requests,
+                'images': self.images,
+                'reused': self.reused,
+                'allocated': self.allocated,
+                'allocations_saved': self.allocations_saved,
+                'allocations_saved_per_request': round(self.allocations_saved / self.requests, 2) if self.requests else None,
+            }
+
+
+def create_input_pool(backend, imgsz, max_batch=1):
+    """按推理后端创建张量池；INPUT_BUFFER_POOL=0 或后端不支持张量输入时返回None"""
+    if not INPUT_BUFFER_POOL or not hasattr(backend, 'predict_tensor'):
+        return None
+    fixed_size = getattr(backend, 'fixed_size', None)
+    return InputBufferPool(fixed_size or imgsz, max_batch, rect=fixed_size is None,
+                           baseline_allocations=backend.preprocess_allocations + 1)
+
+
+class _Lease:
+    __slots__ = ('pool', 'buffer', 'fresh', 'baseline', 'tensor', 'metas', 'count')
+
+    def __init__(self, pool, images, stride, baseline, imgsz):
+        self.pool = pool
+        self.baseline = baseline
+        self.count = len(images)
+        if not pool.rect:
+            stride = None
+        target_width, target_height = batch_letterbox_shape([image.shape for image in images], imgsz, stride)
+        shape = (self.count, 3, target_height, target_width)
+
+        self.buffer, self.fresh = pool._acquire(self.count * 3 * target_height * target_width)
+        # 取池中张量前部的连续视图，形状不同的请求共用同一块内存
+        self.tensor = self.buffer.tensor[:int(np.prod(shape))].reshape(shape)
+        self.metas = []
+        try:
+            for image, out in zip(images, self.tensor):
+                ratio, pad = letterbox_into(image, out, imgsz, stride, self.buffer.scratch)
+                self.metas.append((ratio, pad, image.shape))
+        except Exception:
+            self.release()
+            raise
+
+    def release(self):
+        if self.buffer is not None:
+            self.pool._release(self.buffer, self.count, self.baseline, self.fresh)
+            self.buffer = self.tensor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
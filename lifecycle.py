@@ -0,0 +1,171 @@
+"""
+服务生命周期
+模型预加载 -> 预热推理 -> (gunicorn --preload 时) fork 前准备，以及就绪/存活状态
+
+    gunicorn --preload 'app:create_app()'
+
+create_app() 在master进程中加载模型并预热，之后 gc.freeze() 把已有对象移出GC跟踪，
+fork 出的worker只读这些页面，模型权重与库代码以写时复制 (copy-on-write) 的方式共享。
+gunicorn.conf.py 的 post_fork 钩子调用 after_fork() 恢复worker中的推理线程
+"""
+
+import gc
+import os
+import threading
+import time
+
+import numpy as np
+
+WARMUP_RUNS = int(os.getenv('WARMUP_RUNS', 1))   # 预热推理次数，0为不预热
+FAST_START = os.getenv('FAST_START', '0') == '1'  # 冷启动优先: 跳过启动诊断输出，默认使用onnxruntime
+
+# fork 前加载的检测器，after_fork() 在每个worker中处理
+_preloaded = []
+
+
+def process_started_at():
+    """当前进程的启动时间 (time.time() 时间戳)，从 /proc 读取，无法获取时返回None"""
+    try:
+        with open('/proc/self/stat') as f:
+            # comm 字段可能含空格，从最后一个 ')' 之后开始数，starttime 为第22个字段
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - (uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class ServiceState:
+    """服务阶段: starting -> loading -> warming_up -> ready / failed
+
+    ready 之前 /health 返回503，平台的健康检查不会把流量路由到尚未预热的实例。
+    import_started 为应用模块开始导入时的 time.perf_counter()，用于拆分冷启动耗时：
+    进程启动 -> 导入应用 -> 加载模型 -> 预热 -> 首次检测
+    """
+
+    def __init__(self, import_started=None):
+        self._lock = threading.Lock()
+        self.phase = 'starting'
+        self.error = None
+        self.ready_at = None
+        self.first_prediction_at = None
+        self.timings_ms = {}
+        self.loaded_in_pid = None
+        self.preloaded = False
+
+        now = time.time()
+        import_ms = (time.perf_counter() - import_started) * 1000 if import_started is not None else 0.0
+        # gunicorn --preload 时worker由fork产生，时间从master进程启动算起
+        self.started_at = process_started_at() or now - import_ms / 1000
+        if import_started is not None:
+            before_import_ms = (now - self.started_at) * 1000 - import_ms
+            self.timings_ms['process_start_to_app_import'] = round(max(0.0, before_import_ms), 1)
+            self.timings_ms['app_import'] = round(import_ms, 1)
+
+    def set_phase(self, phase, error=None):
+        with self._lock:
+            self.phase = phase
+            self.error = error
+            if phase == 'ready':
+                self.ready_at = time.time()
+
+    def record(self, name, started):
+        """记录一个启动阶段的耗时 (started 为 time.perf_counter())"""
+        with self._lock:
+            self.timings_ms[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    def mark_first_prediction(self):
+        """记录首次完成检测的时间 (只记录一次)"""
+        if self.first_prediction_at is None:
+            with self._lock:
+                if self.first_prediction_at is None:
+                    self.first_prediction_at = time.time()
+
+    @property
+    def ready(self):
+        return self.phase == 'ready'
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'phase': self.phase,
+                'ready': self.phase == 'ready',
+                'error': self.error,
+                'pid': os.getpid(),
+                'loaded_in_pid': self.loaded_in_pid,
+                'preloaded': self.preloaded,
+                'uptime_s': round(time.time() - self.started_at, 1),
+                'time_to_ready_s': round(self.ready_at - self.started_at, 2) if self.ready_at else None,
+                'time_to_first_prediction_s': (round(self.first_prediction_at - self.started_at, 2)
+                                               if self.first_prediction_at else None),
+                'fast_start': FAST_START,
+                'timings_ms': dict(self.timings_ms)
+            }
+
+
+def warmup_detector(detector, runs=None, size=None):
+    """用 size x size 的灰色图像执行几次推理，触发算子初始化、内存分配等首次推理开销"""
+    runs = WARMUP_RUNS if runs is None else int(runs)
+    size = int(size or detector.input_size)
+    image = np.full((size, size, 3), 114, dtype=np.uint8)
+    for _ in range(max(0, runs)):
+        detector.detect(image, 0.5, 0.4)
+    return runs
+
+
+def load_detector(state, factory, warmup_runs=None, for_fork=False):
+    """加载并预热检测器，state 记录各阶段耗时
+
+    factory() 创建检测器；for_fork 为 True 时 (gunicorn --preload) 按 fork 的要求准备推理后端，
+    预热后冻结GC对象并登记，fork 后由 after_fork() 处理
+    """
+    state.set_phase('loading')
+    started = time.perf_counter()
+    try:
+        detector = factory()
+    except Exception as e:
+        state.set_phase('failed', str(e))
+        raise
+    state.record('model_load', started)
+    state.loaded_in_pid = os.getpid()
+
+    backend = getattr(detector, 'backend', None)
+    if backend is None or not getattr(detector, 'model_loaded', True):
+        state.set_phase('failed', getattr(detector, 'load_error', None) or '模型未加载')
+        return detector
+
+    if for_fork:
+        backend.prepare_fork()
+
+    state.set_phase('warming_up')
+    started = time.perf_counter()
+    try:
+        runs = warmup_detector(detector, warmup_runs)
+    except Exception as e:
+        # 预热失败不影响服务，首个请求仍会完成初始化
+        print(f"预热推理失败: {e}")
+        runs = 0
+    state.record('warmup', started)
+    print(f"预热完成: {runs} 次推理, 耗时 {state.timings_ms['warmup']}ms")
+
+    if for_fork:
+        state.preloaded = True
+        _preloaded.append((detector, state))
+        gc.collect()
+        # 冻结后GC不再遍历这些对象，worker中不会因为写GC头部而复制整页内存
+        gc.freeze()
+
+    state.set_phase('ready')
+    return detector
+
+
+def after_fork():
+    """gunicorn post_fork 钩子: 在worker中恢复推理线程，必要时重建会话并重新预热"""
+    for detector, state in _preloaded:
+        started = time.perf_counter()
+        if detector.backend.reset_after_fork():
+            state.set_phase('warming_up')
+            warmup_detector(detector, max(1, WARMUP_RUNS))
+            state.record('post_fork_warmup', started)
+            state.set_phase('ready')
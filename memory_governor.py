@@ -0,0 +1,224 @@
+"""
+内存调控 (512MB 部署)
+用 psutil 读取进程RSS，代替每次检测后无条件的 gc.collect()：
+
+- RSS 超过高水位 (MEMORY_HIGH_WATER x 预算) 时才执行 gc.collect()，且两次之间至少间隔 MEMORY_GC_INTERVAL 秒；
+  常规请求不再付出全堆回收的几十毫秒
+- 解码前按文件头估算解码所需内存，超出剩余预算时：JPEG 改为更大倍数的降采样解码 (downscale)，
+  其它格式或降到 1/8 仍放不下则拒绝 (MemoryPressureError，接口返回 503 + Retry-After)，而不是被OOM杀掉
+- 每次决策与回收记录在 stats() 中，/debug 的 memory_governor 字段输出
+
+预算默认取容器的 cgroup 内存上限 (没有则为物理内存)，按进程RSS统计；gunicorn 多worker时应按worker数设置 MEMORY_BUDGET_MB
+"""
+
+import gc
+import os
+import threading
+import time
+from collections import deque
+
+from detection_utils import batch_tensor_bytes, read_image_size
+from metrics import MEMORY_DECISIONS, MEMORY_GC_SECONDS, process_peak_rss_bytes, process_rss_bytes
+from resource_plan import container_memory_limit
+
+MEMORY_BUDGET_MB = float(os.getenv('MEMORY_BUDGET_MB', 0))        # 0 为 cgroup 上限 / 物理内存
+MEMORY_HIGH_WATER = float(os.getenv('MEMORY_HIGH_WATER', 0.75))  # RSS 超过 预算 x 该比例 才执行 gc.collect()
+MEMORY_RESERVE_MB = float(os.getenv('MEMORY_RESERVE_MB', 48))    # 为推理中间结果预留的内存
+MEMORY_GC_INTERVAL = float(os.getenv('MEMORY_GC_INTERVAL', 1.0))  # 两次回收的最小间隔 (秒)
+
+_REDUCED_FACTORS = (1, 2, 4, 8)  # 与 decode_image_reduced 相同的 JPEG DCT 缩放倍数
+
+
+class MemoryPressureError(Exception):
+    """剩余内存预算放不下这张图像"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _default_budget():
+    if MEMORY_BUDGET_MB > 0:
+        return int(MEMORY_BUDGET_MB * 1024 * 1024)
+    limit = container_memory_limit()
+    if limit:
+        return limit
+    try:
+        import psutil
+        return psutil.virtual_memory().total
+    except ImportError:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def _is_jpeg(image_bytes):
+    return bytes(image_bytes[:3]) == b'\xff\xd8\xff'
+
+
+def estimate_decode_bytes(size, target_size, jpeg):
+    """按 decode_image_reduced 的规则估算解码内存，返回 (字节数, 缩小倍数)
+
+    只有JPEG能在解码时按DCT缩小；其它格式先解码全分辨率，峰值按原图计算
+    """
+    width, height = size
+    factor = 1
+    for candidate in reversed(_REDUCED_FACTORS):
+        if max(width, height) / candidate >= target_size:
+            factor = candidate
+            break
+    if not jpeg:
+        return width * height * 3, factor
+    return -(-width // factor) * -(-height // factor) * 3, factor
+
+
+class MemoryGovernor:
+    def __init__(self, budget_bytes=None, high_water=MEMORY_HIGH_WATER, reserve_bytes=None,
+                 gc_interval=MEMORY_GC_INTERVAL, history=20):
+        self.budget_bytes = int(budget_bytes or _default_budget())
+        self.high_water_bytes = int(self.budget_bytes * high_water)
+        self.reserve_bytes = int(MEMORY_RESERVE_MB * 1024 * 1024 if reserve_bytes is None else reserve_bytes)
+        self.gc_interval = gc_interval
+        self._lock = threading.Lock()
+        self._process = None
+        self._reserved = 0           # 已准入、尚未完成的请求的解码估算
+        self._last_collect = 0.0
+        self.max_rss = 0
+        self.collections = 0
+        self.collect_seconds = 0.0
+        self.freed_bytes = 0
+        self.skipped_collections = 0
+        self.decisions = {'accept': 0, 'downscale': 0, 'reject': 0}
+        self.recent = deque(maxlen=history)
+
+    def rss(self):
+        """当前进程RSS (字节)；psutil 不可用时读 /proc"""
+        if self._process is None:
+            try:
+                import psutil
+                self._process = psutil.Process()
+            except ImportError:
+                self._process = False
+        if self._process:
+            rss = self._process.memory_info().rss
+        else:
+            rss = process_rss_bytes() or 0
+        if rss > self.max_rss:
+            self.max_rss = rss
+        return rss
+
+    def maybe_collect(self):
+        """RSS 超过高水位且距上次回收超过 gc_interval 时执行 gc.collect()，返回是否回收"""
+        rss = self.rss()
+        if rss < self.high_water_bytes:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_collect < self.gc_interval:
+                self.skipped_collections += 1
+                return False
+            self._last_collect = now
+        started = time.perf_counter()
+        gc.collect()
+        elapsed = time.perf_counter() - started
+        freed = max(0, rss - self.rss())
+        MEMORY_GC_SECONDS.observe(elapsed)
+        with self._lock:
+            self.collections += 1
+            self.collect_seconds += elapsed
+            self.freed_bytes += freed
+        return True
+
+    def plan(self, image_bytes, target_size, input_size=None):
+        """决定这张图像的解码方式，返回 (action, target_size)
+
+        action 为 'accept' / 'downscale' / 'reject'；downscale 时 target_size 为缩小后的解码目标边长
+        """
+        return self._plan(image_bytes, target_size, input_size)[:2]
+
+    def _plan(self, image_bytes, target_size, input_size):
+        size = read_image_size(image_bytes)
+        if size is None:
+            return 'accept', target_size, 0  # 无法识别的文件头，解码本身会失败
+        jpeg = _is_jpeg(image_bytes)
+        overhead = batch_tensor_bytes(input_size or target_size) + self.reserve_bytes
+        with self._lock:
+            reserved = self._reserved
+        available = self.budget_bytes - self.rss() - reserved - overhead
+
+        estimate, factor = estimate_decode_bytes(size, target_size, jpeg)
+        action, planned_target = 'accept', target_size
+        if estimate > available:
+            action = 'reject'
+            if jpeg:
+                for candidate in _REDUCED_FACTORS:
+                    if candidate <= factor:
+                        continue
+                    estimate = -(-size[0] // candidate) * -(-size[1] // candidate) * 3
+                    if estimate <= available:
+                        action, planned_target = 'downscale', max(size) // candidate
+                        break
+
+        self._record(action, size, estimate, available, planned_target)
+        return action, planned_target, estimate
+
+    def reserve(self, image_bytes, target_size, input_size=None):
+        """with governor.reserve(image_bytes, target_size) as target_size: ...
+
+        准入后在请求完成前计入已预留内存，并发请求不会各自按同一份剩余预算放行；
+        放不下时抛出 MemoryPressureError
+        """
+        action, planned_target, estimate = self._plan(image_bytes, target_size, input_size)
+        if action == 'reject':
+            raise MemoryPressureError('内存不足，请稍后重试或上传更小的图像')
+        return _Reservation(self, estimate, planned_target)
+
+    def _record(self, action, size, estimate, available, target_size):
+        MEMORY_DECISIONS.inc(action=action)
+        with self._lock:
+            self.decisions[action] += 1
+            if action != 'accept':
+                self.recent.append({
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'action': action,
+                    'image_size': list(size),
+                    'estimate_mb': round(estimate / 1024 / 1024, 1),
+                    'available_mb': round(available / 1024 / 1024, 1),
+                    'target_size': target_size if action == 'downscale' else None,
+                })
+
+    def stats(self):
+        rss = self.rss()
+        with self._lock:
+            return {
+                'budget_mb': round(self.budget_bytes / 1024 / 1024, 1),
+                'high_water_mb': round(self.high_water_bytes / 1024 / 1024, 1),
+                'reserve_mb': round(self.reserve_bytes / 1024 / 1024, 1),
+                'rss_mb': round(rss / 1024 / 1024, 1),
+                'max_rss_mb': round(self.max_rss / 1024 / 1024, 1),
+                'peak_rss_mb': round((process_peak_rss_bytes() or 0) / 1024 / 1024, 1),
+                'reserved_mb': round(self._reserved / 1024 / 1024, 1),
+                'collections': self.collections,
+                'skipped_collections': self.skipped_collections,
+                'collect_ms_total': round(self.collect_seconds * 1000, 1),
+                'freed_mb_total': round(self.freed_bytes / 1024 / 1024, 1),
+                'decisions': dict(self.decisions),
+                'recent_decisions': list(self.recent),
+            }
+
+
+class _Reservation:
+    __slots__ = ('governor', 'nbytes', 'target_size')
+
+    def __init__(self, governor, nbytes, target_size):
+        self.governor = governor
+        self.nbytes = nbytes
+        self.target_size = target_size
+
+    def __enter__(self):
+        with self.governor._lock:
+            self.governor._reserved += self.nbytes
+        return self.target_size
+
+    def __exit__(self, *exc):
+        with self.governor._lock:
+            self.governor._reserved -= self.nbytes
+        return False
@@ -0,0 +1,222 @@
+"""
+检测流水线指标
+以 Prometheus 文本格式 (/metrics) 输出的计数器与直方图，不依赖 prometheus_client。
+每次观测只是一次 perf_counter、一次二分查找和一次加锁累加，可以在生产环境常开
+
+指标按进程统计：gunicorn 多个worker时每个worker各自一份，抓取到哪个worker就是哪个worker的数据
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# 各阶段耗时的桶 (秒)：覆盖从缓存命中的亚毫秒到CPU推理的数秒
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+IMAGE_MEGAPIXEL_BUCKETS = (0.1, 0.3, 0.5, 1.0, 2.0, 5.0, 8.0, 12.0, 24.0, 50.0)
+UPLOAD_BYTES_BUCKETS = (16e3, 64e3, 256e3, 512e3, 1e6, 2e6, 5e6, 10e6, 25e6)
+DETECTION_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 300)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _format_labels(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{self._format_labels(key)} {_format_value(value)}' for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # key -> [各桶计数 (非累积，最后一个为 +Inf), sum]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def time(self, **labels):
+        """with histogram.time(stage='inference'): ... 记录代码块耗时 (秒)"""
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                lines.append(f'{self.name}_bucket{self._format_labels(key, ("le", le))} {cumulative}')
+            lines.append(f'{self.name}_sum{self._format_labels(key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{self._format_labels(key)} {cumulative}')
+        return lines
+
+
+class Gauge(_Metric):
+    """抓取时调用 func() 取值；func 返回 None 时不输出"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, func):
+        super().__init__(name, help_text)
+        self.func = func
+
+    def samples(self):
+        try:
+            value = self.func()
+        except Exception:
+            value = None
+        return [] if value is None else [f'{self.name} {_format_value(value)}']
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        """注册指标，同名指标会被替换 (例如回调型 Gauge 重新绑定)"""
+        self._metrics = [m for m in self._metrics if m.name != metric.name]
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus 文本格式 (text/plain; version=0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def process_rss_bytes():
+    """当前进程RSS (字节)，读取 /proc/self/statm"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def process_peak_rss_bytes():
+    """当前进程峰值RSS (字节)，读取 /proc/self/status 的 VmHWM"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    'yolo_requests_total', '检测请求数 (按接口与输入方式: file / base64 / raw)', ('endpoint', 'input_mode')))
+ERRORS = REGISTRY.register(Counter(
+    'yolo_request_errors_total', '失败的检测请求数 (按接口与原因)', ('endpoint', 'reason')))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    'yolo_cache_lookups_total', '结果缓存查询次数', ('result',)))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'yolo_stage_seconds', '检测流水线各阶段耗时 (秒)：parse / base64_decode / cache_lookup / image_decode / '
+    'preprocess / inference / postprocess / serialize', LATENCY_BUCKETS, ('stage',)))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'yolo_request_seconds', '检测请求总耗时 (秒)', LATENCY_BUCKETS, ('endpoint',)))
+IMAGE_MEGAPIXELS = REGISTRY.register(Histogram(
+    'yolo_image_megapixels', '上传图像的原始尺寸 (百万像素)', IMAGE_MEGAPIXEL_BUCKETS))
+UPLOAD_BYTES = REGISTRY.register(Histogram(
+    'yolo_upload_bytes', '上传图像的字节数', UPLOAD_BYTES_BUCKETS))
+DETECTIONS = REGISTRY.register(Histogram(
+    'yolo_detections', '每张图像的检测框数量', DETECTION_COUNT_BUCKETS))
+MEMORY_DECISIONS = REGISTRY.register(Counter(
+    'yolo_memory_decisions_total', '内存调控的解码决策 (accept / downscale / reject)', ('action',)))
+MEMORY_GC_SECONDS = REGISTRY.register(Histogram(
+    'yolo_memory_gc_seconds', 'RSS超过高水位时 gc.collect() 的耗时 (秒)', LATENCY_BUCKETS))
+INPUT_ALLOCATIONS_SAVED = REGISTRY.register(Counter(
+    'yolo_input_allocations_saved_total', '预处理写入复用的输入张量而省去的大数组分配次数 (估算)'))
+COALESCED_REQUESTS = REGISTRY.register(Counter(
+    'yolo_coalesced_requests_total', '与同时在途的相同请求合并、共享其结果而未重复推理的请求数'))
+COALESCED_SAVED_SECONDS = REGISTRY.register(Counter(
+    'yolo_coalesced_saved_seconds_total', '请求合并省去的检测耗时 (秒，按领头请求的耗时估算)'))
+ADAPTIVE_INPUT_SIZE = REGISTRY.register(Counter(
+    'yolo_adaptive_input_size_total', '负载自适应选择的推理输入尺寸 (按尺寸统计的请求数)', ('size',)))
+MODEL_EVENTS = REGISTRY.register(Counter(
+    'yolo_model_registry_events_total', '多模型注册表事件 (load / evict / swap / load_error)', ('event',)))
+REGISTRY.register(Gauge('process_resident_memory_bytes', '进程RSS (字节)', process_rss_bytes))
+REGISTRY.register(Gauge('process_peak_resident_memory_bytes', '进程峰值RSS (字节)', process_peak_rss_bytes))
+
+
+def stage(name):
+    """with stage('inference'): ... 记录流水线阶段耗时"""
+    return STAGE_SECONDS.time(stage=name)
@@ -0,0 +1,158 @@
+"""
+动态微批调度器
+把并发到达的单张图像检测请求在 max_wait_ms 时间窗口内合并，
+按相同阈值分组后调用一次 detect_many()，再把结果分发给各个调用方
+"""
+
+import os
+import queue
+import threading
+import time
+
+
+class _PendingRequest:
+    """队列中等待批处理的单个请求"""
+
+    __slots__ = ('image', 'decode_scale', 'key', 'enqueued', 'event', 'predictions', 'error', 'info')
+
+    def __init__(self, image, key, decode_scale=None):
+        self.image = image
+        self.decode_scale = decode_scale
+        self.key = key
+        self.enqueued = time.perf_counter()
+        self.event = threading.Event()
+        self.predictions = None
+        self.error = None
+        self.info = None
+
+
+class MicroBatcher:
+    def __init__(self, detect_many, max_batch_size=8, max_wait_ms=10):
+        """detect_many(images, conf_threshold, nms_threshold, **options) -> 每张图像的预测列表"""
+        self.detect_many = detect_many
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+        # 统计信息
+        self._stats_lock = threading.Lock()
+        self.total_requests = 0
+        self.total_batches = 0
+        self.total_queue_wait_ms = 0.0
+        self.max_observed_batch = 0
+        self.last_batch_size = 0
+
+    def _ensure_worker(self):
+        """懒启动调度线程
+
+        gunicorn --preload 在master进程导入应用，线程不会随fork进入worker，
+        所以按进程号检查，在每个worker里第一次提交时再启动
+        """
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+            self._thread.start()
+
+    def submit(self, image, conf_threshold=0.5, nms_threshold=0.4, timeout=None, decode_scale=None, **options):
+        """提交单张图像并阻塞等待结果
+
+        decode_scale 为降采样解码的比例 (见 detection_utils.decode_image_reduced)，按图像逐张传给 detect_many；
+        options 原样传给 detect_many (如 columnar)，只有阈值和 options 都相同的请求才会合并
+        返回 (predictions, batch_info)，batch_info 包含实际批大小和排队等待时间
+        """
+        self._ensure_worker()
+        key = (float(conf_threshold), float(nms_threshold), tuple(sorted(options.items())))
+        pending = _PendingRequest(image, key, decode_scale)
+        self._queue.put(pending)
+
+        if not pending.event.wait(timeout):
+            raise TimeoutError('微批调度等待超时')
+        if pending.error is not None:
+            raise pending.error
+        return pending.predictions, pending.info
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            batch = [first]
+            # 以最早到达的请求为准计算等待截止时间，保证单个请求的额外延迟不超过 max_wait
+            deadline = first.enqueued + self.max_wait
+            # 截止时间已过时仍取走队列里已经在等的请求 (例如上一批推理期间到达的)
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # 阈值不同的请求不能共用一次NMS，按阈值和选项分组
+            groups = {}
+            for pending in batch:
+                groups.setdefault(pending.key, []).append(pending)
+            for (conf_threshold, nms_threshold, options), items in groups.items():
+                self._run_group(items, conf_threshold, nms_threshold, dict(options))
+
+    def _run_group(self, items, conf_threshold, nms_threshold, options):
+        started = time.perf_counter()
+        error = None
+        try:
+            if any(item.decode_scale is not None for item in items):
+                options = dict(options, decode_scales=[item.decode_scale for item in items])
+            all_predictions = self.detect_many([item.image for item in items], conf_threshold, nms_threshold,
+                                               **options)
+        except Exception as e:
+            all_predictions = None
+            error = e
+
+        inference_ms = (time.perf_counter() - started) * 1000
+        waits = []
+        for i, item in enumerate(items):
+            queue_wait_ms = (started - item.enqueued) * 1000
+            waits.append(queue_wait_ms)
+            item.info = {
+                'batch_size': len(items),
+                'queue_wait_ms': round(queue_wait_ms, 2),
+                'inference_ms': round(inference_ms, 2)
+            }
+            if all_predictions is None:
+                item.error = error
+            else:
+                item.predictions = all_predictions[i]
+            item.image = None
+            item.event.set()
+
+        with self._stats_lock:
+            self.total_requests += len(items)
+            self.total_batches += 1
+            self.total_queue_wait_ms += sum(waits)
+            self.max_observed_batch = max(self.max_observed_batch, len(items))
+            self.last_batch_size = len(items)
+
+    def stats(self):
+        """返回调度统计信息"""
+        with self._stats_lock:
+            batches = self.total_batches
+            requests = self.total_requests
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'total_requests': requests,
+                'total_batches': batches,
+                'avg_batch_size': round(requests / batches, 2) if batches else 0,
+                'max_observed_batch_size': self.max_observed_batch,
+                'last_batch_size': self.last_batch_size,
+                'avg_queue_wait_ms': round(self.total_queue_wait_ms / requests, 2) if requests else 0,
+                'queue_depth': self._queue.qsize() if self._queue is not None else 0
+            }
@@ -0,0 +1,326 @@
+"""
+多模型注册表
+同一服务按名称提供多个模型 (如白天/夜间、不同云类型)，/detect 传 model=名称 选择：
+
+    MODELS="day=/app/models/day.pt,night=/app/models/night.onnx"
+
+- 懒加载: 第一次请求某个模型时才创建检测器 (并预热)，同名模型的并发首请求只加载一次
+- 内存预算: 默认模型之外的常驻模型内存占用 (加载前后的进程RSS增量，至少为权重文件大小) 之和超过
+  MODEL_MEMORY_BUDGET_MB 时，按最近最少使用 (LRU) 卸载没有进行中请求的模型；默认模型 (MODEL_PATH) 常驻，不会被卸载
+- 热替换 (默认关闭): 每隔 MODEL_RELOAD_CHECK 秒检查权重文件的大小/修改时间，变化并稳定后在后台加载新权重，
+  加载预热完成后原子替换注册表中的条目；进行中的请求继续使用它们取到的旧检测器，完成后旧模型随引用释放。
+  替换期间每个worker同时持有新旧两份检测器，只在内存充足的部署中开启
+
+    with registry.acquire('night') as detector:
+        detector.detect(image, ...)
+"""
+
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from lifecycle import warmup_detector
+from metrics import MODEL_EVENTS, process_rss_bytes
+from result_cache import file_identity
+
+MODELS = os.getenv('MODELS', '')                                              # 名称=路径，逗号分隔
+DEFAULT_MODEL_NAME = os.getenv('DEFAULT_MODEL_NAME', 'default')              # MODEL_PATH 对应的名称
+MODEL_MEMORY_BUDGET_MB = float(os.getenv('MODEL_MEMORY_BUDGET_MB', 0))        # 默认模型之外的常驻模型内存上限，0为不限制
+MODEL_RELOAD_CHECK = float(os.getenv('MODEL_RELOAD_CHECK', 0))                # 权重文件检查间隔 (秒)，0为关闭热替换 (默认)
+
+
+class UnknownModelError(KeyError):
+    """请求了未配置的模型名称"""
+
+    def __init__(self, name, available):
+        super().__init__(name)
+        self.name = name
+        self.available = available
+
+    def __str__(self):
+        return f"未知模型: {self.name}，可用模型: {', '.join(self.available)}"
+
+
+class ModelLoadError(RuntimeError):
+    """模型懒加载失败"""
+
+
+def parse_models(spec):
+    """解析 MODELS 环境变量 "名称=路径,名称=路径"，返回有序字典"""
+    models = OrderedDict()
+    for item in (spec or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, path = item.partition('=')
+        if not sep or not name.strip() or not path.strip():
+            raise ValueError(f"MODELS 格式错误: {item!r}，应为 名称=路径")
+        models[name.strip()] = path.strip()
+    return models
+
+
+class _Entry:
+    __slots__ = ('name', 'path', 'detector', 'identity', 'footprint', 'loaded_at', 'last_used', 'uses',
+                 'refs', 'version', 'checked_at', 'pending_identity', 'reloading')
+
+    def __init__(self, name, path, detector, identity, footprint, version=1):
+        self.name = name
+        self.path = path
+        self.detector = detector
+        self.identity = identity
+        self.footprint = max(0, int(footprint))
+        self.loaded_at = time.time()
+        self.last_used = None
+        self.uses = 0
+        self.refs = 0               # 进行中的请求数
+        self.version = version      # 热替换次数 + 1
+        self.checked_at = time.monotonic()
+        self.pending_identity = None  # 上次检查看到的新文件标识，连续两次相同才加载 (文件写入完成)
+        self.reloading = False
+
+
+class ModelRegistry:
+    """按名称管理检测器: factory(path) 创建检测器，paths 为 名称 -> 权重路径"""
+
+    def __init__(self, factory, paths=None, default_name=DEFAULT_MODEL_NAME, budget_bytes=None,
+                 reload_check=MODEL_RELOAD_CHECK, warmup_runs=None, on_swap=None):
+        self.factory = factory
+        self.paths = OrderedDict(paths or {})
+        self.default_name = default_name
+        self.budget_bytes = int(MODEL_MEMORY_BUDGET_MB * 1024 * 1024 if budget_bytes is None else budget_bytes)
+        self.reload_check = reload_check
+        self.warmup_runs = warmup_runs
+        self.on_swap = on_swap  # on_swap(name, detector)，默认模型热替换后应用据此更新全局检测器
+        self._entries = OrderedDict()  # 名称 -> _Entry，按最近使用排序
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.loads = 0
+        self.evictions = 0
+        self.swaps = 0
+        self.load_errors = 0
+        self.last_error = None
+
+    def adopt(self, name, path, detector, footprint=0):
+        """登记启动时已加载 (并预热) 的检测器，作为常驻的默认模型"""
+        self.default_name = name
+        self.paths[name] = path
+        entry = _Entry(name, path, detector, file_identity(path), footprint)
+        with self._lock:
+            self._entries[name] = entry
+            self._entries.move_to_end(name)
+
+    def names(self):
+        return list(self.paths)
+
+    def resolve(self, name):
+        """规范化模型名称，空值为默认模型；未配置时抛出 UnknownModelError"""
+        name = name or self.default_name
+        if name not in self.paths:
+            raise UnknownModelError(name, self.names())
+        return name
+
+    def acquire(self, name=None):
+        """with registry.acquire(name) as detector: ... 期间该模型不会被卸载"""
+        return _Lease(self, self.resolve(name))
+
+    def class_names(self, name=None):
+        """常驻模型的类别名称，未加载时返回空字典"""
+        entry = self._entries.get(name or self.default_name)
+        return entry.detector.backend.names if entry is not None else {}
+
+    def _checkout(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                self._touch(entry)
+        if entry is None:
+            entry = self._load(name)
+        self._maybe_schedule_reload(entry)
+        return entry
+
+    def _touch(self, entry):
+        entry.refs += 1
+        entry.uses += 1
+        entry.last_used = time.time()
+        self._entries.move_to_end(entry.name)
+
+    def _checkin(self, entry):
+        with self._lock:
+            entry.refs -= 1
+
+    def _load_lock(self, name):
+        with self._lock:
+            return self._load_locks.setdefault(name, threading.Lock())
+
+    def _create(self, name, path):
+        """创建并预热检测器，返回 (detector, 内存占用)"""
+        before = process_rss_bytes() or 0
+        started = time.perf_counter()
+        try:
+            detector = self.factory(path)
+            if not getattr(detector, 'model_loaded', True):
+                raise ModelLoadError(getattr(detector, 'load_error', None) or f"模型 {name} 加载失败")
+            warmup_detector(detector, self.warmup_runs)
+        except Exception as e:
+            MODEL_EVENTS.inc(event='load_error')
+            with self._lock:
+                self.load_errors += 1
+                self.last_error = f"{name}: {e}"
+            if isinstance(e, ModelLoadError):
+                raise
+            raise ModelLoadError(f"模型 {name} 加载失败: {e}") from e
+        # 加载期间释放的临时内存会被复用，RSS增量可能偏小，至少按权重文件大小计
+        footprint = max((process_rss_bytes() or 0) - before, os.path.getsize(path))
+        print(f"📦 模型 {name} 已加载: {path}, 占用约 {footprint / 1024 / 1024:.1f} MB, "
+              f"耗时 {(time.perf_counter() - started) * 1000:.0f} ms")
+        return detector, footprint
+
+    def _load(self, name):
+        """懒加载；同名模型的并发请求等待同一次加载"""
+        with self._load_lock(name):
+            with self._lock:
+                entry = self._entries.get(name)
+                if entry is not None:
+                    self._touch(entry)
+                    return entry
+            path = self.paths[name]
+            identity = file_identity(path)
+            detector, footprint = self._create(name, path)
+            entry = _Entry(name, path, detector, identity, footprint)
+            with self._lock:
+                self._entries[name] = entry
+                self._touch(entry)
+                self.loads += 1
+            MODEL_EVENTS.inc(event='load')
+        self._evict()
+        return entry
+
+    def _evict(self):
+        """默认模型之外的常驻模型超出内存预算时按LRU卸载，跳过有进行中请求的模型"""
+        if self.budget_bytes <= 0:
+            return
+        evicted = []
+        with self._lock:
+            total = sum(entry.footprint for entry in self._entries.values() if entry.name != self.default_name)
+            for entry in list(self._entries.values()):
+                if total <= self.budget_bytes:
+                    break
+                if entry.name == self.default_name or entry.refs > 0:
+                    continue
+                del self._entries[entry.name]
+                total -= entry.footprint
+                evicted.append(entry)
+            self.evictions += len(evicted)
+        if not evicted:
+            return
+        for entry in evicted:
+            MODEL_EVENTS.inc(event='evict')
+            print(f"♻️ 卸载模型 {entry.name} (约 {entry.footprint / 1024 / 1024:.1f} MB)")
+        del evicted, entry
+        # 模型对象内部有循环引用，卸载很少发生，直接回收一次才能真正归还内存
+        gc.collect()
+
+    def _maybe_schedule_reload(self, entry):
+        """按 reload_check 间隔检查权重文件，标识变化且连续两次检查一致时在后台加载新权重"""
+        if self.reload_check <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if entry.reloading or now - entry.checked_at < self.reload_check:
+                return
+            entry.checked_at = now
+        identity = file_identity(entry.path)
+        with self._lock:
+            if identity == entry.identity:
+                entry.pending_identity = None
+                return
+            if identity != entry.pending_identity:
+                entry.pending_identity = identity  # 文件可能仍在写入，下次检查再确认
+                return
+            entry.reloading = True
+        threading.Thread(target=self._reload_in_background, args=(entry,), name=f'model-reload-{entry.name}',
+                         daemon=True).start()
+
+    def _reload_in_background(self, entry):
+        try:
+            self.reload(entry.name)
+        except Exception as e:
+            print(f"❌ 模型 {entry.name} 热替换失败，继续使用旧模型: {e}")
+        finally:
+            entry.reloading = False
+
+    def reload(self, name=None):
+        """重新加载权重并原子替换，返回新版本号；加载失败时保留旧模型并抛出 ModelLoadError"""
+        name = self.resolve(name)
+        with self._load_lock(name):
+            path = self.paths[name]
+            identity = file_identity(path)
+            detector, footprint = self._create(name, path)
+            with self._lock:
+                old = self._entries.get(name)
+                entry = _Entry(name, path, detector, identity, footprint, version=old.version + 1 if old else 1)
+                if old is not None:
+                    entry.uses = old.uses
+                    entry.last_used = old.last_used
+                # 只替换字典中的条目，持有旧条目的请求不受影响
+                self._entries[name] = entry
+                self.swaps += 1
+            MODEL_EVENTS.inc(event='swap')
+            print(f"🔁 模型 {name} 已热替换为 v{entry.version}")
+        if self.on_swap is not None:
+            self.on_swap(name, detector)
+        self._evict()
+        return entry.version
+
+    def resident(self):
+        """常驻模型及其内存占用 (/health 输出)"""
+        with self._lock:
+            return [{
+                'name': entry.name,
+                'path': entry.path,
+                'default': entry.name == self.default_name,
+                'version': entry.version,
+                'footprint_mb': round(entry.footprint / 1024 / 1024, 1),
+                'in_flight': entry.refs,
+                'uses': entry.uses,
+                'loaded_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(entry.loaded_at)),
+            } for entry in reversed(self._entries.values())]
+
+    def stats(self):
+        with self._lock:
+            resident_bytes = sum(entry.footprint for entry in self._entries.values())
+            budgeted_bytes = sum(entry.footprint for entry in self._entries.values() if entry.name != self.default_name)
+            return {
+                'available': self.names(),
+                'default': self.default_name,
+                'resident': len(self._entries),
+                'resident_mb': round(resident_bytes / 1024 / 1024, 1),
+                'budgeted_mb': round(budgeted_bytes / 1024 / 1024, 1),
+                'budget_mb': round(self.budget_bytes / 1024 / 1024, 1) if self.budget_bytes > 0 else None,
+                'reload_check_s': self.reload_check,
+                'loads': self.loads,
+                'evictions': self.evictions,
+                'swaps': self.swaps,
+                'load_errors': self.load_errors,
+                'last_error': self.last_error,
+            }
+
+
+class _Lease:
+    __slots__ = ('registry', 'name', 'entry')
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+        self.entry = None
+
+    def __enter__(self):
+        self.entry = self.registry._checkout(self.name)
+        return self.entry.detector
+
+    def __exit__(self, *exc):
+        self.registry._checkin(self.entry)
+        self.entry = None
+        return False
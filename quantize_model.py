@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+INT8量化工具
+把 best.pt / best.onnx 量化为 INT8 ONNX 模型，供 MinimalYOLODetector 在 512MB 内存下使用
+
+    # 用本地天空样本图像做静态量化校准，并与FP32对比峰值内存和延迟
+    python quantize_model.py --model models/best.pt --calib-dir samples/ --imgsz 416
+
+    # 没有校准图像时使用动态量化
+    python quantize_model.py --model models/best.pt --mode dynamic
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from detection_utils import letterbox
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def int8_path_for(onnx_path):
+    """best.onnx -> best.int8.onnx"""
+    return os.path.splitext(onnx_path)[0] + '.int8.onnx'
+
+
+def fingerprint_path_for(int8_path):
+    """best.int8.onnx -> best.int8.quant.json (记录量化时的输入与参数)"""
+    return os.path.splitext(int8_path)[0] + '.quant.json'
+
+
+def list_images(directory, max_images=None):
+    """递归列出目录下的图像文件 (按路径排序，结果稳定)"""
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    paths.sort()
+    return paths[:max_images] if max_images else paths
+
+
+def image_to_blob(image, imgsz):
+    """BGR图像 -> letterbox后的 NCHW RGB float32 输入，与 OnnxRuntimeBackend 的预处理一致"""
+    canvas, _, _ = letterbox(image, imgsz)
+    blob = canvas[..., ::-1].transpose(2, 0, 1)[None]
+    return np.ascontiguousarray(blob, dtype=np.float32) / 255.0
+
+
+def _make_calibration_reader(onnx_path, calibration_dir, imgsz, max_images):
+    from onnxruntime.quantization import CalibrationDataReader
+    import onnxruntime as ort
+
+    input_name = ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+    image_paths = list_images(calibration_dir, max_images)
+    if not image_paths:
+        raise FileNotFoundError(f"校准目录中没有图像: {calibration_dir}")
+
+    class SkyImageCalibrationReader(CalibrationDataReader):
+        """逐张读取校准图像，避免一次性占用大量内存"""
+
+        def __init__(self):
+            self.paths = iter(image_paths)
+
+        def get_next(self):
+            for path in self.paths:
+                image = cv2.imread(path, cv2.IMREAD_COLOR)
+                if image is not None:
+                    return {input_name: image_to_blob(image, imgsz)}
+            return None
+
+    print(f"校准图像: {len(image_paths)} 张 ({calibration_dir})")
+    return SkyImageCalibrationReader()
+
+
+def quantize_onnx_model(onnx_path, int8_path=None, calibration_dir=None, imgsz=416, max_images=100):
+    """量化ONNX模型
+
+    提供 calibration_dir 时做静态量化 (QDQ, 逐通道权重, 用样本图像校准激活范围)，
+    否则做动态量化 (只量化权重，激活在推理时动态计算范围)
+    """
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_dynamic, quantize_static
+
+    int8_path = int8_path or int8_path_for(onnx_path)
+    started = time.perf_counter()
+
+    # 只量化卷积，检测头里的 Concat / Sigmoid / 坐标解码保持FP32以保证精度
+    if calibration_dir:
+        reader = _make_calibration_reader(onnx_path, calibration_dir, imgsz, max_images)
+        quantize_static(onnx_path, int8_path, calibration_data_reader=reader,
+                        quant_format=QuantFormat.QDQ, op_types_to_quantize=['Conv'],
+                        per_channel=True, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+        mode = 'static'
+    else:
+        # ConvInteger 在CPU上只支持 uint8 权重
+        quantize_dynamic(onnx_path, int8_path, op_types_to_quantize=['Conv'], weight_type=QuantType.QUInt8)
+        mode = 'dynamic'
+
+    _copy_metadata(onnx_path, int8_path)
+    with open(fingerprint_path_for(int8_path), 'w', encoding='utf-8') as f:
+        json.dump(quantization_fingerprint(onnx_path, calibration_dir, imgsz, max_images), f, indent=2)
+    print(f"INT8量化完成 ({mode}): {int8_path}, 耗时 {time.perf_counter() - started:.1f}s")
+    return int8_path
+
+
+def quantization_fingerprint(onnx_path, calibration_dir=None, imgsz=416, max_images=100):
+    """INT8模型的缓存键: FP32模型的大小/修改时间 + 量化方式；静态量化另含输入尺寸、校准图像数上限
+    和校准图像集合 (相对路径、大小、修改时间) 的哈希
+    """
+    stat = os.stat(onnx_path)
+    fingerprint = {
+        'source': {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns},
+        'mode': 'static' if calibration_dir else 'dynamic',
+    }
+    if calibration_dir:
+        paths = list_images(calibration_dir, max_images)
+        digest = hashlib.sha256()
+        for path in paths:
+            image_stat = os.stat(path)
+            digest.update(f"{os.path.relpath(path, calibration_dir)}|{image_stat.st_size}|"
+                          f"{image_stat.st_mtime_ns}\n".encode('utf-8'))
+        fingerprint.update({
+            'imgsz': int(imgsz),
+            'max_images': max_images,
+            'calibration_images': len(paths),
+            'calibration_sha256': digest.hexdigest(),
+        })
+    return fingerprint
+
+
+def _read_fingerprint(int8_path):
+    try:
+        with open(fingerprint_path_for(int8_path), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _copy_metadata(src_path, dst_path):
+    """量化不会保留ultralytics写入的 names / imgsz 等元数据，从FP32模型复制过来"""
+    import onnx
+
+    src = onnx.load(src_path, load_external_data=False)
+    dst = onnx.load(dst_path)
+    existing = {prop.key for prop in dst.metadata_props}
+    for prop in src.metadata_props:
+        if prop.key not in existing:
+            dst.metadata_props.add(key=prop.key, value=prop.value)
+    onnx.save(dst, dst_path)
+
+
+def ensure_int8_model(onnx_path, calibration_dir=None, imgsz=416, max_images=100):
+    """返回可用的INT8模型路径，不存在或与当前的FP32模型、校准图像、量化参数不一致时重新量化
+
+    未指定校准目录时只要求FP32模型一致，沿用已有的量化结果 (通常是本地用样本图像静态量化后随镜像部署的)
+    """
+    int8_path = int8_path_for(onnx_path)
+    if os.path.exists(int8_path):
+        stored = _read_fingerprint(int8_path)
+        if stored is None:
+            # 没有记录的旧版量化结果：无法确认校准输入，只在未指定校准目录时按修改时间沿用
+            fresh = not calibration_dir and os.path.getmtime(int8_path) >= os.path.getmtime(onnx_path)
+        else:
+            current = quantization_fingerprint(onnx_path, calibration_dir, imgsz, max_images)
+            fresh = stored == current if calibration_dir else stored.get('source') == current['source']
+        if fresh:
+            return int8_path
+        print(f"INT8模型与当前的FP32模型或量化参数不一致，重新量化: {int8_path}")
+    return quantize_onnx_model(onnx_path, int8_path, calibration_dir, imgsz, max_images)
+
+
+def peak_rss_mb():
+    """当前进程的峰值RSS (MB)
+
+    优先读 /proc/self/status 的 VmHWM：ru_maxrss 会跨 exec 继承父进程的峰值，
+    父进程导出模型时加载过torch会让子进程的读数失真
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    # Linux 上 ru_maxrss 单位为KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _benchmark_in_process(model_path, image_paths, imgsz, runs):
+    """在当前进程中加载模型并测量延迟与峰值RSS"""
+    from inference_backends import OnnxRuntimeBackend
+
+    load_started = time.perf_counter()
+    backend = OnnxRuntimeBackend(model_path, imgsz=imgsz)
+    load_ms = (time.perf_counter() - load_started) * 1000
+
+    images = [cv2.imread(path, cv2.IMREAD_COLOR) for path in image_paths]
+    images = [image for image in images if image is not None]
+    if not images:
+        rng = np.random.default_rng(0)
+        images = [(rng.random((imgsz, imgsz, 3)) * 255).astype(np.uint8)]
+
+    backend.predict([images[0]], 0.25, 0.45, imgsz=imgsz)  # 预热
+    latencies = []
+    for i in range(runs):
+        started = time.perf_counter()
+        backend.predict([images[i % len(images)]], 0.25, 0.45, imgsz=imgsz)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    return {
+        'model_path': model_path,
+        'model_size_mb': round(os.path.getsize(model_path) / (1024 * 1024), 2),
+        'load_ms': round(load_ms, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'latency_ms_mean': round(float(np.mean(latencies)), 2),
+        'latency_ms_p50': round(float(np.percentile(latencies, 50)), 2),
+        'latency_ms_p95': round(float(np.percentile(latencies, 95)), 2),
+        'runs': runs
+    }
+
+
+def benchmark_model(model_path, image_dir=None, imgsz=416, runs=20):
+    """在独立子进程中测量单个模型，保证峰值RSS互不影响"""
+    cmd = [sys.executable, os.path.abspath(__file__), '--bench-one', model_path,
+           '--imgsz', str(imgsz), '--runs', str(runs)]
+    if image_dir:
+        cmd += ['--calib-dir', image_dir]
+    output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='YOLO模型INT8量化与FP32对比')
+    parser.add_argument('--model', default=os.getenv('MODEL_PATH', '/app/models/best.pt'), help='.pt 或 .onnx 模型路径')
+    parser.add_argument('--calib-dir', default=os.getenv('QUANT_CALIB_DIR'), help='校准/测速用的天空样本图像目录')
+    parser.add_argument('--mode', choices=['static', 'dynamic'], default=None, help='量化方式，默认有校准目录时为static')
+    parser.add_argument('--imgsz', type=int, default=416, help='校准与测速的输入尺寸')
+    parser.add_argument('--max-images', type=int, default=100, help='最多使用的校准图像数')
+    parser.add_argument('--runs', type=int, default=20, help='每个模型的测速次数')
+    parser.add_argument('--report', default=None, help='对比结果JSON输出路径')
+    parser.add_argument('--bench-one', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.bench_one:
+        image_paths = list_images(args.calib_dir, 20) if args.calib_dir else []
+        print(json.dumps(_benchmark_in_process(args.bench_one, image_paths, args.imgsz, args.runs)))
+        return
+
+    from inference_backends import ensure_onnx_export
+
+    onnx_path = ensure_onnx_export(args.model, args.imgsz) if args.model.endswith('.pt') else args.model
+    calibration_dir = None if args.mode == 'dynamic' else args.calib_dir
+    if args.mode == 'static' and not calibration_dir:
+        parser.error('静态量化需要 --calib-dir')
+
+    int8_path = quantize_onnx_model(onnx_path, calibration_dir=calibration_dir,
+                                    imgsz=args.imgsz, max_images=args.max_images)
+
+    print("\n=== FP32 vs INT8 ===")
+    fp32 = benchmark_model(onnx_path, args.calib_dir, args.imgsz, args.runs)
+    int8 = benchmark_model(int8_path, args.calib_dir, args.imgsz, args.runs)
+    for key in ('model_size_mb', 'load_ms', 'peak_rss_mb', 'latency_ms_mean', 'latency_ms_p50', 'latency_ms_p95'):
+        print(f"{key:>16}: FP32 {fp32[key]:>9}  INT8 {int8[key]:>9}")
+
+    report = {
+        'mode': 'static' if calibration_dir else 'dynamic',
+        'imgsz': args.imgsz,
+        'fp32': fp32,
+        'int8': int8
+    }
+    report_path = args.report or os.path.splitext(int8_path)[0] + '.report.json'
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\n对比结果已保存到: {report_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+CPU / 内存感知的 worker 与线程规划
+gunicorn.conf.py 在启动时读取容器的 cgroup CPU配额、内存上限和模型的内存占用，决定：
+
+    workers            gunicorn worker 进程数
+    inference_threads  每个worker的 torch intra-op / ONNX Runtime 线程数 (INFERENCE_THREADS)
+    opencv_threads     每个worker的 OpenCV 线程数
+
+默认规则: 可用核数 = min(CPU亲和性, ceil(cgroup配额))，workers 取 核数/2 (至少1) 且不超过内存能容纳的个数，
+线程数 = 核数 / workers，workers x 线程数 不超过可用核数，1 vCPU 的实例为 1 x 1。
+WEB_CONCURRENCY / INFERENCE_THREADS / OPENCV_THREADS 已设置时优先使用。
+
+gunicorn.conf.py 在导入应用之前调用本模块，线程数环境变量必须在 numpy / torch 加载前设置，
+因此这里只使用标准库，不导入其它应用模块。
+
+自测模式在当前机器上用真实模型逐个尝试候选配置，把吞吐最高的一组写入 RESOURCE_PLAN_FILE，之后启动直接采用
+(CPU数或内存上限与测试时不同则忽略)：
+
+    python resource_plan.py                         # 打印当前会采用的规划
+    python resource_plan.py --benchmark --app app_minimal --model models/best.pt
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+RESOURCE_PLAN_FILE = os.getenv('RESOURCE_PLAN_FILE') or os.path.join(
+    os.path.dirname(os.getenv('MODEL_PATH', '/app/models/best.pt')), 'resource_plan.json')
+MEMORY_HEADROOM = 0.8  # 只按内存上限的80%规划，留给请求中的图像与分配器碎片
+
+# 没有实测值时每个worker的内存估算: 推理运行时本身 + 模型文件大小的倍数 (权重、计算图与中间激活)
+_RUNTIME_MEMORY_MB = {'ultralytics': 300, 'onnxruntime': 120}
+_MODEL_MEMORY_FACTOR = 4
+
+_CGROUP_LIMIT_FILES = ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes')
+_CPU_QUOTA_FILES = (
+    ('/sys/fs/cgroup/cpu.max', None),                                           # cgroup v2: "quota period"
+    ('/sys/fs/cgroup/cpu/cpu.cfs_quota_us', '/sys/fs/cgroup/cpu/cpu.cfs_period_us'),  # cgroup v1
+)
+
+
+def cgroup_cpu_quota():
+    """cgroup 的CPU配额 (核数，可为小数)，没有限制时返回None"""
+    for quota_path, period_path in _CPU_QUOTA_FILES:
+        try:
+            with open(quota_path) as f:
+                fields = f.read().split()
+            if period_path is not None:
+                with open(period_path) as f:
+                    fields.append(f.read().strip())
+        except OSError:
+            continue
+        if len(fields) < 2 or fields[0] in ('max', '-1'):
+            return None
+        try:
+            return int(fields[0]) / int(fields[1])
+        except (ValueError, ZeroDivisionError):
+            return None
+    return None
+
+
+def available_cpus():
+    """可用核数: CPU亲和性与 cgroup 配额 (向上取整) 中较小的一个"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = cgroup_cpu_quota()
+    if quota:
+        cpus = min(cpus, math.ceil(quota))
+    return max(1, cpus)
+
+
+def container_memory_limit():
+    """cgroup v2 / v1 的内存上限 (字节)，没有限制时返回None"""
+    for path in _CGROUP_LIMIT_FILES:
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # v1 未设置上限时是一个接近 2^63 的数
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    return None
+
+
+def memory_limit():
+    """容器内存上限 (字节)，没有 cgroup 限制时为物理内存"""
+    return container_memory_limit() or os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def estimate_worker_memory(model_path=None, backend_name=None):
+    """每个worker的内存估算 (字节)；MODEL_MEMORY_MB 环境变量优先"""
+    if os.getenv('MODEL_MEMORY_MB'):
+        return int(float(os.getenv('MODEL_MEMORY_MB')) * 1024 * 1024)
+    model_path = model_path or os.getenv('MODEL_PATH', '/app/models/best.pt')
+    # 与 inference_backends.default_backend_name() / onnx_path_for() 相同，不在这里导入推理模块
+    fast_start = os.getenv('FAST_START', '0') == '1'
+    backend_name = backend_name or os.getenv('INFERENCE_BACKEND') or ('onnxruntime' if fast_start else 'ultralytics')
+    onnx_path = os.path.splitext(model_path)[0] + '.onnx'
+    if backend_name == 'onnxruntime' and os.path.exists(onnx_path):
+        model_path = onnx_path
+    model_mb = os.path.getsize(model_path) / 1024 / 1024 if os.path.exists(model_path) else 25
+    runtime_mb = _RUNTIME_MEMORY_MB.get(backend_name, 300)
+    return int((runtime_mb + model_mb * _MODEL_MEMORY_FACTOR) * 1024 * 1024)
+
+
+def machine_fingerprint(cpus=None, memory_bytes=None):
+    """规划文件适用的机器条件：CPU数与内存上限相同才复用自测结果"""
+    return {
+        'cpus': cpus or available_cpus(),
+        'memory_mb': int((memory_bytes or memory_limit()) / 1024 / 1024),
+    }
+
+
+def load_saved_plan(path=RESOURCE_PLAN_FILE, fingerprint=None):
+    """读取自测保存的规划，机器条件不一致或文件不存在时返回None"""
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if saved.get('machine') != (fingerprint or machine_fingerprint()):
+        return None
+    return saved
+
+
+def candidate_configs(cpus, max_workers):
+    """候选的 (workers, threads)：workers x threads 不超过可用核数"""
+    configs = []
+    for workers in range(1, max(1, min(cpus, max_workers)) + 1):
+        threads = cpus // workers
+        if threads >= 1 and (workers, threads) not in configs:
+            configs.append((workers, threads))
+    return configs
+
+
+def plan_resources(cpus=None, memory_bytes=None, worker_memory_bytes=None, saved=None):
+    """返回规划 dict: workers, inference_threads, opencv_threads 以及依据"""
+    cpus = cpus or available_cpus()
+    memory_bytes = memory_bytes or memory_limit()
+    saved = saved if saved is not None else load_saved_plan(fingerprint=machine_fingerprint(cpus, memory_bytes))
+    if saved and saved.get('worker_memory_mb') and worker_memory_bytes is None and not os.getenv('MODEL_MEMORY_MB'):
+        worker_memory_bytes = int(saved['worker_memory_mb'] * 1024 * 1024)  # 自测时实测的单worker内存
+    worker_memory_bytes = worker_memory_bytes or estimate_worker_memory()
+    max_workers = max(1, int(memory_bytes * MEMORY_HEADROOM // worker_memory_bytes))
+
+    if saved and saved['workers'] <= max_workers:
+        workers, threads, source = saved['workers'], saved['inference_threads'], 'benchmark'
+    else:
+        workers = max(1, min(cpus // 2, max_workers))
+        threads = max(1, cpus // workers)
+        source = 'heuristic'
+
+    if os.getenv('WEB_CONCURRENCY'):
+        workers, source = int(os.getenv('WEB_CONCURRENCY')), 'env'
+        threads = max(1, cpus // workers)
+    if os.getenv('INFERENCE_THREADS'):
+        threads, source = int(os.getenv('INFERENCE_THREADS')), 'env'
+    # 请求的解码在各worker中并行，多worker时OpenCV不再开线程池
+    opencv_threads = int(os.getenv('OPENCV_THREADS') or (threads if workers == 1 else 1))
+
+    return {
+        'workers': workers,
+        'inference_threads': threads,
+        'opencv_threads': opencv_threads,
+        'source': source,
+        'cpus': cpus,
+        'cpu_quota': cgroup_cpu_quota(),
+        'memory_limit_mb': int(memory_bytes / 1024 / 1024),
+        'worker_memory_mb': int(worker_memory_bytes / 1024 / 1024),
+        'max_workers_by_memory': max_workers,
+    }
+
+
+def export_thread_env(plan):
+    """在导入 torch / onnxruntime / OpenCV 之前设置线程数环境变量 (已设置的不覆盖)"""
+    threads = str(plan['inference_threads'])
+    for name in ('INFERENCE_THREADS', 'OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ.setdefault(name, threads)
+    os.environ.setdefault('OPENCV_THREADS', str(plan['opencv_threads']))
+
+
+def apply_opencv_threads():
+    """在worker中设置OpenCV线程数 (OPENCV_THREADS)"""
+    value = os.getenv('OPENCV_THREADS')
+    cv2 = sys.modules.get('cv2')
+    if value and cv2 is not None:
+        cv2.setNumThreads(int(value))
+
+
+# ---------------------------------------------------------------- 自测
+
+def _benchmark_worker(app_module, model_path, threads, seconds, image_size, ready, start_event, results):
+    """自测子进程: 按给定线程数加载一份检测器，与其它子进程同时开始，持续检测 seconds 秒"""
+    for name in ('INFERENCE_THREADS', 'OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[name] = str(threads)
+    os.environ['MICRO_BATCH'] = '0'
+    os.environ['RESULT_CACHE_MB'] = '0'
+    sys.stdout = open(os.devnull, 'w')
+
+    import importlib
+
+    import numpy as np
+
+    from metrics import process_rss_bytes
+
+    try:
+        rss_before = process_rss_bytes() or 0
+        module = importlib.import_module(app_module)
+        detector = module.init_detector(model_path)
+        if not getattr(detector, 'model_loaded', True):
+            raise RuntimeError(detector.load_error)
+        memory = (process_rss_bytes() or 0) - rss_before
+    except Exception as e:
+        ready.put(f'{type(e).__name__}: {e}')
+        return
+    ready.put(None)
+
+    image = np.random.default_rng(os.getpid()).integers(0, 255, (image_size[1], image_size[0], 3), dtype=np.uint8)
+    latencies = []
+    start_event.wait()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        detector.detect(image, 0.5, 0.4)
+        latencies.append(time.perf_counter() - started)
+    memory = max(memory, (process_rss_bytes() or 0) - rss_before)
+    results.put({'count': len(latencies), 'latencies': latencies, 'memory': memory})
+
+
+def benchmark_config(app_module, model_path, workers, threads, seconds=10.0, image_size=(1280, 960),
+                     load_timeout=600):
+    """同时启动 workers 个子进程各跑一份检测器，返回吞吐、延迟与单进程内存
+
+    所有子进程加载并预热完模型后才同时开始计时，加载时间不计入
+    """
+    import multiprocessing
+
+    context = multiprocessing.get_context('spawn')  # 子进程在导入推理库之前设置线程数
+    ready, results, start_event = context.Queue(), context.Queue(), context.Event()
+    processes = [context.Process(target=_benchmark_worker, daemon=True,
+                                 args=(app_module, model_path, threads, seconds, image_size, ready, start_event,
+                                       results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        for _ in processes:
+            error = ready.get(timeout=load_timeout)
+            if error is not None:
+                raise RuntimeError(f'自测子进程加载模型失败: {error}')
+        start_event.set()
+        outputs = [results.get(timeout=seconds + 60) for _ in processes]
+    finally:
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+    latencies = sorted(latency for output in outputs for latency in output['latencies'])
+    count = sum(output['count'] for output in outputs)
+    return {
+        'workers': workers,
+        'inference_threads': threads,
+        'images_per_second': round(count / seconds, 2),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+        'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1) if latencies else None,
+        'worker_memory_mb': round(max(output['memory'] for output in outputs) / 1024 / 1024, 1),
+    }
+
+
+def run_self_benchmark(app_module, model_path, seconds=10.0, image_size=(1280, 960), output=RESOURCE_PLAN_FILE):
+    """逐个尝试候选配置，把吞吐最高的一组 (吞吐相差5%以内取p95更低的) 写入 output"""
+    cpus = available_cpus()
+    memory_bytes = memory_limit()
+    # 先用单worker实测内存占用，再据此确定内存能容纳的最大worker数
+    first = benchmark_config(app_module, model_path, 1, cpus, seconds, image_size)
+    print(json.dumps(first, ensure_ascii=False))
+    worker_memory = max(first['worker_memory_mb'], 1) * 1024 * 1024
+    max_workers = max(1, int(memory_bytes * MEMORY_HEADROOM // worker_memory))
+
+    results = [first]
+    for workers, threads in candidate_configs(cpus, max_workers):
+        if (workers, threads) == (1, cpus):
+            continue
+        try:
+            result = benchmark_config(app_module, model_path, workers, threads, seconds, image_size)
+        except Exception as e:
+            print(f"{workers} x {threads} 失败: {e}")
+            continue
+        print(json.dumps(result, ensure_ascii=False))
+        results.append(result)
+
+    top = max(result['images_per_second'] for result in results)
+    best = min((result for result in results if result['images_per_second'] >= top * 0.95),
+               key=lambda result: result['p95_ms'] or float('inf'))
+    saved = {
+        'workers': best['workers'],
+        'inference_threads': best['inference_threads'],
+        'worker_memory_mb': max(result['worker_memory_mb'] for result in results),
+        'machine': machine_fingerprint(cpus, memory_bytes),
+        'app': app_module,
+        'model_path': model_path,
+        'image_size': list(image_size),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    with open(output, 'w') as f:
+        json.dump(saved, f, ensure_ascii=False, indent=2)
+    return saved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='worker 与线程数规划')
+    parser.add_argument('--benchmark', action='store_true', help='在本机用真实模型自测候选配置并保存最快的一组')
+    parser.add_argument('--app', default=os.getenv('ASGI_APP_MODULE', 'app'), help='应用模块 (app / app_minimal / app_pytorch)')
+    parser.add_argument('--model', default=os.getenv('MODEL_PATH', '/app/models/best.pt'), help='模型路径')
+    parser.add_argument('--seconds', type=float, default=10.0, help='每个配置的测试时长 (秒)')
+    parser.add_argument('--image-size', default='1280x960', help='测试图像尺寸 WxH')
+    parser.add_argument('--output', default=RESOURCE_PLAN_FILE, help='规划文件')
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        width, height = (int(value) for value in args.image_size.lower().split('x'))
+        saved = run_self_benchmark(args.app, args.model, args.seconds, (width, height), args.output)
+        print(f"已保存 {args.output}: {saved['workers']} workers x {saved['inference_threads']} 线程")
+    print(json.dumps(plan_resources(saved=load_saved_plan(args.output)), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""
+检测结果缓存
+以上传图像原始字节的哈希 + 检测参数 + 模型文件标识作为键，
+LRU淘汰，支持TTL过期与总字节数上限；
+SingleFlight 用同一个键合并同时在途的相同请求，只推理一次
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def file_identity(path):
+    """模型文件标识: 绝对路径 + 大小 + 修改时间，替换权重文件后缓存自动失效"""
+    try:
+        stat = os.stat(path)
+        return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    except OSError:
+        return os.path.abspath(path)
+
+
+def estimate_result_bytes(predictions):
+    """估算缓存结果占用的内存 (按检测框数量线性估算，避免为计算大小再序列化一次)"""
+    if isinstance(predictions, dict):
+        count = len(predictions.get('confidence', []))
+        return 256 + count * 120
+    return 256 + len(predictions) * 400
+
+
+class DetectionCache:
+    def __init__(self, max_bytes, ttl_seconds=300, max_entries=10000):
+        self.max_bytes = int(max_bytes)
+        self.ttl = float(ttl_seconds)
+        self.max_entries = int(max_entries)
+        self._entries = OrderedDict()  # key -> (expires_at, size, predictions)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(image_bytes, conf_threshold, nms_threshold, model_identity, **options):
+        """缓存键: sha256(原始字节) + 阈值 + 模型标识 + 其它影响结果的选项"""
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        extra = ','.join(f'{k}={v}' for k, v in sorted(options.items()))
+        return f"{digest}|{float(conf_threshold):.6g}|{float(nms_threshold):.6g}|{model_identity}|{extra}"
+
+    def get(self, key):
+        """命中返回缓存的预测结果，未命中或已过期返回None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, size, predictions = entry
+            if expires_at <= now:
+                self._remove(key, size)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return predictions
+
+    def put(self, key, predictions):
+        size = estimate_result_bytes(predictions)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (time.monotonic() + self.ttl, size, predictions)
+            self.current_bytes += size
+            # 超出字节预算或条目上限时从最久未使用的一端淘汰
+            while self._entries and (self.current_bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                _, (_, old_size, _) = self._entries.popitem(last=False)
+                self.current_bytes -= old_size
+                self.evictions += 1
+
+    def _remove(self, key, size):
+        del self._entries[key]
+        self.current_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+class _Call:
+    __slots__ = ('event', 'value', 'error', 'waiters', 'elapsed')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        self.waiters = 0
+        self.elapsed = 0.0
+
+
+class SingleFlight:
+    """合并相同键的并发调用: 第一个调用执行 fn()，执行期间到达的相同调用等待并共享其结果 (或异常)
+
+    与结果缓存使用相同的键；只合并同一进程内同时在途的请求，完成后不保留结果 (由缓存负责)
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+        self.max_waiters = 0
+        self.saved_seconds = 0.0  # 合并的请求省去的执行时间 (按领头请求的耗时估算)
+
+    def do(self, key, fn):
+        """返回 (结果, saved_seconds)
+
+        saved_seconds 为None表示本次调用自己执行了 fn()；否则共享了领头请求的结果，值为领头请求的执行耗时 (省去的时间)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+            else:
+                call.waiters += 1
+                self.followers += 1
+                self.max_waiters = max(self.max_waiters, call.waiters)
+                leader = False
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, call.elapsed
+
+        started = time.perf_counter()
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            call.elapsed = time.perf_counter() - started
+            with self._lock:
+                del self._calls[key]
+                self.saved_seconds += call.elapsed * call.waiters
+            call.event.set()
+        return call.value, None
+
+    def stats(self):
+        with self._lock:
+            calls = self.leaders + self.followers
+            return {
+                'in_flight': len(self._calls),
+                'executed': self.leaders,
+                'coalesced': self.followers,
+                'coalesced_rate': round(self.followers / calls, 4) if calls else 0,
+                'max_waiters': self.max_waiters,
+                'saved_ms_total': round(self.saved_seconds * 1000, 1),
+            }
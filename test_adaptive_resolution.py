@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""ResolutionController 延迟降级/回升的单元测试 (python -m pytest test_adaptive_resolution.py)"""
+
+import types
+
+import pytest
+
+import adaptive_resolution
+from adaptive_resolution import ResolutionController
+
+
+@pytest.fixture(autouse=True)
+def fake_clock(monkeypatch):
+    # 每次读取时钟前进2秒，超过1秒的统计窗口：窗口内只有最新一个样本，p95 即为本次延迟
+    clock = {'now': 0.0}
+
+    def monotonic():
+        clock['now'] += 2
+        return clock['now']
+
+    monkeypatch.setattr(adaptive_resolution, 'time', types.SimpleNamespace(monotonic=monotonic,
+                                                                           perf_counter=monotonic))
+
+
+def make_controller():
+    return ResolutionController(sizes=[640, 512, 416, 320], target_p95_ms=100, capacity=1,
+                                queue_step=1, window=1, cooldown=0, enabled=True)
+
+
+def drive(controller, top, latencies):
+    """按给定延迟依次完成请求，返回每个请求使用的尺寸和完成后的 latency_level"""
+    sizes, levels = [], []
+    for latency_ms in latencies:
+        sizes.append(controller._begin(top, None, True))
+        controller._end(top, latency_ms, True)
+        levels.append(controller.latency_level)
+    return sizes, levels
+
+
+def test_levels_follow_p95_for_full_ladder():
+    controller = make_controller()
+    sizes, levels = drive(controller, 640, [500] * 5 + [10] * 5)
+    assert levels == [1, 2, 3, 3, 3, 2, 1, 0, 0, 0]
+    assert sizes == [640, 512, 416, 320, 320, 320, 416, 512, 640, 640]
+
+
+def test_levels_capped_by_served_ladder():
+    # 416 之下只有 320 一档，持续超时也只降一级，恢复时一次回升即回到 416
+    controller = make_controller()
+    sizes, levels = drive(controller, 416, [500] * 4 + [10] * 2)
+    assert levels == [1, 1, 1, 1, 0, 0]
+    assert sizes == [416, 320, 320, 320, 320, 416]
+
+
+def test_smaller_top_clamps_level_raised_by_larger_top():
+    controller = make_controller()
+    drive(controller, 640, [500] * 3)
+    assert controller.latency_level == 3
+    _, levels = drive(controller, 416, [10])
+    assert levels == [0]
@@ -0,0 +1,93 @@
+"""
+分块推理 (超大天空/卫星图像)
+把原图切成相互重叠的 tile_size 方块，按 tile_batch 张一批送入模型，
+各块的框平移回原图坐标后做一次全局按类别NMS
+
+峰值内存由 tile_batch × workers 个分块的输入张量决定，与原图尺寸无关；
+分块直接使用原图的切片视图，不复制原图
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import numpy as np
+
+from detection_utils import batched_nms
+
+
+def tile_windows(width, height, tile_size, overlap=0.2):
+    """计算分块窗口 [(x0, y0, x1, y1), ...]
+
+    相邻分块重叠 overlap 比例；最后一块贴齐图像边缘，保证所有分块都是完整的 tile_size
+    (图像某一边小于 tile_size 时该方向只有一块)
+    """
+    tile_size = int(tile_size)
+    step = max(1, int(tile_size * (1 - min(max(float(overlap), 0.0), 0.9))))
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, step))
+        positions.append(length - tile_size)
+        return positions
+
+    return [(x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+            for y0 in starts(height) for x0 in starts(width)]
+
+
+def run_tiled(backend, image, conf_threshold=0.5, nms_threshold=0.4, tile_size=640, overlap=0.2,
+              tile_batch=4, workers=1, lock=None, max_det=1000):
+    """分块检测整张图像
+
+    backend 为 inference_backends 中的推理后端；lock 非空时每次前向推理都持有该锁
+    (ultralytics predictor 非线程安全)，分块裁剪和后处理仍在多个线程中并行
+    返回 (xyxy, confidence, class_id, tile_info)，坐标为原图坐标
+    """
+    height, width = image.shape[:2]
+    windows = tile_windows(width, height, tile_size, overlap)
+    tile_batch = max(1, int(tile_batch))
+    batches = [windows[i:i + tile_batch] for i in range(0, len(windows), tile_batch)]
+    lock = lock or nullcontext()
+
+    def run_batch(batch_windows):
+        tiles = [image[y0:y1, x0:x1] for x0, y0, x1, y1 in batch_windows]
+        with lock:
+            outputs = backend.predict(tiles, conf_threshold, nms_threshold, imgsz=tile_size)
+        boxes, scores, classes = [], [], []
+        for (xyxy, confidences, class_ids), (x0, y0, _, _) in zip(outputs, batch_windows):
+            if len(xyxy):
+                boxes.append(np.asarray(xyxy, dtype=np.float32) + np.array([x0, y0, x0, y0], dtype=np.float32))
+                scores.append(confidences)
+                classes.append(class_ids)
+        return boxes, scores, classes
+
+    workers = max(1, min(int(workers), len(batches)))
+    if workers == 1:
+        results = [run_batch(batch) for batch in batches]
+    else:
+        # 线程池按批次流式处理，同一时刻最多 workers 批分块在内存中
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tile') as executor:
+            results = list(executor.map(run_batch, batches))
+
+    boxes = [b for result in results for b in result[0]]
+    tile_info = {'tiles': len(windows), 'tile_size': int(tile_size), 'tile_batches': len(batches),
+                 'workers': workers}
+    if not boxes:
+        empty = np.zeros((0, 4), dtype=np.float32)
+        return empty, np.zeros((0,), dtype=np.float32), np.zeros((0,), dtype=np.int64), tile_info
+
+    xyxy = np.concatenate(boxes)
+    confidences = np.concatenate([s for result in results for s in result[1]]).astype(np.float32)
+    class_ids = np.concatenate([c for result in results for c in result[2]]).astype(np.int64)
+
+    # 全局NMS合并重叠区域的重复框；类别偏移需大于图像尺寸，否则超大图像中不同类别的框会互相抑制
+    keep = batched_nms(xyxy, confidences, class_ids, nms_threshold, max_det=max_det,
+                       max_wh=max(width, height, 7680) + 1)
+    return xyxy[keep], confidences[keep], class_ids[keep], tile_info
+
+
+def default_tile_workers(limit=4):
+    """分块推理的默认线程数: CPU核数，最多 limit"""
+    return max(1, min(os.cpu_count() or 1, limit))
+
@@ -0,0 +1,165 @@
+"""
+二进制上传与紧凑响应格式
+
+上传: /detect 接受 Content-Type 为 application/octet-stream 或 image/* 的原始请求体，阈值等参数放在查询字符串中
+
+    POST /detect?conf_threshold=0.5&nms_threshold=0.4
+    Content-Type: image/jpeg
+
+请求体按 Content-Length 直接读入预先分配的 bytearray，解码时 np.frombuffer 不再复制；
+不再同时持有 JSON 字符串、Base64解码后的字节和解码后的图像，上传体积也比Base64小约25%
+
+响应: 按 Accept 头协商，默认仍为JSON
+    application/x-msgpack    MessagePack，检测框/置信度/类别为 little-endian float32/int32 打包数组 (需要安装 msgpack)
+    application/x-yolo-f32   纯二进制 N x 6 的 little-endian float32 数组 [x1, y1, x2, y2, confidence, class_id]，
+                             其它字段以JSON放在 X-Detection-Meta 响应头中
+"""
+
+import json
+import os
+
+import numpy as np
+
+RAW_UPLOAD_MAX_MB = float(os.getenv('RAW_UPLOAD_MAX_MB', 50))  # 原始请求体上限
+
+MSGPACK_MEDIA_TYPE = 'application/x-msgpack'
+PACKED_F32_MEDIA_TYPE = 'application/x-yolo-f32'
+PACKED_F32_COLUMNS = ('x1', 'y1', 'x2', 'y2', 'confidence', 'class_id')
+
+_FORMAT_MEDIA_TYPES = {
+    MSGPACK_MEDIA_TYPE: 'msgpack',
+    'application/msgpack': 'msgpack',
+    'application/vnd.msgpack': 'msgpack',
+    PACKED_F32_MEDIA_TYPE: 'f32',
+}
+
+
+def is_raw_upload(mimetype):
+    """Content-Type 为 application/octet-stream 或 image/* 时请求体就是图像本身"""
+    mimetype = (mimetype or '').split(';', 1)[0].strip().lower()
+    return mimetype == 'application/octet-stream' or mimetype.startswith('image/')
+
+
+def raw_upload_limit():
+    return int(RAW_UPLOAD_MAX_MB * 1024 * 1024)
+
+
+def read_raw_body(stream, content_length=None, max_bytes=None, chunk_size=1024 * 1024):
+    """把请求体读入 bytearray
+
+    有 Content-Length 时一次分配、readinto 直接写入；分块上传 (没有长度) 时逐块追加。
+    超过 max_bytes 或请求体不完整时抛出 ValueError
+    """
+    max_bytes = raw_upload_limit() if max_bytes is None else max_bytes
+    if content_length is not None:
+        if content_length > max_bytes:
+            raise ValueError(f'请求体超过上限: {content_length} > {max_bytes} 字节')
+        buffer = bytearray(content_length)
+        view = memoryview(buffer)
+        readinto = getattr(stream, 'readinto', None)
+        received = 0
+        while received < content_length:
+            if readinto is not None:
+                count = readinto(view[received:])
+            else:
+                chunk = stream.read(min(chunk_size, content_length - received))
+                count = len(chunk)
+                view[received:received + count] = chunk
+            if not count:
+                raise ValueError(f'请求体不完整: 收到 {received} / {content_length} 字节')
+            received += count
+        return buffer
+
+    buffer = bytearray()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return buffer
+        buffer += chunk
+        if len(buffer) > max_bytes:
+            raise ValueError(f'请求体超过上限: {max_bytes} 字节')
+
+
+def msgpack_available():
+    try:
+        import msgpack  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def accepted_format(accept):
+    """按 Accept 头选择响应格式: 'json' / 'msgpack' / 'f32'
+
+    按 q 值从高到低取第一个支持的类型；未安装 msgpack 时不提供 MessagePack
+    """
+    candidates = []
+    for position, item in enumerate((accept or '').split(',')):
+        parts = [part.strip() for part in item.split(';')]
+        media_type = parts[0].lower()
+        quality = 1.0
+        for param in parts[1:]:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if media_type and quality > 0:
+            candidates.append((-quality, position, media_type))
+
+    for _, _, media_type in sorted(candidates):
+        if media_type in ('application/json', '*/*', 'application/*'):
+            return 'json'
+        fmt = _FORMAT_MEDIA_TYPES.get(media_type)
+        if fmt == 'msgpack' and not msgpack_available():
+            continue
+        if fmt is not None:
+            return fmt
+    return 'json'
+
+
+def detection_arrays(predictions):
+    """行式或列式预测结果 -> (boxes float32 Nx4, confidences float32 N, class_ids int32 N)"""
+    if isinstance(predictions, dict):
+        boxes, confidences, class_ids = predictions['bbox'], predictions['confidence'], predictions['class_id']
+    else:
+        boxes = [p['bbox'] for p in predictions]
+        confidences = [p['confidence'] for p in predictions]
+        class_ids = [p['class_id'] for p in predictions]
+    return (np.asarray(boxes, dtype='<f4').reshape(-1, 4),
+            np.asarray(confidences, dtype='<f4').reshape(-1),
+            np.asarray(class_ids, dtype='<i4').reshape(-1))
+
+
+def encode_result(result, fmt, names=None):
+    """把 /detect 的响应字典编码为紧凑格式，返回 (body, content_type, headers)"""
+    boxes, confidences, class_ids = detection_arrays(result['predictions'])
+    meta = {key: value for key, value in result.items() if key != 'predictions'}
+    meta['format'] = 'packed'
+
+    if fmt == 'msgpack':
+        import msgpack
+
+        names = names or {}
+        meta.update({
+            'boxes': boxes.tobytes(),
+            'confidences': confidences.tobytes(),
+            'class_ids': class_ids.tobytes(),
+            # 字符串键 (与JSON的 model_classes 一致)：msgpack 1.0 起 unpackb 默认 strict_map_key=True，拒绝整数键
+            'class_names': {str(int(c)): names.get(int(c), f'class_{int(c)}') for c in np.unique(class_ids)}
+        })
+        return msgpack.packb(meta, use_bin_type=True), MSGPACK_MEDIA_TYPE, {}
+
+    if fmt == 'f32':
+        packed = np.empty((len(confidences), 6), dtype='<f4')
+        packed[:, :4] = boxes
+        packed[:, 4] = confidences
+        packed[:, 5] = class_ids
+        headers = {
+            'X-Total-Detections': str(len(confidences)),
+            'X-Detection-Columns': ','.join(PACKED_F32_COLUMNS),
+            'X-Detection-Meta': json.dumps(meta, separators=(',', ':'))  # ensure_ascii，响应头只能是ASCII
+        }
+        return packed.tobytes(), PACKED_F32_MEDIA_TYPE, headers
+
+    raise ValueError(f'未知的响应格式: {fmt}')